@@ -12,12 +12,15 @@ from .analyzer import run_forensics
 from .ela_scanner import run_ela
 from .metadata import extract_metadata
 from .noise_analysis import run_noise_analysis
+from .image_context import ImageContext, as_image_context
 
 __all__ = [
     'run_forensics',
     'run_ela',
     'extract_metadata',
     'run_noise_analysis',
+    'ImageContext',
+    'as_image_context',
 ]
 
 __version__ = '1.0.0'
@@ -9,47 +9,66 @@ Used by python-workers/analyze-image.py
 """
 
 import os
+import time
 import traceback
 
 try:
     from df.ela_scanner   import run_ela
     from df.metadata      import extract_metadata
     from df.noise_analysis import run_noise_analysis
+    from df.image_context  import as_image_context
 except ImportError:
     # Fallback for when called from a different working directory
     from ela_scanner    import run_ela
     from metadata       import extract_metadata
     from noise_analysis import run_noise_analysis
+    from image_context  import as_image_context
 
 
-def run_forensics(image_path: str) -> dict:
+# Checks run by run_forensics(), in report order
+FORENSIC_CHECKS = {
+    "ela"     : run_ela,
+    "metadata": extract_metadata,
+    "noise"   : run_noise_analysis,
+}
+
+
+def run_forensics(image_path, executor=None, timings=None) -> dict:
     """
     Run all forensic checks on a single image.
 
+    `image_path` may be a file path or an ImageContext; the image is
+    decoded once and shared by every check.
+
+    If `executor` (a concurrent.futures executor) is given, the checks
+    run as independent tasks on it and are joined before returning.
+    If `timings` is a dict, each check's wall time is stored in it as
+    "<name>_ms".
+
     Returns a dict with keys:
         ela, metadata, noise,
         forensic_flags (int 0-3),
         forensic_verdict (str)
     """
     result = {}
-
-    # ── ELA ──────────────────────────────────────────────────────────
     try:
-        result["ela"] = run_ela(image_path)
-    except Exception as e:
-        result["ela"] = {"error": str(e), "suspicious": None}
+        image = as_image_context(image_path)
+    except Exception:
+        # Undecodable input — let each check record the failure itself
+        image = image_path
 
-    # ── Metadata ─────────────────────────────────────────────────────
-    try:
-        result["metadata"] = extract_metadata(image_path)
-    except Exception as e:
-        result["metadata"] = {"error": str(e), "suspicious": None}
+    if executor is None:
+        outcomes = {name: _run_check(check, image)
+                    for name, check in FORENSIC_CHECKS.items()}
+    else:
+        futures  = {name: executor.submit(_run_check, check, image)
+                    for name, check in FORENSIC_CHECKS.items()}
+        outcomes = {name: f.result() for name, f in futures.items()}
 
-    # ── Noise ────────────────────────────────────────────────────────
-    try:
-        result["noise"] = run_noise_analysis(image_path)
-    except Exception as e:
-        result["noise"] = {"error": str(e), "suspicious": None}
+    for name, (check_result, elapsed_ms) in outcomes.items():
+        result[name] = check_result
+        if timings is not None:
+            timings[f"{name}_ms"] = elapsed_ms
 
     # ── Aggregate verdict ────────────────────────────────────────────
     flags = sum([
@@ -69,3 +88,13 @@ def run_forensics(image_path: str) -> dict:
         result["forensic_verdict"] = "Highly suspicious"
 
     return result
+
+
+def _run_check(check, image):
+    """Run one check, turning exceptions into an error entry. Returns (result, ms)."""
+    start = time.perf_counter()
+    try:
+        check_result = check(image)
+    except Exception as e:
+        check_result = {"error": str(e), "suspicious": None}
+    return check_result, round((time.perf_counter() - start) * 1000, 2)
@@ -8,21 +8,76 @@ pixel-level difference between the original and re-compressed version.
 
 AI-generated or manipulated images often show non-uniform ELA
 (some regions edited at different compression levels than others).
+
+Two modes:
+    full   re-encode the whole frame and reduce a float32 diff array
+           (the original implementation; ~12 bytes/pixel extra memory)
+    tiled  re-encode horizontal bands and fold each band's integer
+           diff into a 256-bin histogram, from which mean/std/max are
+           exact; extra memory depends only on width × band height
+Large images use tiled mode by default (see TILED_MIN_PIXELS).
+
+Optionally (regions=True, or MAD_ELA_REGIONS=1 for the worker) the
+diff is also reduced to a grid of cell_size×cell_size blocks with
+vectorised np.add.reduceat sums, giving a small PNG heatmap of the
+per-block error levels, the most suspicious blocks and a max/median
+block ratio that flags localised edits (a pasted total line) the
+global numbers average away.  The full per-block grids (thousands of
+values on a phone photo) are only included with grids=True, or
+MAD_ELA_GRIDS=1 for the worker.
 """
 
 import io
+import os
+import math
+import base64
 import numpy as np
 from PIL import Image, ImageChops, ImageEnhance
 
+try:
+    from df.image_context import as_image_context
+    from df.utils         import block_sums
+except ImportError:
+    from image_context import as_image_context
+    from utils         import block_sums
+
+
+# Images with more pixels than this use tiled ELA unless told otherwise
+TILED_MIN_PIXELS = 4_000_000
+
+# Band height for tiled mode.  Must be a multiple of 16 so every band
+# starts on a JPEG MCU boundary (4:2:0 chroma → 16×16 MCUs).
+DEFAULT_BAND_ROWS = 256
+
+# Extra rows encoded above/below each band and then discarded, so the
+# decoder's chroma upsampling sees the same neighbours as in full mode.
+_HALO_ROWS = 16
+
+# Regional ELA defaults
+DEFAULT_CELL_SIZE   = 32
+DEFAULT_TOP_BLOCKS  = 5
+_HEATMAP_MAX_SIDE   = 128      # longest side of the heatmap PNG, in cells/pixels
+
 
-def run_ela(image_path: str, quality: int = 95) -> dict:
+def run_ela(image_path, quality: int = 95, tiled: bool | None = None,
+            band_rows: int = DEFAULT_BAND_ROWS, regions: bool | None = None,
+            cell_size: int = DEFAULT_CELL_SIZE, grids: bool | None = None) -> dict:
     """
     Run ELA on a single image.
 
     Parameters
     ----------
-    image_path : str  — absolute path to the image
+    image_path : str | ImageContext — absolute path or a decoded context
     quality    : int  — JPEG re-compression quality (default 95)
+    tiled      : bool | None — force tiled (True) or full-frame (False)
+                 mode; None picks tiled for images above TILED_MIN_PIXELS
+    band_rows  : int  — rows per band in tiled mode (multiple of 16);
+                 with regions, rounded to a multiple of cell_size too
+    regions    : bool | None — also return the block grid / heatmap;
+                 None reads MAD_ELA_REGIONS ("1" = on)
+    cell_size  : int  — block size in pixels for the regional grid
+    grids      : bool | None — include the full per-block grids in
+                 `regions`; None reads MAD_ELA_GRIDS ("1" = on)
 
     Returns
     -------
@@ -32,31 +87,202 @@ def run_ela(image_path: str, quality: int = 95) -> dict:
         std         float  — standard deviation of differences
         suspicious  bool   — True if std > 8.0 (heuristic threshold)
         quality     int    — JPEG quality used
+        mode        str    — "full" or "tiled"
+        regions     dict   — only with regions=True:
+            cell              int    — block size in pixels
+            rows, cols        int    — grid shape
+            heatmap_png       str    — base64 PNG, one pixel per block
+                                       (downsampled if the grid is large)
+            block_ratio       float  — max / median block mean
+                                       (localised suspicion score)
+            top_blocks        list   — the DEFAULT_TOP_BLOCKS blocks with
+                                       the highest mean: {row, col, mean, std}
+            mean_grid         list   — only with grids: per-block mean
+            std_grid          list   — only with grids: per-block std
     """
-    original = Image.open(image_path).convert("RGB")
+    original = as_image_context(image_path).rgb
 
-    # Re-compress to a buffer at the given quality
-    buf = io.BytesIO()
-    original.save(buf, format="JPEG", quality=quality)
-    buf.seek(0)
-    recompressed = Image.open(buf).convert("RGB")
+    if tiled is None:
+        tiled = original.width * original.height > TILED_MIN_PIXELS
+    if regions is None:
+        regions = os.environ.get("MAD_ELA_REGIONS") == "1"
+    if grids is None:
+        grids = os.environ.get("MAD_ELA_GRIDS") == "1"
 
-    # Pixel-level absolute difference
-    diff     = ImageChops.difference(original, recompressed)
-    diff_arr = np.array(diff, dtype=np.float32)
+    blocks = _BlockGrid(original.size, cell_size) if regions else None
 
-    ela_mean = float(np.mean(diff_arr))
-    ela_max  = float(np.max(diff_arr))
-    ela_std  = float(np.std(diff_arr))
+    if tiled:
+        if blocks is not None and band_rows % cell_size:
+            # Bands must start on a cell boundary and on a JPEG MCU row
+            step      = math.lcm(16, cell_size)
+            band_rows = max(step, band_rows // step * step)
+        ela_mean, ela_max, ela_std = _ela_tiled(original, quality, band_rows, blocks)
+    else:
+        ela_mean, ela_max, ela_std = _ela_full(original, quality, blocks)
 
     # Heuristic: real screenshots tend to have uniform ELA (low std).
     # AI-generated or edited images often have patchwork ELA (high std).
     suspicious = ela_std > 8.0
 
-    return {
+    result = {
         "mean"      : round(ela_mean, 3),
         "max"       : round(ela_max,  3),
         "std"       : round(ela_std,  3),
         "suspicious": suspicious,
         "quality"   : quality,
+        "mode"      : "tiled" if tiled else "full",
     }
+    if blocks is not None:
+        result["regions"] = blocks.summary(grids)
+    return result
+
+
+def _ela_full(original, quality, blocks=None):
+    # Re-compress to a buffer at the given quality
+    buf = io.BytesIO()
+    original.save(buf, format="JPEG", quality=quality)
+    buf.seek(0)
+    recompressed = Image.open(buf).convert("RGB")
+
+    # Pixel-level absolute difference
+    diff     = ImageChops.difference(original, recompressed)
+    diff_arr = np.array(diff, dtype=np.float32)
+
+    if blocks is not None:
+        blocks.add_rows(np.asarray(diff), 0)
+
+    return (
+        float(np.mean(diff_arr)),
+        float(np.max(diff_arr)),
+        float(np.std(diff_arr)),
+    )
+
+
+def _ela_tiled(original, quality, band_rows, blocks=None):
+    """Band-by-band ELA; returns (mean, max, std) from one fused histogram."""
+    if band_rows <= 0 or band_rows % 16:
+        raise ValueError(f"band_rows must be a positive multiple of 16, got {band_rows}")
+
+    width, height = original.size
+    hist = np.zeros(256, dtype=np.int64)
+
+    for top in range(0, height, band_rows):
+        bottom = min(top + band_rows, height)
+        y0     = max(0, top - _HALO_ROWS)
+        y1     = min(height, bottom + _HALO_ROWS)
+
+        band = original.crop((0, y0, width, y1))
+        buf  = io.BytesIO()
+        band.save(buf, format="JPEG", quality=quality)
+        buf.seek(0)
+        recompressed = Image.open(buf).convert("RGB")
+
+        # uint8 |a - b| for the band's own rows only (halo dropped)
+        diff = np.asarray(ImageChops.difference(band, recompressed))
+        diff = diff[top - y0 : bottom - y0]
+        hist += np.bincount(diff.ravel(), minlength=256)
+        if blocks is not None:
+            blocks.add_rows(diff, top)
+
+    return _stats_from_histogram(hist)
+
+
+def _stats_from_histogram(hist):
+    """Exact (mean, max, std) of uint8 values given their 256-bin histogram."""
+    levels = np.arange(256, dtype=np.int64)
+    count  = int(hist.sum())
+    if count == 0:
+        return 0.0, 0.0, 0.0
+
+    total    = int(np.dot(hist, levels))
+    total_sq = int(np.dot(hist, levels * levels))
+    mean     = total / count
+    var      = max(total_sq / count - mean * mean, 0.0)
+    max_val  = float(np.flatnonzero(hist)[-1])
+
+    return mean, max_val, var ** 0.5
+
+
+class _BlockGrid:
+    """
+    Per-block sums of an ELA diff, filled band by band.
+
+    Bands must start on a cell boundary.  Edge blocks may be smaller
+    than cell_size; their statistics use their real pixel count.
+    """
+
+    def __init__(self, size, cell_size):
+        if cell_size <= 0:
+            raise ValueError(f"cell_size must be positive, got {cell_size}")
+        width, height = size
+        self.cell   = cell_size
+        self.rows   = -(-height // cell_size)
+        self.cols   = -(-width  // cell_size)
+        self.sum    = np.zeros((self.rows, self.cols), dtype=np.int64)
+        self.sum_sq = np.zeros((self.rows, self.cols), dtype=np.int64)
+
+        self.width  = width
+
+        col_widths  = np.diff(np.append(np.arange(0, width,  cell_size), width))
+        row_heights = np.diff(np.append(np.arange(0, height, cell_size), height))
+        self.count  = np.outer(row_heights, col_widths) * 3        # 3 channels
+
+        # Narrowest accumulator that cannot overflow: uint32 holds a
+        # block's squared sum up to ~148×148 cells, uint64 beyond that
+        peak        = cell_size * cell_size * 3 * 255 * 255
+        self.dtype  = np.uint32 if peak < 2 ** 32 else np.uint64
+
+    def add_rows(self, diff, top):
+        """Fold a (rows, W, 3) uint8 diff starting at image row `top` into the grid."""
+        flat    = diff.reshape(diff.shape[0], -1)              # (rows, W*3)
+        squares = np.square(flat, dtype=np.uint16)
+        first   = top // self.cell
+
+        for grid, values in ((self.sum, flat), (self.sum_sq, squares)):
+            cells = block_sums(values, self.cell, self.width, channels=3, dtype=self.dtype)
+            grid[first:first + cells.shape[0]] += cells.astype(np.int64)
+
+    def summary(self, grids=False, top=DEFAULT_TOP_BLOCKS):
+        mean = self.sum / self.count
+        var  = np.maximum(self.sum_sq / self.count - mean * mean, 0.0)
+        std  = np.sqrt(var)
+
+        median      = float(np.median(mean))
+        block_ratio = float(mean.max()) / median if median > 0 else None
+
+        order = np.argsort(-mean, axis=None, kind="stable")[:top]
+        out = {
+            "cell"       : self.cell,
+            "rows"       : self.rows,
+            "cols"       : self.cols,
+            "heatmap_png": _heatmap_png(mean),
+            "block_ratio": round(block_ratio, 3) if block_ratio is not None else None,
+            "top_blocks" : [
+                {"row": int(r), "col": int(c),
+                 "mean": round(float(mean[r, c]), 2), "std": round(float(std[r, c]), 2)}
+                for r, c in zip(*np.unravel_index(order, mean.shape))
+            ],
+        }
+        if grids:
+            out["mean_grid"] = np.round(mean, 2).tolist()
+            out["std_grid"]  = np.round(std,  2).tolist()
+        return out
+
+
+def _heatmap_png(mean_grid):
+    """Encode the block means as a small grayscale PNG (base64)."""
+    peak   = float(mean_grid.max())
+    scaled = mean_grid * (255.0 / peak) if peak > 0 else mean_grid
+    img    = Image.fromarray(scaled.astype(np.uint8), mode="L")
+
+    longest = max(img.size)
+    if longest > _HEATMAP_MAX_SIDE:
+        factor = _HEATMAP_MAX_SIDE / longest
+        img = img.resize(
+            (max(1, round(img.width * factor)), max(1, round(img.height * factor))),
+            Image.BOX,
+        )
+
+    buf = io.BytesIO()
+    img.save(buf, format="PNG", optimize=True)
+    return base64.b64encode(buf.getvalue()).decode("ascii")
@@ -0,0 +1,196 @@
+"""
+backend/df/image_context.py
+=============================
+Decoded-image context shared by the ML and forensics stages.
+
+One upload used to be opened and decoded separately by the CNN
+ensemble, ELA, metadata and noise checks.  An ImageContext is built
+once per request and handed to every stage instead; it keeps the raw
+file bytes, the PIL image and lazily computed RGB / grayscale
+conversions so each representation is produced at most once.
+Pixel data is only decoded when a stage first needs it, so checks
+that read just the header (metadata) stay cheap.  Views are built
+under a per-context lock, so stages running on different threads
+still share a single decode.
+
+The raw data may be bytes or any other contiguous buffer (a memoryview
+or an mmap of a shared-memory segment); buffers are read in place
+rather than copied into a bytes object first.
+"""
+
+import hashlib
+import io
+import os
+import threading
+
+import numpy as np
+from PIL import Image
+
+
+class ImageContext:
+    """
+    Raw bytes + decoded image for a single upload.
+
+    Attributes
+    ----------
+    data  : bytes-like — the file contents (bytes, memoryview, mmap)
+    path  : str|None  — source path, if the image came from a file
+    image : PIL.Image — opened image in its original mode
+    lock  : RLock     — hold while touching `image` directly from a
+                        stage that may run concurrently with others
+
+    Derived values (computed on first access, then cached):
+        sha256      str         — hex digest of `data` (content address)
+        rgb         PIL.Image   — image converted to "RGB"
+        gray        PIL.Image   — image converted to "L"
+        rgb_array   np.ndarray  — uint8 (H, W, 3)
+        gray_array  np.ndarray  — uint8 (H, W)
+
+    draft_rgb(size) gives a reduced-resolution RGB decode for consumers
+    that only need a small image (the CNN input).
+    """
+
+    def __init__(self, data, path: str | None = None):
+        self.data  = data
+        self.path  = path
+        self.image = Image.open(self._stream())     # header only, decoded lazily
+
+        self._sha256     = None
+        self._rgb        = None
+        self._gray       = None
+        self._rgb_array  = None
+        self._gray_array = None
+        self._draft      = {}
+        self.lock       = threading.RLock()
+
+    @classmethod
+    def from_path(cls, image_path: str) -> "ImageContext":
+        """Read an image file and open it."""
+        if not os.path.isfile(image_path):
+            raise FileNotFoundError(f"Image not found: {image_path}")
+        with open(image_path, "rb") as f:
+            return cls(f.read(), path=image_path)
+
+    # ── Original image properties ────────────────────────────────────
+
+    @property
+    def format(self) -> str | None:
+        return self.image.format
+
+    @property
+    def mode(self) -> str:
+        return self.image.mode
+
+    @property
+    def size(self) -> tuple:
+        return self.image.size
+
+    # ── Lazy views ───────────────────────────────────────────────────
+
+    @property
+    def sha256(self) -> str:
+        if self._sha256 is None:
+            self._sha256 = hashlib.sha256(self.data).hexdigest()
+        return self._sha256
+
+    @property
+    def rgb(self) -> Image.Image:
+        if self._rgb is None:
+            with self.lock:
+                if self._rgb is None:
+                    self.image.load()
+                    self._rgb = self.image if self.image.mode == "RGB" \
+                        else self.image.convert("RGB")
+        return self._rgb
+
+    @property
+    def gray(self) -> Image.Image:
+        if self._gray is None:
+            with self.lock:
+                if self._gray is None:
+                    self.image.load()
+                    self._gray = self.image if self.image.mode == "L" \
+                        else self.image.convert("L")
+        return self._gray
+
+    def draft_rgb(self, size: tuple) -> Image.Image:
+        """
+        RGB image decoded at reduced resolution, still covering `size`.
+
+        JPEGs are always decoded with DCT scaling (1/2, 1/4 or 1/8) from
+        a second handle on the raw bytes, so this neither waits for nor
+        triggers the full decode other stages may need — and the result
+        does not depend on whether another stage decoded first.  Other
+        formats have no reduced decode; they share the full `rgb` view.
+        """
+        if self.image.format != "JPEG":
+            return self.rgb
+        size = tuple(size)
+        if size not in self._draft:
+            img = Image.open(self._stream())
+            img.draft("RGB", size)
+            img = img.convert("RGB")
+            with self.lock:
+                self._draft.setdefault(size, img)
+        return self._draft[size]
+
+    def _stream(self):
+        """A new file object over `data` with its own read position."""
+        if isinstance(self.data, bytes):
+            return io.BytesIO(self.data)      # shares the bytes, no copy
+        return io.BufferedReader(_BufferReader(self.data))
+
+    @property
+    def rgb_array(self) -> np.ndarray:
+        if self._rgb_array is None:
+            with self.lock:
+                if self._rgb_array is None:
+                    self._rgb_array = np.asarray(self.rgb)
+        return self._rgb_array
+
+    @property
+    def gray_array(self) -> np.ndarray:
+        if self._gray_array is None:
+            with self.lock:
+                if self._gray_array is None:
+                    self._gray_array = np.asarray(self.gray)
+        return self._gray_array
+
+class _BufferReader(io.RawIOBase):
+    """Seekable read-only file over a memoryview-compatible buffer."""
+
+    def __init__(self, buffer):
+        self._view = memoryview(buffer).cast("B")
+        self._pos  = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = max(0, min(len(b), len(self._view) - self._pos))
+        b[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self._view)}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+
+def as_image_context(image_input) -> ImageContext:
+    """
+    Accept a file path or an existing ImageContext and return a context.
+
+    Lets the forensic checks keep their old `image_path` call style
+    while sharing one decode when the caller already built a context.
+    """
+    if isinstance(image_input, ImageContext):
+        return image_input
+    return ImageContext.from_path(image_input)
@@ -12,6 +12,11 @@ often have missing or stripped EXIF data.
 from PIL import Image
 from PIL.ExifTags import TAGS
 
+try:
+    from df.image_context import as_image_context
+except ImportError:
+    from image_context import as_image_context
+
 
 # EXIF tag IDs we care about
 _TAG_SOFTWARE  = 305
@@ -21,10 +26,12 @@ _TAG_DATETIME  = 306
 _TAG_GPS_INFO  = 34853
 
 
-def extract_metadata(image_path: str) -> dict:
+def extract_metadata(image_path) -> dict:
     """
     Extract and analyse EXIF metadata from an image.
 
+    `image_path` may be a file path or an ImageContext.
+
     Returns
     -------
     dict:
@@ -39,7 +46,8 @@ def extract_metadata(image_path: str) -> dict:
         suspicious  bool  — True if EXIF is missing (common in AI images)
     """
     try:
-        img = Image.open(image_path)
+        ctx = as_image_context(image_path)
+        img = ctx.image
 
         base = {
             "format"      : img.format,
@@ -57,7 +65,9 @@ def extract_metadata(image_path: str) -> dict:
         exif_raw = None
         if hasattr(img, "_getexif"):
             try:
-                exif_raw = img._getexif()
+                # Some formats (PNG) load pixel data to find EXIF
+                with ctx.lock:
+                    exif_raw = img._getexif()
             except Exception:
                 pass
 
@@ -82,7 +92,6 @@ def extract_metadata(image_path: str) -> dict:
                         f"Software tag indicates editing: {base['software']}"
                     )
 
-        img.close()
         return base
 
     except Exception as e:
@@ -6,16 +6,35 @@ Noise pattern analysis using the Laplacian operator.
 Real camera/screen images have natural high-frequency noise from
 sensor variation and JPEG compression.  AI-generated images can be
 unnaturally smooth (low variance) or show repeating artefacts.
+
+A single global variance averages away a spliced region whose noise
+level differs from the rest, so the analysis also builds a local
+variance map: Laplacian sums and squared sums are collected per small
+cell, turned into summed-area tables, and every block_size window
+(sliding by one cell) gets its variance from four table lookups.
+
+The default "fused" path computes the Laplacian in int16 over row
+bands of the uint8 grayscale image and accumulates all moments as it
+goes — no full float32 copy of the image is ever made.  Borders are
+edge-replicated, which is what scipy's default "reflect" mode does for
+a 3×3 kernel, so the fused numbers match the scipy path.
 """
 
+import importlib.util
+
 import numpy as np
 from PIL import Image
 
 try:
-    from scipy.ndimage import convolve as scipy_convolve
-    _SCIPY = True
+    from df.image_context import as_image_context
+    from df.utils         import block_sums
 except ImportError:
-    _SCIPY = False
+    from image_context import as_image_context
+    from utils         import block_sums
+
+# scipy is only used by the non-default full-convolution path; import
+# it there so loading the forensics stack stays cheap at worker startup
+_SCIPY = importlib.util.find_spec("scipy") is not None
 
 
 # Laplacian kernel — highlights edges and high-frequency content
@@ -23,32 +42,72 @@ _LAPLACIAN = np.array([[0, 1, 0],
                         [1,-4, 1],
                         [0, 1, 0]], dtype=np.float32)
 
+# Fused path: rows per band, rounded down to a multiple of cell_size so
+# no cell straddles two bands
+_BAND_ROWS = 256
+
+# Local variance map defaults
+DEFAULT_BLOCK_SIZE = 64        # window side in pixels
+DEFAULT_CELL_SIZE  = 16        # window stride / summed-area-table resolution
 
-def run_noise_analysis(image_path: str) -> dict:
+
+def run_noise_analysis(image_path, fused: bool = True,
+                       block_size: int = DEFAULT_BLOCK_SIZE,
+                       cell_size: int = DEFAULT_CELL_SIZE,
+                       return_map: bool = False) -> dict:
     """
     Measure noise characteristics of an image.
 
+    `image_path` may be a file path or an ImageContext.
+
+    Parameters
+    ----------
+    fused      : bool — int16 banded Laplacian (default) instead of a
+                 full float32 convolution (scipy, or manual slicing)
+    block_size : int  — local variance window side, in pixels
+    cell_size  : int  — window stride; block_size must be a multiple
+    return_map : bool — include the full local variance map
+
     Returns
     -------
     dict:
         variance    float — variance of Laplacian response
         mean_abs    float — mean absolute Laplacian response
         suspicious  bool  — True if variance < 50 (too smooth)
-        method      str   — "scipy" or "manual"
+        method      str   — "fused", "scipy" or "manual"
+        local       dict  — block-wise Laplacian variance:
+            block, stride      int    — window side / step in pixels
+            rows, cols         int    — map shape
+            min, median, max   float  — over all windows
+            inconsistency      float  — std of log(1 + window variance);
+                                        high when regions differ in noise
+            map                list   — only with return_map=True
     """
-    img = Image.open(image_path).convert("L")   # grayscale
-    arr = np.array(img, dtype=np.float32)
+    gray = as_image_context(image_path).gray_array   # grayscale uint8
+
+    if cell_size <= 0:
+        raise ValueError(f"cell_size must be positive, got {cell_size}")
+    if block_size % cell_size:
+        raise ValueError("block_size must be a multiple of cell_size")
+    cells = _CellMoments(gray.shape, cell_size)
 
-    if _SCIPY:
-        filtered = scipy_convolve(arr, _LAPLACIAN)
-        method   = "scipy"
+    if fused:
+        variance, mean_abs = _fused_laplacian(gray, cells)
+        method             = "fused"
     else:
-        # Pure numpy fallback — manual 2D convolution via slicing
-        filtered = _manual_laplacian(arr)
-        method   = "manual"
+        arr = gray.astype(np.float32)
+        if _SCIPY:
+            from scipy.ndimage import convolve as scipy_convolve
+            filtered = scipy_convolve(arr, _LAPLACIAN)
+            method   = "scipy"
+        else:
+            # Pure numpy fallback — manual 2D convolution via slicing
+            filtered = _manual_laplacian(arr)
+            method   = "manual"
 
-    variance  = float(np.var(filtered))
-    mean_abs  = float(np.mean(np.abs(filtered)))
+        variance  = float(np.var(filtered))
+        mean_abs  = float(np.mean(np.abs(filtered)))
+        cells.add_rows(filtered.astype(np.int32), 0)
 
     # Heuristic:
     # Real screenshots: variance typically > 100
@@ -60,13 +119,19 @@ def run_noise_analysis(image_path: str) -> dict:
         "mean_abs"  : round(mean_abs, 3),
         "suspicious": suspicious,
         "method"    : method,
+        "local"     : cells.local_variance(block_size // cell_size, return_map),
     }
 
 
 def _manual_laplacian(arr: np.ndarray) -> np.ndarray:
-    """Apply Laplacian using array slicing (no scipy required)."""
-    _, _ = arr.shape
-    out  = (
+    """
+    Apply Laplacian using array slicing (no scipy required).
+
+    Borders are edge-replicated, like scipy's "reflect" mode for a 3×3
+    kernel, so the output is full size and lines up with the cell grid.
+    """
+    arr = np.pad(arr, 1, mode="edge")
+    out = (
         -4 * arr[1:-1, 1:-1]
         +    arr[0:-2, 1:-1]
         +    arr[2:  , 1:-1]
@@ -74,3 +139,104 @@ def _manual_laplacian(arr: np.ndarray) -> np.ndarray:
         +    arr[1:-1, 2:  ]
     )
     return out
+
+
+def _fused_laplacian(gray: np.ndarray, cells: "_CellMoments"):
+    """
+    Laplacian + global moments in one banded pass over a uint8 image.
+
+    Each band (plus a one-row halo) is widened to int16 — enough for
+    the Laplacian range of ±1020 — so extra memory is a few bytes per
+    pixel of one band.  Returns (variance, mean_abs).
+    """
+    height, _ = gray.shape
+    total = total_sq = total_abs = 0
+    band  = max(cells.cell, _BAND_ROWS // cells.cell * cells.cell)
+
+    for top in range(0, height, band):
+        bottom = min(top + band, height)
+        y0     = max(0, top - 1)
+        y1     = min(height, bottom + 1)
+
+        chunk = np.pad(
+            gray[y0:y1].astype(np.int16),
+            ((1 if top == 0 else 0, 1 if bottom == height else 0), (1, 1)),
+            mode="edge",
+        )
+        lap = (
+            chunk[:-2, 1:-1] + chunk[2:, 1:-1]
+            + chunk[1:-1, :-2] + chunk[1:-1, 2:]
+            - 4 * chunk[1:-1, 1:-1]
+        )
+
+        lap32      = lap.astype(np.int32)
+        total     += int(lap32.sum(dtype=np.int64))
+        total_sq  += int(np.square(lap32).sum(dtype=np.int64))
+        total_abs += int(np.abs(lap32).sum(dtype=np.int64))
+        cells.add_rows(lap32, top)
+
+    count    = gray.size
+    mean     = total / count
+    variance = max(total_sq / count - mean * mean, 0.0)
+    return variance, total_abs / count
+
+
+class _CellMoments:
+    """
+    Per-cell sums of a Laplacian response, plus summed-area tables over
+    them for O(1) per-window variance.
+    """
+
+    def __init__(self, shape, cell_size):
+        height, width = shape
+        self.cell   = cell_size
+        self.width  = width
+        self.rows   = -(-height // cell_size)
+        self.cols   = -(-width  // cell_size)
+        self.sum    = np.zeros((self.rows, self.cols), dtype=np.int64)
+        self.sum_sq = np.zeros((self.rows, self.cols), dtype=np.int64)
+
+        col_widths  = np.diff(np.append(np.arange(0, width,  cell_size), width))
+        row_heights = np.diff(np.append(np.arange(0, height, cell_size), height))
+        self.count  = np.outer(row_heights, col_widths).astype(np.int64)
+
+    def add_rows(self, lap, top):
+        """
+        Fold a (rows, W) int32 Laplacian starting at image row `top`,
+        which must be a multiple of the cell size.
+        """
+        first = top // self.cell
+        for grid, values in ((self.sum, lap), (self.sum_sq, np.square(lap, dtype=np.int64))):
+            cells = block_sums(values, self.cell, self.width)
+            grid[first:first + cells.shape[0]] += cells
+
+    def local_variance(self, cells_per_block, return_map=False):
+        k = max(1, min(cells_per_block, self.rows, self.cols))
+
+        win_sum   = _window_sums(self.sum,    k)
+        win_sq    = _window_sums(self.sum_sq, k)
+        win_count = _window_sums(self.count,  k)
+
+        mean = win_sum / win_count
+        var  = np.maximum(win_sq / win_count - mean * mean, 0.0)
+
+        local = {
+            "block"        : k * self.cell,
+            "stride"       : self.cell,
+            "rows"         : int(var.shape[0]),
+            "cols"         : int(var.shape[1]),
+            "min"          : round(float(var.min()), 3),
+            "median"       : round(float(np.median(var)), 3),
+            "max"          : round(float(var.max()), 3),
+            "inconsistency": round(float(np.std(np.log1p(var))), 4),
+        }
+        if return_map:
+            local["map"] = np.round(var, 2).tolist()
+        return local
+
+
+def _window_sums(grid, k):
+    """Sums of every k×k window of `grid` via a summed-area table."""
+    sat = np.zeros((grid.shape[0] + 1, grid.shape[1] + 1), dtype=np.int64)
+    np.cumsum(np.cumsum(grid, axis=0), axis=1, out=sat[1:, 1:])
+    return sat[k:, k:] - sat[:-k, k:] - sat[k:, :-k] + sat[:-k, :-k]
@@ -6,8 +6,11 @@ Helper functions for:
 - Hex header validation
 - File signature verification
 - Format-specific checks
+- Block-wise sums used by regional ELA / local noise maps
 """
 
+import numpy as np
+
 
 def check_file_signature(file_bytes: bytes) -> dict:
     """
@@ -34,3 +37,30 @@ def check_file_signature(file_bytes: bytes) -> dict:
             return {"valid": True, "detected_format": format_name}
     
     return {"valid": False, "reason": "Unknown file signature"}
+
+
+def block_sums(values: np.ndarray, cell_size: int, width: int,
+               channels: int = 1, dtype=np.int64) -> np.ndarray:
+    """
+    Sum a (rows, width * channels) array over cell_size × cell_size blocks.
+
+    Whole row-blocks use reshape + sum (much faster than np.add.reduceat
+    along axis 0); a trailing partial row-block and partial column-block
+    are summed over the pixels they actually have.  Channels of one
+    pixel are interleaved along axis 1 and land in the same block.
+
+    Returns an array of shape (ceil(rows / cell_size), ceil(width / cell_size)).
+    """
+    n_rows = values.shape[0]
+    full   = n_rows // cell_size
+    parts  = []
+    if full:
+        parts.append(values[:full * cell_size]
+                     .reshape(full, cell_size, -1)
+                     .sum(axis=1, dtype=dtype))
+    if n_rows % cell_size:
+        parts.append(values[full * cell_size:].sum(axis=0, dtype=dtype)[None])
+    rows = parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    col_starts = np.arange(0, width, cell_size) * channels
+    return np.add.reduceat(rows, col_starts, axis=1)
@@ -0,0 +1,145 @@
+"""
+backend/ml/backend_parity.py
+==============================
+Parity check for the optimized CNN inference backends.
+
+Loads the model set twice — eager fp32 as the reference and the
+candidate backend — runs both over a reference set and compares what
+matters downstream: each XGBoost head's decision, the ensemble verdict
+and the fake probability, plus the feature vectors themselves.
+
+Usage (from backend/):
+    python -m ml.backend_parity /data/reference-receipts --backend int8 \\
+        --calibration /data/calibration-receipts
+    python -m ml.backend_parity refs/ --backend torchscript
+    python -m ml.backend_parity refs/ --backend onnx
+
+Prints one JSON summary:
+    {"backend": "int8", "images": 200, "ensemble_flips": 0,
+     "decision_agreement": {"resnet34": 1.0, ...},
+     "feature_cosine_min": {"resnet34": 0.991, ...},
+     "max_abs_drift": 0.018, "mean_abs_drift": 0.003,
+     "ms_per_image": {"eager": 210.4, "int8": 71.9}, "speedup": 2.93}
+
+Exits with status 1 if any ensemble verdict flips (usable as a gate).
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+import torch
+
+try:
+    from ml.inference  import CNN_MODEL_NAMES, DEVICE, load_models, preprocess
+    from ml.backends   import BACKENDS
+    from ml.draft_drift import iter_images
+except ImportError:
+    from inference  import CNN_MODEL_NAMES, DEVICE, load_models, preprocess
+    from backends   import BACKENDS
+    from draft_drift import iter_images
+
+
+def run_backend(tensors, cnn_models, xgb_models, batch_size):
+    """Return ({name: features}, {name: (N, 2) probs}, seconds) over all tensors."""
+    feats   = {name: [] for name in CNN_MODEL_NAMES}
+    probs   = {name: [] for name in CNN_MODEL_NAMES}
+    seconds = 0.0
+    onnx    = getattr(next(iter(cnn_models.values())), "runtime", None) == "onnx"
+
+    for start in range(0, len(tensors), batch_size):
+        batch = tensors[start:start + batch_size]
+        batch = batch.numpy() if onnx else batch.to(DEVICE)
+        n     = batch.shape[0]
+        t0    = time.perf_counter()
+        with torch.no_grad():
+            for name in CNN_MODEL_NAMES:
+                f = cnn_models[name](batch).reshape(n, -1)
+                f = f if onnx else f.cpu().numpy()
+                feats[name].append(f)
+                probs[name].append(xgb_models[name].predict_proba(f))
+        seconds += time.perf_counter() - t0
+
+    return (
+        {k: np.concatenate(v) for k, v in feats.items()},
+        {k: np.concatenate(v) for k, v in probs.items()},
+        seconds,
+    )
+
+
+def _cosine(a, b):
+    num = np.sum(a * b, axis=1)
+    den = np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1)
+    return num / np.maximum(den, 1e-12)
+
+
+def compare(paths, backend, batch_size=16) -> dict:
+    tensors = torch.stack([preprocess(p) for p in paths])
+
+    ref_cnn, xgb_models = load_models(backend="eager")
+    cand_cnn, _         = load_models(backend=backend)
+
+    # Warm both once so one-off JIT/allocator costs do not skew timings
+    run_backend(tensors[:1], ref_cnn,  xgb_models, 1)
+    run_backend(tensors[:1], cand_cnn, xgb_models, 1)
+
+    ref_f,  ref_p,  ref_s  = run_backend(tensors, ref_cnn,  xgb_models, batch_size)
+    cand_f, cand_p, cand_s = run_backend(tensors, cand_cnn, xgb_models, batch_size)
+
+    ref_avg  = np.mean([ref_p[name]  for name in CNN_MODEL_NAMES], axis=0)
+    cand_avg = np.mean([cand_p[name] for name in CNN_MODEL_NAMES], axis=0)
+    drift    = np.abs(ref_avg[:, 1] - cand_avg[:, 1])
+    n        = len(paths)
+
+    return {
+        "backend"           : backend,
+        "images"            : n,
+        "ensemble_flips"    : int(np.sum(ref_avg.argmax(1) != cand_avg.argmax(1))),
+        "decision_agreement": {
+            name: round(float(np.mean(ref_p[name].argmax(1) == cand_p[name].argmax(1))), 4)
+            for name in CNN_MODEL_NAMES
+        },
+        "feature_cosine_min": {
+            name: round(float(_cosine(ref_f[name], cand_f[name]).min()), 5)
+            for name in CNN_MODEL_NAMES
+        },
+        "max_abs_drift"     : round(float(drift.max()), 6),
+        "mean_abs_drift"    : round(float(drift.mean()), 6),
+        "ms_per_image"      : {
+            "eager": round(ref_s  * 1000 / n, 2),
+            backend: round(cand_s * 1000 / n, 2),
+        },
+        "speedup"           : round(ref_s / cand_s, 2) if cand_s else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare an inference backend's XGBoost decisions against eager fp32."
+    )
+    parser.add_argument("reference", help="image file or directory of reference images")
+    parser.add_argument("--backend", required=True, choices=[b for b in BACKENDS if b != "eager"])
+    parser.add_argument("--calibration",
+                        help="int8 calibration image directory (default MAD_QUANT_CALIB_DIR)")
+    parser.add_argument("--batch-size", type=int, default=16)
+    args = parser.parse_args(argv)
+
+    if args.calibration:
+        os.environ["MAD_QUANT_CALIB_DIR"] = args.calibration
+
+    paths = list(iter_images(args.reference))
+    if not paths:
+        sys.stderr.write(f"No images found in {args.reference}\n")
+        sys.exit(1)
+
+    summary = compare(paths, args.backend, args.batch_size)
+    print(json.dumps(summary))
+    if summary["ensemble_flips"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
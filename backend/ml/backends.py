@@ -0,0 +1,142 @@
+"""
+backend/ml/backends.py
+========================
+CPU inference backends for the CNN feature extractors.
+
+load_models(backend=...) (or MAD_INFERENCE_BACKEND) wraps each loaded
+fp32 backbone in one of:
+
+    eager          the nn.Sequential as trained (default, reference)
+    channels_last  NHWC memory format + torch.inference_mode — oneDNN
+                   convolutions skip the NCHW↔NHWC reorders
+    torchscript    traced, frozen and optimize_for_inference'd graph
+                   (conv+bn folding, fused activations)
+    int8           FX-graph static post-training quantization, calibrated
+                   on MAD_QUANT_CALIB_DIR images
+    onnx           exported graphs served by ONNX Runtime without torch
+                   (ml/onnx_backend.py; not built here)
+
+Every torch backend takes the same (N, 3, 224, 224) float input and
+returns a contiguous feature tensor, so predict_batch() is unchanged.
+torch is imported lazily, so reading the configured backend is cheap.  Use
+`python -m ml.backend_parity <dir> --backend int8` to confirm the
+XGBoost decisions still match eager fp32 on a reference set.
+"""
+
+import os
+
+
+BACKENDS         = ("eager", "channels_last", "torchscript", "int8", "onnx")
+DEFAULT_BACKEND  = "eager"
+
+# int8 calibration
+DEFAULT_CALIB_IMAGES = 64
+_CALIB_BATCH         = 16
+
+
+def backend_from_env() -> str:
+    return os.environ.get("MAD_INFERENCE_BACKEND", DEFAULT_BACKEND).strip().lower()
+
+
+def optimize(model, backend: str, calibration=None):
+    """
+    Return `model` (eval mode, fp32) converted for `backend`.
+
+    `calibration` is a (N, 3, 224, 224) tensor of preprocessed images;
+    required for "int8", ignored otherwise.
+    """
+    if backend not in BACKENDS or backend == "onnx":
+        raise ValueError(f"Unknown inference backend {backend!r}; expected one of {BACKENDS}")
+
+    if backend == "eager":
+        return model
+    if backend == "channels_last":
+        return _ChannelsLast(model)
+    if backend == "torchscript":
+        return _torchscript(model)
+    if calibration is None or len(calibration) == 0:
+        raise ValueError(
+            "int8 backend needs calibration images — set MAD_QUANT_CALIB_DIR "
+            "to a directory of typical uploads"
+        )
+    return _int8(model, calibration)
+
+
+class _ChannelsLast:
+    """Runs the wrapped model on NHWC tensors under inference_mode."""
+
+    def __init__(self, model):
+        import torch
+        self.model = model.to(memory_format=torch.channels_last).eval()
+
+    def __call__(self, x):
+        import torch
+        with torch.inference_mode():
+            out = self.model(x.contiguous(memory_format=torch.channels_last))
+            return out.contiguous()
+
+
+def _torchscript(model):
+    import torch
+    example = torch.zeros(1, 3, 224, 224, device=next(model.parameters()).device)
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example)
+        frozen = torch.jit.optimize_for_inference(torch.jit.freeze(traced.eval()))
+        frozen(example)                                       # run once to specialise
+    return frozen
+
+
+def _int8(model, calibration):
+    # Quantized kernels are CPU-only
+    import torch
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    engine = "x86" if "x86" in torch.backends.quantized.supported_engines else "qnnpack"
+    torch.backends.quantized.engine = engine
+
+    model       = model.cpu().eval()
+    calibration = calibration.cpu()
+    prepared    = prepare_fx(
+        model, get_default_qconfig_mapping(engine), example_inputs=(calibration[:1],)
+    )
+    with torch.no_grad():
+        for start in range(0, len(calibration), _CALIB_BATCH):
+            prepared(calibration[start:start + _CALIB_BATCH])
+    return _Contiguous(convert_fx(prepared).eval())
+
+
+class _Contiguous:
+    """Makes the wrapped model's output contiguous (quantized convs emit NHWC)."""
+
+    def __init__(self, model):
+        self.model = model
+
+    def __call__(self, x):
+        return self.model(x).contiguous()
+
+
+def load_calibration(preprocess, directory=None, limit=None):
+    """
+    Preprocessed (N, 3, 224, 224) tensor from up to `limit` images in
+    `directory` (default MAD_QUANT_CALIB_DIR / MAD_QUANT_CALIB_SIZE),
+    or None if no directory is configured.
+    """
+    directory = directory or os.environ.get("MAD_QUANT_CALIB_DIR")
+    if not directory:
+        return None
+    limit = limit or int(os.environ.get("MAD_QUANT_CALIB_SIZE", DEFAULT_CALIB_IMAGES))
+
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for fname in sorted(files):
+            if fname.lower().endswith((".jpg", ".jpeg", ".png", ".webp")):
+                paths.append(os.path.join(root, fname))
+    if not paths:
+        raise FileNotFoundError(f"No calibration images found in {directory}")
+
+    # Spread the sample over the whole directory rather than its first files
+    import torch
+    step = max(1, len(paths) // limit)
+    return torch.stack([preprocess(p) for p in paths[::step][:limit]])
@@ -0,0 +1,214 @@
+"""
+backend/ml/batching.py
+========================
+Dynamic micro-batching in front of ml.inference.predict_batch().
+
+Concurrent requests submit their image and get a Future back.  A single
+background thread collects pending images until either `max_batch_size`
+are waiting or `max_wait_ms` has passed since the first one arrived,
+runs the whole ensemble once on that batch, and resolves each Future
+with its own result.
+
+    batcher = MicroBatcher(cnn_models, xgb_models)
+    result  = batcher.predict(image_ctx)          # blocks, same dict as predict()
+
+With a `feature_sink` (e.g. ml.embeddings.EmbeddingStore.append), the
+CNN features of every image submitted with a key are handed to it after
+the batch's Futures are resolved.  With `keep_features=True` each
+resolved Future also carries them as `future.features` (used for the
+similarity search in ml/similarity.py).  A `shadow_sink` (see
+ml/shadow.py) is offered every finished batch — inputs, results,
+features and keys — after its Futures are resolved.
+"""
+
+import sys
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+try:
+    from ml.inference import predict_batch, preprocess_for
+except ImportError:
+    from inference import predict_batch, preprocess_for
+
+
+DEFAULT_MAX_BATCH_SIZE = 16
+DEFAULT_MAX_WAIT_MS    = 10.0
+
+_STOP = object()
+
+
+class MicroBatcher:
+    """
+    Gathers concurrent predict() calls into batched ensemble runs.
+
+    Parameters
+    ----------
+    cnn_models     : dict  — from load_models()
+    xgb_models     : dict  — from load_models()
+    max_batch_size : int   — flush as soon as this many images are queued
+    max_wait_ms    : float — flush at most this long after the first
+                             image of a batch arrived
+    preprocess_executor : concurrent.futures executor, optional —
+                             decode + resize each image there before it
+                             joins the queue, keeping the batching
+                             thread free for forward passes
+    feature_sink   : callable(key, {name: vector}), optional — receives
+                             the features of images submitted with a key
+    keep_features  : bool  — attach {name: vector} to every resolved
+                             Future as `features`
+    shadow_sink    : callable(inputs, results, features, keys), optional
+                             — must return at once (queue, don't run)
+    """
+
+    def __init__(self, cnn_models, xgb_models,
+                 max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+                 max_wait_ms: float = DEFAULT_MAX_WAIT_MS,
+                 preprocess_executor=None, feature_sink=None,
+                 keep_features: bool = False, shadow_sink=None):
+        self.cnn_models     = cnn_models
+        self.xgb_models     = xgb_models
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait       = max(0.0, float(max_wait_ms)) / 1000.0
+        self.preprocess_executor = preprocess_executor
+        self._preprocess    = preprocess_for(cnn_models)
+        self.feature_sink   = feature_sink
+        self.keep_features  = keep_features
+        self.shadow_sink    = shadow_sink
+
+        self.batches_run    = 0
+        self.images_run     = 0
+
+        self._queue  = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._loop, name="ml-batcher", daemon=True
+        )
+        self._thread.start()
+
+    # ── Public API ───────────────────────────────────────────────────
+
+    def submit(self, image_input, key: str | None = None) -> Future:
+        """
+        Queue one image; the Future resolves to its predict() dict.
+
+        `key` (the content SHA-256) tags the image's features for the
+        feature sink; without one they are not kept.
+
+        Once resolved, the Future also carries `submitted_at`,
+        `completed_at` (time.perf_counter() values) and `batch_size`
+        (plus `features` with keep_features).
+        """
+        future = Future()
+        future.submitted_at = time.perf_counter()
+        future.feature_key  = key
+        if self.preprocess_executor is None:
+            self._queue.put((image_input, future))
+        else:
+            pre = self.preprocess_executor.submit(self._preprocess, image_input)
+            pre.add_done_callback(lambda f: self._enqueue_preprocessed(f, future))
+        return future
+
+    def predict(self, image_input) -> dict:
+        """Blocking drop-in replacement for ml.inference.predict()."""
+        return self.submit(image_input).result()
+
+    def backlog(self) -> int:
+        """Images queued for the next batch (0 when the batcher is idle)."""
+        return self._queue.qsize()
+
+    def close(self):
+        """Finish queued work and stop the batching thread."""
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _enqueue_preprocessed(self, pre, future):
+        exc = pre.exception()
+        if exc is not None:
+            future.set_exception(exc)
+        else:
+            self._queue.put((pre.result(), future))
+
+    # ── Batching loop ────────────────────────────────────────────────
+
+    def _loop(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+
+            batch    = [item]
+            stopping = False
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 \
+                        else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self._run_batch(batch)
+            if stopping:
+                return
+
+    def _run_batch(self, batch):
+        # Preprocess individually so one undecodable upload only fails
+        # its own request, not everyone else in the batch.
+        tensors, futures = [], []
+        for image_input, future in batch:
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                tensors.append(self._preprocess(image_input))
+                futures.append(future)
+            except Exception as exc:
+                future.set_exception(exc)
+
+        if not futures:
+            return
+
+        keep     = self.feature_sink is not None or self.keep_features \
+            or self.shadow_sink is not None
+        features = [] if keep else None
+        try:
+            results = predict_batch(tensors, self.cnn_models, self.xgb_models,
+                                    features_out=features)
+        except Exception as exc:
+            for future in futures:
+                future.set_exception(exc)
+            return
+
+        self.batches_run += 1
+        self.images_run  += len(futures)
+        completed_at = time.perf_counter()
+        for i, (future, result) in enumerate(zip(futures, results)):
+            future.completed_at = completed_at
+            future.batch_size   = len(futures)
+            if self.keep_features:
+                future.features = features[i]
+            future.set_result(result)
+
+        if self.feature_sink is not None:
+            self._sink_features(futures, features)
+        if self.shadow_sink is not None:
+            try:
+                self.shadow_sink(tensors, results, features,
+                                 [future.feature_key for future in futures])
+            except Exception as exc:
+                sys.stderr.write(f"[ml-batcher] shadow sink failed: {exc}\n")
+
+    def _sink_features(self, futures, features):
+        # Runs after the Futures are resolved: storage never delays a
+        # response, and a storage error never fails one.
+        for future, feats in zip(futures, features):
+            if future.feature_key is None:
+                continue
+            try:
+                self.feature_sink(future.feature_key, feats)
+            except Exception as exc:
+                sys.stderr.write(f"[ml-batcher] feature sink failed: {exc}\n")
@@ -0,0 +1,260 @@
+"""
+backend/ml/bundle.py
+======================
+Pickle-free model bundle, loaded through mmap.
+
+`torch.load` of the .pth files unpickles every weight into a private
+copy in each worker, and the XGBoost heads are unpickled sklearn
+objects.  A bundle stores the same models as flat files:
+
+    <bundle>/manifest.json                {"format", "models", "files"}
+    <bundle>/cnn_<name>.safetensors       backbone state_dict
+    <bundle>/xgb_<name>.ubj               native XGBoost booster
+
+The .safetensors files use the safetensors layout (8-byte header
+length, JSON header of dtype / shape / byte range per tensor, raw
+little-endian data) and are read with a copy-on-write np.memmap: the
+weights stay in the page cache, shared by every worker process on the
+host, and start-up costs disk reads instead of unpickling.  The
+manifest records each file's size and SHA-256; sizes are always
+checked, checksums unless MAD_BUNDLE_VERIFY=0.
+
+load_models() uses MODEL_DIR/bundle when its manifest exists
+(MAD_MODEL_BUNDLE points elsewhere, or "off" ignores bundles).  Only
+the eager backend keeps the weights mapped — the other torch backends
+rewrite them into their own layout — and ONNX Runtime reads its .onnx
+files directly.
+
+Build one from the existing .pth / .pkl (or .ubj) files:
+    python -m ml.bundle --model-dir ml/models --out ml/models/bundle
+"""
+
+import os
+import sys
+import json
+import struct
+import hashlib
+import argparse
+
+import numpy as np
+
+
+BUNDLE_FORMAT = 1
+MANIFEST      = "manifest.json"
+
+_DTYPES = {
+    "F64": np.float64, "F32": np.float32, "F16": np.float16,
+    "I64": np.int64,   "I32": np.int32,   "I16": np.int16, "I8": np.int8,
+    "U8" : np.uint8,   "BOOL": np.bool_,
+}
+_CODES = {np.dtype(v): k for k, v in _DTYPES.items()}
+
+
+class ModelBundle:
+    """
+    A verified bundle directory.
+
+    Raises FileNotFoundError / ValueError when the manifest is missing,
+    names files that are absent, or a size or checksum does not match.
+    """
+
+    def __init__(self, directory: str, verify: bool | None = None):
+        self.dir = directory
+        with open(os.path.join(directory, MANIFEST), "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("format") != BUNDLE_FORMAT:
+            raise ValueError(f"{directory}: unsupported bundle format {self.manifest.get('format')}")
+        if verify is None:
+            verify = os.environ.get("MAD_BUNDLE_VERIFY", "1") != "0"
+        for fname, entry in self.manifest["files"].items():
+            _check_file(os.path.join(directory, fname), entry, verify)
+
+    @property
+    def version(self) -> str:
+        """Content fingerprint: the files' checksums."""
+        digest = hashlib.sha256()
+        for fname in sorted(self.manifest["files"]):
+            digest.update(f"{fname}:{self.manifest['files'][fname]['sha256']};".encode())
+        return digest.hexdigest()[:12]
+
+    def cnn_path(self, name: str) -> str:
+        return os.path.join(self.dir, self.manifest["models"][name]["cnn"])
+
+    def xgb_path(self, name: str) -> str:
+        return os.path.join(self.dir, self.manifest["models"][name]["xgb"])
+
+    def state_dict(self, name: str) -> dict:
+        """{tensor name: np.ndarray} memory-mapped from the backbone's file."""
+        return load_safetensors(self.cnn_path(name))
+
+
+def find_bundle(model_dir: str, env_path: bool = True):
+    """
+    Bundle directory for `model_dir`, or None.  MAD_MODEL_BUNDLE=off
+    always applies; a MAD_MODEL_BUNDLE path only with `env_path`.
+    """
+    setting = os.environ.get("MAD_MODEL_BUNDLE", "")
+    if setting.lower() == "off":
+        return None
+    directory = (env_path and setting) or os.path.join(model_dir, "bundle")
+    return directory if os.path.exists(os.path.join(directory, MANIFEST)) else None
+
+
+# ─────────────────────────────────────────────────────────────────────
+# SAFETENSORS LAYOUT
+# ─────────────────────────────────────────────────────────────────────
+
+def save_safetensors(path: str, tensors: dict, metadata: dict | None = None):
+    """Write {name: array} (NumPy or anything np.asarray accepts)."""
+    arrays = {k: np.ascontiguousarray(np.asarray(v)) for k, v in tensors.items()}
+    # Widest dtypes first: every tensor then starts aligned to its itemsize
+    order  = sorted(arrays, key=lambda k: (-arrays[k].dtype.itemsize, k))
+
+    header, offset = {}, 0
+    for key in order:
+        arr = arrays[key]
+        if arr.dtype not in _CODES:
+            raise ValueError(f"{key}: unsupported dtype {arr.dtype}")
+        header[key] = {
+            "dtype"       : _CODES[arr.dtype],
+            "shape"       : list(arr.shape),
+            "data_offsets": [offset, offset + arr.nbytes],
+        }
+        offset += arr.nbytes
+    if metadata:
+        header["__metadata__"] = {k: str(v) for k, v in metadata.items()}
+
+    blob = json.dumps(header, separators=(",", ":")).encode()
+    blob += b" " * (-(8 + len(blob)) % 8)           # data starts 8-byte aligned
+
+    # Replace, never rewrite in place: a worker may have the old file
+    # mapped, and its weights must not change under it
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(struct.pack("<Q", len(blob)))
+        f.write(blob)
+        for key in order:
+            f.write(arrays[key].astype(arrays[key].dtype.newbyteorder("<"), copy=False).tobytes())
+    os.replace(tmp, path)
+
+
+def load_safetensors(path: str) -> dict:
+    """
+    {name: array} backed by a copy-on-write memmap of `path`.
+
+    Nothing is read until a tensor is touched; writes (if any) go to
+    private pages, never to the file.
+    """
+    with open(path, "rb") as f:
+        (header_len,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_len))
+    header.pop("__metadata__", None)
+
+    start = 8 + header_len
+    data  = np.memmap(path, dtype=np.uint8, mode="c", offset=start) \
+        if os.path.getsize(path) > start else np.zeros(0, dtype=np.uint8)
+    out = {}
+    for key, info in header.items():
+        begin, end = info["data_offsets"]
+        dtype      = np.dtype(_DTYPES[info["dtype"]]).newbyteorder("<")
+        out[key]   = data[begin:end].view(dtype).reshape(info["shape"])
+    return out
+
+
+# ─────────────────────────────────────────────────────────────────────
+# CONVERTER — .pth / .pkl → bundle
+# ─────────────────────────────────────────────────────────────────────
+
+def convert(model_dir: str, out_dir: str, names) -> dict:
+    """Write a bundle for `names` from model_dir's .pth and .pkl/.ubj files."""
+    import torch
+    try:
+        from ml.xgb_native import native_path
+    except ImportError:
+        from xgb_native import native_path
+
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = {"format": BUNDLE_FORMAT, "models": {}, "files": {}}
+
+    for name in names:
+        cnn_file = f"cnn_{name}.safetensors"
+        state    = torch.load(os.path.join(model_dir, f"cnn_{name}.pth"),
+                              map_location="cpu", weights_only=True)
+        save_safetensors(
+            os.path.join(out_dir, cnn_file),
+            {k: v.detach().cpu().numpy() for k, v in state.items()},
+            metadata={"model": name},
+        )
+
+        xgb_file = f"xgb_{name}.ubj"
+        native   = native_path(model_dir, name)
+        if native is not None:
+            import xgboost as xgb
+            booster = xgb.Booster()
+            booster.load_model(native)
+        else:
+            import pickle
+            with open(os.path.join(model_dir, f"xgb_{name}.pkl"), "rb") as f:
+                booster = pickle.load(f).get_booster()
+        tmp = os.path.join(out_dir, xgb_file + ".tmp.ubj")
+        booster.save_model(tmp)
+        os.replace(tmp, os.path.join(out_dir, xgb_file))
+
+        manifest["models"][name] = {"cnn": cnn_file, "xgb": xgb_file}
+        for fname in (cnn_file, xgb_file):
+            manifest["files"][fname] = _describe(os.path.join(out_dir, fname))
+
+    # Manifest last, atomically: a half-written bundle is never picked up
+    tmp = os.path.join(out_dir, MANIFEST + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, os.path.join(out_dir, MANIFEST))
+    return manifest
+
+
+def _describe(path):
+    return {"bytes": os.path.getsize(path), "sha256": _sha256(path)}
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _check_file(path, entry, verify):
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Bundle file missing: {path}")
+    size = os.path.getsize(path)
+    if size != entry["bytes"]:
+        raise ValueError(f"Bundle file {path}: {size} bytes, manifest says {entry['bytes']}")
+    if verify and _sha256(path) != entry["sha256"]:
+        raise ValueError(f"Bundle file {path}: SHA-256 does not match the manifest")
+
+
+def main(argv=None):
+    try:
+        from ml.inference import CNN_MODEL_NAMES, MODEL_DIR
+    except ImportError:
+        from inference import CNN_MODEL_NAMES, MODEL_DIR
+
+    parser = argparse.ArgumentParser(
+        description="Pack .pth / .pkl models into an mmap-able, pickle-free bundle."
+    )
+    parser.add_argument("--model-dir", default=MODEL_DIR, help="where the cnn_*.pth / xgb_* files are")
+    parser.add_argument("--out", help="bundle directory (default: <model-dir>/bundle)")
+    args = parser.parse_args(argv)
+
+    out_dir  = args.out or os.path.join(args.model_dir, "bundle")
+    manifest = convert(args.model_dir, out_dir, CNN_MODEL_NAMES)
+    ModelBundle(out_dir, verify=True)
+    sys.stdout.write(json.dumps({
+        "bundle": out_dir,
+        "files" : {k: v["bytes"] for k, v in manifest["files"].items()},
+    }) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+backend/ml/cascade_eval.py
+============================
+Offline accuracy-vs-compute evaluation for the early-exit cascade.
+
+Runs every backbone + XGBoost head once over a labelled reference set,
+timing each model, then replays the cascade (ml.inference.predict_cascade)
+for each candidate margin without running the CNNs again.  Labels come
+from the directory layout: images under a directory named "real" are
+Real, under "fake" / "ai" are AI/Fake.
+
+Usage (from backend/):
+    python -m ml.cascade_eval /data/labelled-receipts
+    python -m ml.cascade_eval refs/ --margins 0.9,0.95,0.99
+
+Prints one JSON line per margin plus one for the full ensemble:
+    {"margin": 0.95, "accuracy": 0.981, "agreement": 0.996,
+     "mean_models": 1.31, "compute": 0.22, "exit_at": {"mobilenet_v2": 0.8, ...}}
+
+    accuracy    — against the directory labels
+    agreement   — fraction of verdicts identical to the full ensemble
+    mean_models — backbones run per image
+    compute     — measured per-image cost relative to the full ensemble
+    exit_at     — fraction of images finishing at each backbone
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+
+try:
+    from ml.inference import (
+        CASCADE_ORDER, cascade_exit, extract_features, load_models, preprocess_batch,
+    )
+    from ml.draft_drift import iter_images
+except ImportError:
+    from inference import (
+        CASCADE_ORDER, cascade_exit, extract_features, load_models, preprocess_batch,
+    )
+    from draft_drift import iter_images
+
+
+DEFAULT_MARGINS = [0.8, 0.85, 0.9, 0.95, 0.98, 0.99]
+
+_LABELS = {"real": 0, "fake": 1, "ai": 1}
+
+
+def label_for(path: str, root: str):
+    """0 (Real) / 1 (AI/Fake) from the nearest labelled directory, else None."""
+    parts = os.path.relpath(path, root).split(os.sep)[:-1]
+    for part in reversed(parts):
+        if part.lower() in _LABELS:
+            return _LABELS[part.lower()]
+    return None
+
+
+def score_all(paths, cnn_models, xgb_models, batch_size=16):
+    """
+    Return ({name: (N, 2) probs}, {name: seconds}) for every backbone.
+
+    Batches are built and scored exactly as predict_batch() does, so
+    this works for every MAD_INFERENCE_BACKEND and times what serving
+    runs.
+    """
+    probs   = {name: [] for name in CASCADE_ORDER}
+    seconds = {name: 0.0 for name in CASCADE_ORDER}
+
+    for start in range(0, len(paths), batch_size):
+        chunk = paths[start:start + batch_size]
+        batch = preprocess_batch(chunk, cnn_models)
+        for name in CASCADE_ORDER:
+            t0    = time.perf_counter()
+            feats = extract_features(cnn_models[name], batch)
+            probs[name].append(xgb_models[name].predict_proba(feats))
+            seconds[name] += time.perf_counter() - t0
+
+    return {name: np.concatenate(p) for name, p in probs.items()}, seconds
+
+
+def replay(probs, labels, cost, margin):
+    """Simulate the cascade at `margin` from precomputed per-model probabilities."""
+    n        = len(labels)
+    prob_sum = np.zeros((n, 2))
+    ran      = np.zeros(n, dtype=np.int64)
+    active   = np.arange(n)
+    exit_at  = {}
+
+    for stage, name in enumerate(CASCADE_ORDER):
+        prob_sum[active] += probs[name][active]
+        ran[active]      += 1
+        if stage == len(CASCADE_ORDER) - 1:
+            exit_at[name] = len(active) / n
+            break
+        done          = cascade_exit(prob_sum[active] / ran[active, None], margin)
+        exit_at[name] = int(done.sum()) / n
+        active        = active[~done]
+
+    verdicts = np.argmax(prob_sum / ran[:, None], axis=1)
+    # Cost of image i = cost of the first ran[i] models in cascade order
+    stage_cost = np.cumsum([cost[name] for name in CASCADE_ORDER])
+    return verdicts, {
+        "accuracy"   : round(float(np.mean(verdicts == labels)), 4),
+        "mean_models": round(float(ran.mean()), 3),
+        "compute"    : round(float(stage_cost[ran - 1].mean() / stage_cost[-1]), 3),
+        "exit_at"    : {k: round(v, 4) for k, v in exit_at.items()},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Accuracy vs compute of the early-exit cascade for candidate margins."
+    )
+    parser.add_argument("reference", help="directory with real/ and fake/ (or ai/) images")
+    parser.add_argument("--margins", default=",".join(map(str, DEFAULT_MARGINS)),
+                        help="comma-separated candidate margins")
+    parser.add_argument("--batch-size", type=int, default=16)
+    args = parser.parse_args(argv)
+
+    paths, labels = [], []
+    for path in iter_images(args.reference):
+        label = label_for(path, args.reference)
+        if label is not None:
+            paths.append(path)
+            labels.append(label)
+    if not paths:
+        sys.stderr.write(f"No labelled images (real/, fake/) found in {args.reference}\n")
+        sys.exit(1)
+    labels = np.asarray(labels)
+
+    cnn_models, xgb_models = load_models()
+    probs, seconds = score_all(paths, cnn_models, xgb_models, args.batch_size)
+    cost = {name: seconds[name] / len(paths) for name in CASCADE_ORDER}
+
+    full, full_stats = replay(probs, labels, cost, margin=float("inf"))
+    print(json.dumps({
+        "margin"     : None,
+        **full_stats,
+        "agreement"  : 1.0,
+        "images"     : len(paths),
+        "model_ms"   : {name: round(c * 1000, 2) for name, c in cost.items()},
+    }))
+
+    for margin in (float(m) for m in args.margins.split(",") if m.strip()):
+        verdicts, stats = replay(probs, labels, cost, margin)
+        print(json.dumps({
+            "margin"   : margin,
+            **stats,
+            "agreement": round(float(np.mean(verdicts == full)), 4),
+        }))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""
+backend/ml/embeddings.py
+==========================
+Persistent store of the CNN features behind each prediction.
+
+Every scored image already costs three backbone passes; keeping their
+outputs means the XGBoost heads can be refitted or recalibrated, and
+history re-scored, without running the CNNs again.
+
+Layout (one directory per model-set version, one file pair per CNN):
+
+    <root>/<model_version>/meta.json          {"resnet34": 512, ...}
+    <root>/<model_version>/<name>.f32         float32 rows, D per row
+    <root>/<model_version>/<name>.sha         32-byte SHA-256 per row
+
+Both files are append-only and row i of one matches row i of the
+other, so readers can np.memmap them directly.  A crash mid-append
+leaves at most one torn row, which readers ignore and the next writer
+truncates away.  Each image is stored once per model version (later
+duplicates are skipped).  Several processes may append to one store
+with `shared=True` (python-workers/supervisor.py): each row is then
+written under an exclusive flock and flushed straight away, so rows of
+the two files stay paired, and each writer first reads the hashes the
+others appended since it last looked, so duplicates are skipped across
+processes too.
+
+Writer (the worker enables it with MAD_EMBED_DIR):
+    store = EmbeddingStore(root, model_version)
+    store.append(sha256_hex, {"resnet34": vec, ...})
+
+Reader:
+    reader = EmbeddingReader(root, model_version)
+    hashes, X = reader.matrix("resnet34")          # (N,) hex, (N, 512) memmap
+    hashes, Xs = reader.aligned()                   # rows present for all CNNs
+    reader.get(sha256_hex)                          # {name: vector}
+"""
+
+import os
+import json
+import threading
+
+try:
+    import fcntl
+except ImportError:                      # Windows: single worker process only
+    fcntl = None
+
+import numpy as np
+
+
+_SHA_BYTES = 32
+_FLUSH_EVERY = 64          # appends between flushes
+
+
+class EmbeddingStore:
+    """
+    Append-only writer for one model version.
+
+    Thread-safe; appends are buffered and flushed every _FLUSH_EVERY
+    images and on flush()/close().  With `shared=True` other processes
+    may append to the same store (see module docstring).
+    """
+
+    def __init__(self, root: str, model_version: str, shared: bool = False):
+        self.dir  = os.path.join(root, model_version)
+        os.makedirs(self.dir, exist_ok=True)
+        self.shared = shared and fcntl is not None
+
+        self._lock    = threading.Lock()
+        self._meta    = _read_meta(self.dir)
+        self._files   = {}
+        self._seen    = {}
+        self._read_to = {}         # bytes of each .sha file already in _seen
+        self._pending = 0
+        self.appended = 0
+
+        for name, dim in self._meta.items():
+            feat_f, sha_f = self._open(name)
+            if self.shared:                     # not while another process writes a row
+                fcntl.flock(sha_f, fcntl.LOCK_EX)
+            try:
+                hashes = _stored_hashes(self.dir, name, dim)
+                _truncate(self.dir, name, dim, len(hashes))     # drop a torn last row
+            finally:
+                if self.shared:
+                    fcntl.flock(sha_f, fcntl.LOCK_UN)
+            self._seen[name]    = set(hashes)
+            self._read_to[name] = len(hashes) * _SHA_BYTES
+
+    @classmethod
+    def from_env(cls, model_version: str, shared: bool = False):
+        """Store under MAD_EMBED_DIR, or None if it is not set."""
+        root = os.environ.get("MAD_EMBED_DIR")
+        return cls(root, model_version, shared) if root else None
+
+    def append(self, sha256_hex: str, features: dict):
+        """Store {model name: 1-D feature vector} for one image."""
+        digest = bytes.fromhex(sha256_hex)
+        with self._lock:
+            for name, vec in features.items():
+                vec = np.ascontiguousarray(vec, dtype=np.float32).ravel()
+                if name not in self._meta:
+                    self._meta[name]    = int(vec.size)
+                    self._seen[name]    = set()
+                    self._read_to[name] = 0
+                    _write_meta(self.dir, self._meta)
+                elif vec.size != self._meta[name]:
+                    raise ValueError(
+                        f"{name}: feature size {vec.size} != stored {self._meta[name]}"
+                    )
+                if digest in self._seen[name]:
+                    continue
+
+                feat_f, sha_f = self._open(name)
+                if self.shared:
+                    fcntl.flock(sha_f, fcntl.LOCK_EX)
+                try:
+                    if self.shared:
+                        self._read_others(name)
+                        if digest in self._seen[name]:
+                            continue
+                    feat_f.write(vec.tobytes())
+                    sha_f.write(digest)
+                    if self.shared:
+                        feat_f.flush()
+                        sha_f.flush()
+                        self._read_to[name] += _SHA_BYTES
+                finally:
+                    if self.shared:
+                        fcntl.flock(sha_f, fcntl.LOCK_UN)
+                self._seen[name].add(digest)
+
+            self.appended += 1
+            self._pending += 1
+            if self._pending >= _FLUSH_EVERY:
+                self._flush_locked()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def close(self):
+        with self._lock:
+            self._flush_locked()
+            for feat_f, sha_f in self._files.values():
+                feat_f.close()
+                sha_f.close()
+            self._files.clear()
+
+    def _open(self, name):
+        if name not in self._files:
+            self._files[name] = (
+                open(os.path.join(self.dir, f"{name}.f32"), "ab"),
+                open(os.path.join(self.dir, f"{name}.sha"), "ab"),
+            )
+        return self._files[name]
+
+    def _read_others(self, name):
+        """
+        Add the hashes other processes appended to `name` since the last
+        call to _seen (caller holds the flock, so every row is complete).
+        """
+        path = os.path.join(self.dir, f"{name}.sha")
+        size = os.path.getsize(path)
+        if size <= self._read_to[name]:
+            return
+        with open(path, "rb") as f:
+            f.seek(self._read_to[name])
+            raw = f.read(size - self._read_to[name])
+        self._seen[name].update(
+            raw[i:i + _SHA_BYTES] for i in range(0, len(raw), _SHA_BYTES)
+        )
+        self._read_to[name] = size
+
+    def _flush_locked(self):
+        # Features first: a reader never sees a hash without its row
+        for feat_f, sha_f in self._files.values():
+            feat_f.flush()
+            sha_f.flush()
+        self._pending = 0
+
+
+class EmbeddingReader:
+    """Read-only, memory-mapped view of one model version's embeddings."""
+
+    def __init__(self, root: str, model_version: str):
+        self.dir  = os.path.join(root, model_version)
+        self.meta = _read_meta(self.dir)
+        if not self.meta:
+            raise FileNotFoundError(f"No embeddings stored in {self.dir}")
+        self._index = None
+
+    def models(self):
+        return list(self.meta)
+
+    def matrix(self, name: str):
+        """(hashes, features): hex digests (N,) and a read-only (N, D) memmap."""
+        dim    = self.meta[name]
+        hashes = _stored_hashes(self.dir, name, dim)
+        rows   = len(hashes)
+        if rows == 0:
+            return np.array([], dtype=object), np.zeros((0, dim), dtype=np.float32)
+        feats = np.memmap(
+            os.path.join(self.dir, f"{name}.f32"), dtype=np.float32, mode="r",
+            shape=(rows, dim),
+        )
+        return np.array([h.hex() for h in hashes], dtype=object), feats
+
+    def aligned(self, names=None):
+        """
+        (hashes, {name: (N, D) array}) for images stored for every model
+        in `names` (default: all), rows in the same order for each model.
+        Cascade-mode requests that stopped early are left out.
+        """
+        names    = list(names or self.meta)
+        mats     = {name: self.matrix(name) for name in names}
+        position = {name: {h: i for i, h in enumerate(mats[name][0])} for name in names}
+        common   = [h for h in mats[names[0]][0] if all(h in position[n] for n in names)]
+        return (
+            np.array(common, dtype=object),
+            {name: mats[name][1][[position[name][h] for h in common]] for name in names},
+        )
+
+    def get(self, sha256_hex: str) -> dict:
+        """{name: vector} stored for one image (empty if unknown)."""
+        if self._index is None:
+            self._index = {}
+            for name in self.meta:
+                hashes, feats = self.matrix(name)
+                for i, h in enumerate(hashes):
+                    self._index.setdefault(h, {})[name] = (feats, i)
+        return {name: np.array(f[i]) for name, (f, i) in self._index.get(sha256_hex, {}).items()}
+
+
+def _read_meta(directory):
+    path = os.path.join(directory, "meta.json")
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_meta(directory, meta):
+    tmp = os.path.join(directory, "meta.json.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(tmp, os.path.join(directory, "meta.json"))
+
+
+def _truncate(directory, name, dim, rows):
+    for ext, row_bytes in ((".f32", 4 * dim), (".sha", _SHA_BYTES)):
+        path = os.path.join(directory, name + ext)
+        if os.path.exists(path) and os.path.getsize(path) > rows * row_bytes:
+            os.truncate(path, rows * row_bytes)
+
+
+def _stored_hashes(directory, name, dim):
+    """Digests of complete rows (both files written) for one model."""
+    sha_path  = os.path.join(directory, f"{name}.sha")
+    feat_path = os.path.join(directory, f"{name}.f32")
+    if not os.path.exists(sha_path) or not os.path.exists(feat_path):
+        return []
+    rows = min(os.path.getsize(sha_path) // _SHA_BYTES,
+               os.path.getsize(feat_path) // (4 * dim))
+    with open(sha_path, "rb") as f:
+        raw = f.read(rows * _SHA_BYTES)
+    return [raw[i * _SHA_BYTES:(i + 1) * _SHA_BYTES] for i in range(rows)]
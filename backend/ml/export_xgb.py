@@ -0,0 +1,88 @@
+"""
+backend/ml/export_xgb.py
+==========================
+Convert the pickled XGBClassifier heads to native XGBoost model files.
+
+Reads MODEL_DIR/xgb_<name>.pkl, writes xgb_<name>.ubj (UBJSON, or
+--format json) next to it, then checks that the native NativeHead
+gives the same probabilities as the pickled classifier on random
+feature rows of the right width.  load_models() picks the native files
+up automatically; delete them to go back to the pickles.
+
+Usage (from backend/):
+    python -m ml.export_xgb
+    python -m ml.export_xgb --out-dir /srv/models --format json
+
+Prints one JSON line per head:
+    {"model": "resnet34", "path": ".../xgb_resnet34.ubj", "kb": 412.0,
+     "max_abs_diff": 0.0, "pickle_ms": 2.91, "native_ms": 0.38}
+"""
+
+import os
+import json
+import time
+import pickle
+import argparse
+
+import numpy as np
+
+try:
+    from ml.inference  import CNN_MODEL_NAMES, MODEL_DIR
+    from ml.xgb_native import NativeHead
+except ImportError:
+    from inference  import CNN_MODEL_NAMES, MODEL_DIR
+    from xgb_native import NativeHead
+
+
+def convert(pkl_path: str, out_path: str):
+    with open(pkl_path, "rb") as f:
+        clf = pickle.load(f)
+    clf.get_booster().save_model(out_path)
+    return clf
+
+
+def check(clf, out_path: str, rows: int = 256, seed: int = 0) -> dict:
+    head  = NativeHead(out_path)
+    feats = np.random.default_rng(seed).standard_normal(
+        (rows, head.n_features_in_), dtype=np.float32
+    )
+
+    t0  = time.perf_counter()
+    ref = clf.predict_proba(feats)
+    t1  = time.perf_counter()
+    out = head.predict_proba(feats)
+    t2  = time.perf_counter()
+
+    return {
+        "max_abs_diff": float(np.max(np.abs(ref - out))),
+        "pickle_ms"   : round((t1 - t0) * 1000, 2),
+        "native_ms"   : round((t2 - t1) * 1000, 2),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Convert pickled XGBoost heads to native .ubj/.json models."
+    )
+    parser.add_argument("--model-dir", default=MODEL_DIR, help="where the xgb_*.pkl files are")
+    parser.add_argument("--out-dir", help="where to write the native files (default: --model-dir)")
+    parser.add_argument("--format", choices=("ubj", "json"), default="ubj")
+    args = parser.parse_args(argv)
+
+    out_dir = args.out_dir or args.model_dir
+    os.makedirs(out_dir, exist_ok=True)
+
+    for name in CNN_MODEL_NAMES:
+        pkl_path = os.path.join(args.model_dir, f"xgb_{name}.pkl")
+        out_path = os.path.join(out_dir, f"xgb_{name}.{args.format}")
+        clf      = convert(pkl_path, out_path)
+        print(json.dumps({
+            "model": name,
+            "path" : out_path,
+            "kb"   : round(os.path.getsize(out_path) / 1e3, 1),
+            **check(clf, out_path),
+        }))
+
+
+if __name__ == "__main__":
+    main()
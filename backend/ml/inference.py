@@ -9,14 +9,37 @@ Called by prediction_worker.py and analyze-image.py.
 DO NOT run this file directly.
 """
 
+import io
 import os
+import sys
+import time
 import pickle
+import hashlib
+import importlib.util
 import numpy as np
 from PIL import Image
 
-import torch
-import torch.nn as nn
-from torchvision import models, transforms
+# Optional: without df the models still serve paths and PIL images
+try:
+    from df.image_context import ImageContext
+except ImportError:
+    ImageContext = None
+
+try:
+    from ml.backends   import backend_from_env, load_calibration, optimize
+    from ml.bundle     import ModelBundle, find_bundle
+    from ml.xgb_native import NativeHead, native_path
+except ImportError:
+    from backends   import backend_from_env, load_calibration, optimize
+    from bundle     import ModelBundle, find_bundle
+    from xgb_native import NativeHead, native_path
+
+# torch / torchvision are imported on first use (_import_torch), not
+# here: the ONNX Runtime backend and decode-only callers (bulk_scan's
+# pool processes) never need them, and they dominate import time.
+# torch, nn, models, transforms, DEVICE and INFER_TRANSFORM are still
+# module attributes — touching one triggers the import.
+_TORCH_NAMES = ("torch", "nn", "models", "transforms", "DEVICE", "INFER_TRANSFORM")
 
 # Models live in backend/ml/models/
 # This file is at backend/ml_worker/inference.py
@@ -28,26 +51,66 @@ MODEL_DIR  = os.environ.get(
     os.path.join(_BACKEND, "ml", "models")
 )
 
-DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-
 # ─────────────────────────────────────────────────────────────────────
 # PREPROCESSING
 # CRITICAL: these values must exactly match what was used in Colab.
 # Changing resize size or mean/std will break predictions.
 # ─────────────────────────────────────────────────────────────────────
 
-INFER_TRANSFORM = transforms.Compose([
-    transforms.Resize((224, 224)),       # ImageNet standard
-    transforms.ToTensor(),               # → [0, 1] float tensor
-    transforms.Normalize(
-        mean=[0.485, 0.456, 0.406],      # ImageNet mean — DO NOT CHANGE
-        std =[0.229, 0.224, 0.225],      # ImageNet std  — DO NOT CHANGE
-    ),
-])
+IMAGENET_MEAN = [0.485, 0.456, 0.406]    # ImageNet mean — DO NOT CHANGE
+IMAGENET_STD  = [0.229, 0.224, 0.225]    # ImageNet std  — DO NOT CHANGE
+
+
+def _import_torch():
+    """Import torch/torchvision and build DEVICE + INFER_TRANSFORM (once)."""
+    global torch, nn, models, transforms, DEVICE, INFER_TRANSFORM
+    if "INFER_TRANSFORM" in globals():
+        return
+
+    import torch
+    import torch.nn as nn
+    from torchvision import models, transforms
+
+    DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+    INFER_TRANSFORM = transforms.Compose([
+        transforms.Resize((224, 224)),       # ImageNet standard
+        transforms.ToTensor(),               # → [0, 1] float tensor
+        transforms.Normalize(
+            mean=IMAGENET_MEAN,
+            std =IMAGENET_STD,
+        ),
+    ])
+
+
+def __getattr__(name):
+    if name in _TORCH_NAMES:
+        _import_torch()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# NumPy twin of INFER_TRANSFORM's ToTensor + Normalize, for ONNX Runtime
+_NP_MEAN = np.asarray(IMAGENET_MEAN, dtype=np.float32)
+_NP_STD  = np.asarray(IMAGENET_STD,  dtype=np.float32)
+
+CNN_INPUT_SIZE  = (224, 224)
+
+# Reduced-resolution JPEG decode for the CNN input (see resize_for_cnn).
+# MAD_DRAFT_DECODE=0 restores the full-decode path; use
+# `python -m ml.draft_drift <dir>` to measure the difference.
+DRAFT_DECODE    = os.environ.get("MAD_DRAFT_DECODE", "1") != "0"
 
 CNN_MODEL_NAMES = ["resnet34", "efficientnet_b0", "mobilenet_v2"]
 LABEL_MAP       = {0: "Real", 1: "AI/Fake"}
 
+# Early-exit cascade: backbones cheapest first.  With a margin set
+# (MAD_CASCADE_MARGIN, e.g. 0.95) an image stops as soon as the soft
+# vote of the models run so far is at least that confident; unset runs
+# the full ensemble.  `python -m ml.cascade_eval <dir>` picks a margin.
+CASCADE_ORDER   = ["mobilenet_v2", "efficientnet_b0", "resnet34"]
+CASCADE_MARGIN  = float(os.environ["MAD_CASCADE_MARGIN"]) if os.environ.get("MAD_CASCADE_MARGIN") else None
+
 # ─────────────────────────────────────────────────────────────────────
 # MODEL BUILDERS
 # These must match the architectures used during training in Colab.
@@ -75,70 +138,378 @@ _BUILDERS = {
 # LOADER — called once when worker starts
 # ─────────────────────────────────────────────────────────────────────
 
-def load_models():
+def load_models(backend=None, timings=None, model_dir=None):
     """
-    Load CNN feature extractors and XGBoost classifiers from MODEL_DIR.
+    Load CNN feature extractors and XGBoost classifiers from `model_dir`
+    (default MODEL_DIR).
+
+    Args:
+        backend : str | None — CNN inference backend (see ml.backends):
+                  "eager", "channels_last", "torchscript", "int8" or
+                  "onnx"; default MAD_INFERENCE_BACKEND, else "eager".
+                  "onnx" falls back to "eager" when onnxruntime is not
+                  installed (see resolve_backend).
+        timings : dict | None — filled with the startup breakdown:
+                  "import_ms" (torch or onnxruntime) and, per model,
+                  "load_ms" (CNN weights) and "xgb_load_ms"
+        model_dir : str | None — another model set's directory (see
+                  ml.registry); default MODEL_DIR
 
     Returns:
-        cnn_models  : dict { name: nn.Sequential }
-        xgb_models  : dict { name: XGBClassifier }
+        cnn_models  : dict { name: nn.Module | OrtBackbone }
+        xgb_models  : dict { name: NativeHead | XGBClassifier } — the
+                      native xgb_<name>.ubj/.json booster when present
+                      (see ml.xgb_native), else the pickled classifier
+
+    When <model_dir>/bundle holds a model bundle (see ml.bundle), the CNN
+    weights are memory-mapped from it and the XGBoost heads read from
+    its .ubj files; nothing is unpickled.
 
     Raises:
         FileNotFoundError if any expected model file is missing.
+        ValueError if a bundle file fails its size or checksum check.
+        ValueError for an unknown backend, or int8 without calibration
+        images / on a GPU.
     """
-    _validate_model_dir()
+    requested = backend or backend_from_env()
+    backend   = resolve_backend(requested)
+    if backend != requested:
+        sys.stderr.write(
+            f"[ml] {requested} backend unavailable (onnxruntime not installed) "
+            f"— falling back to {backend}\n"
+        )
 
-    cnn_models = {}
+    model_dir  = model_dir or MODEL_DIR
+    bundle_dir = find_bundle(model_dir, env_path=model_dir == MODEL_DIR)
+    bundle     = ModelBundle(bundle_dir) if bundle_dir else None
+    _validate_model_dir(backend, bundle, model_dir)
+
+    cnn_models = load_backbones(CNN_MODEL_NAMES, model_dir, backend, bundle, timings)
+    return cnn_models, load_heads(model_dir, bundle, timings)
+
+
+def load_backbones(names, model_dir=None, backend=None, bundle=None, timings=None):
+    """
+    {name: nn.Module | OrtBackbone} for `names` only, from `bundle` where
+    it has the model, else model_dir's .pth (.onnx for ONNX Runtime).
+    `backend` must already be resolved (see resolve_backend).
+    """
+    model_dir = model_dir or MODEL_DIR
+    backend   = backend or resolve_backend()
+    if backend == "onnx":
+        try:
+            from ml.onnx_backend import load_onnx_backbones
+        except ImportError:
+            from onnx_backend import load_onnx_backbones
+        return load_onnx_backbones(model_dir, list(names), timings)
+    return _load_torch_backbones(backend, timings, bundle, model_dir, names)
+
+
+def load_heads(model_dir=None, bundle=None, timings=None):
+    """
+    {name: NativeHead | XGBClassifier} for every model in `model_dir`:
+    from `bundle` when it has the model, else the native booster, else
+    the pickled classifier.  "xgb_load_ms" per model goes to `timings`.
+    """
+    model_dir  = model_dir or MODEL_DIR
+    xgb_models = {}
     for name in CNN_MODEL_NAMES:
-        pth_path = os.path.join(MODEL_DIR, f"cnn_{name}.pth")
+        started = time.perf_counter()
+        if bundle is not None and name in bundle.manifest["models"]:
+            native = bundle.xgb_path(name)
+        else:
+            native = native_path(model_dir, name)
+        if native is not None:
+            xgb_models[name] = NativeHead(native)
+            _record(timings, name, "xgb_load_ms", started)
+            continue
+
+        pkl_path = os.path.join(model_dir, f"xgb_{name}.pkl")
+        if not os.path.exists(pkl_path):
+            raise FileNotFoundError(
+                f"Missing XGBoost model: {pkl_path}\n"
+                f"  → Download xgb_{name}.pkl from your Google Drive "
+                f"(ML-Samples/saved_model/) into backend/ml/models/"
+            )
+        with open(pkl_path, "rb") as f:
+            xgb_models[name] = pickle.load(f)
+        _record(timings, name, "xgb_load_ms", started)
+    return xgb_models
+
+
+def warm_up(cnn_models, xgb_models, timings=None, batch_sizes=(1,), rounds=1, image=None):
+    """
+    Run synthetic batches through every backbone and head.
+
+    The first call of each model pays one-off costs (allocator growth,
+    kernel selection, lazy ONNX Runtime / XGBoost initialisation) that
+    would otherwise land on the first real request — and oneDNN builds
+    its kernels per input shape, so once per batch size.  Each size in
+    `batch_sizes` runs `rounds` times.
+
+    `image` is encoded image bytes (decoded afresh for every sample, as
+    an upload would be) or a PIL image; default a blank 224×224 image.
+
+    Timings: timings["models"][name]["warmup_ms"] is each model's total,
+    timings["warmup"][str(size)] the wall time of each round at that
+    batch size, preprocessing included.
+    """
+    if image is None:
+        image = Image.new("RGB", CNN_INPUT_SIZE)
+    pre       = preprocess_for(cnn_models)
+    if not isinstance(image, (bytes, bytearray)):
+        sample = lambda: image
+    elif ImageContext is not None:
+        sample = lambda: ImageContext(image)
+    else:
+        sample = lambda: Image.open(io.BytesIO(image))
+    model_ms  = dict.fromkeys(CNN_MODEL_NAMES, 0.0)
+    rounds_ms = {}
+
+    for size in batch_sizes:
+        for _ in range(rounds):
+            started = time.perf_counter()
+            batch   = _stack([pre(sample()) for _ in range(size)])
+            for name in CNN_MODEL_NAMES:
+                model_started = time.perf_counter()
+                xgb_models[name].predict_proba(extract_features(cnn_models[name], batch))
+                model_ms[name] += time.perf_counter() - model_started
+            rounds_ms.setdefault(str(size), []).append(
+                round((time.perf_counter() - started) * 1000, 2))
+
+    if timings is not None:
+        for name, seconds in model_ms.items():
+            timings.setdefault("models", {}).setdefault(name, {})["warmup_ms"] = \
+                round(seconds * 1000, 2)
+        timings["warmup"] = rounds_ms
+
+
+def _record(timings, name, key, started):
+    if timings is not None:
+        timings.setdefault("models", {}).setdefault(name, {})[key] = \
+            round((time.perf_counter() - started) * 1000, 2)
+
+
+def resolve_backend(backend=None) -> str:
+    """The backend load_models() will really use for `backend` (default: env)."""
+    backend = backend or backend_from_env()
+    if backend == "onnx" and importlib.util.find_spec("onnxruntime") is None:
+        return "eager"
+    return backend
+
+
+def _load_torch_backbones(backend, timings=None, bundle=None, model_dir=None,
+                          names=CNN_MODEL_NAMES):
+    started = time.perf_counter()
+    _import_torch()
+    if timings is not None:
+        timings["import_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+    calibration = None
+    if backend == "int8":
+        if DEVICE.type != "cpu":
+            raise ValueError("int8 backend runs on CPU only")
+        calibration = load_calibration(preprocess)
+
+    cnn_models = {}
+    for name in names:
+        if bundle is not None and name in bundle.manifest["models"]:
+            started = time.perf_counter()
+            model = _load_mapped(name, bundle)
+            cnn_models[name] = optimize(model, backend, calibration)
+            _record(timings, name, "load_ms", started)
+            continue
+
+        pth_path = os.path.join(model_dir or MODEL_DIR, f"cnn_{name}.pth")
         if not os.path.exists(pth_path):
             raise FileNotFoundError(
                 f"Missing CNN weights: {pth_path}\n"
                 f"  → Download cnn_{name}.pth from your Google Drive "
                 f"(ML-Samples/saved_model/) into backend/ml/models/"
             )
+        started = time.perf_counter()
         model = _BUILDERS[name]()
         # map_location=DEVICE handles CPU-only machines safely
         state = torch.load(pth_path, map_location=DEVICE)
         model.load_state_dict(state)
         model.to(DEVICE).eval()
-        cnn_models[name] = model
+        cnn_models[name] = optimize(model, backend, calibration)
+        _record(timings, name, "load_ms", started)
+    return cnn_models
 
-    xgb_models = {}
-    for name in CNN_MODEL_NAMES:
-        pkl_path = os.path.join(MODEL_DIR, f"xgb_{name}.pkl")
-        if not os.path.exists(pkl_path):
-            raise FileNotFoundError(
-                f"Missing XGBoost model: {pkl_path}\n"
-                f"  → Download xgb_{name}.pkl from your Google Drive "
-                f"(ML-Samples/saved_model/) into backend/ml/models/"
-            )
-        with open(pkl_path, "rb") as f:
-            xgb_models[name] = pickle.load(f)
 
-    return cnn_models, xgb_models
+def _load_mapped(name, bundle):
+    """
+    Backbone whose parameters are views of the bundle's memory map.
 
+    The module is built on the meta device (no weight allocation or
+    random init) and load_state_dict(assign=True) adopts the mapped
+    tensors as its parameters, so the weights are never copied on CPU.
+    """
+    state = {k: torch.from_numpy(v) for k, v in bundle.state_dict(name).items()}
+    with torch.device("meta"):
+        model = _BUILDERS[name]()
+    model.load_state_dict(state, assign=True)
+    if any(t.is_meta for t in model.state_dict().values()):
+        raise ValueError(f"Bundle weights for {name} do not cover the whole model")
+    return model.to(DEVICE).eval()
 
-def _validate_model_dir():
-    if not os.path.isdir(MODEL_DIR):
+
+def _validate_model_dir(backend="eager", bundle=None, model_dir=None):
+    model_dir = model_dir or MODEL_DIR
+    if not os.path.isdir(model_dir):
         raise FileNotFoundError(
-            f"Model directory not found: {MODEL_DIR}\n"
+            f"Model directory not found: {model_dir}\n"
             f"  → Create backend/ml/models/ and place your .pth and .pkl files there."
         )
-    existing = os.listdir(MODEL_DIR)
+    existing = os.listdir(model_dir)
     missing  = []
     for name in CNN_MODEL_NAMES:
-        if f"cnn_{name}.pth" not in existing:
-            missing.append(f"cnn_{name}.pth")
-        if f"xgb_{name}.pkl" not in existing:
+        if bundle is not None and name not in bundle.manifest["models"]:
+            missing.append(f"bundle entry for {name} ({bundle.dir})")
+            continue
+        if (bundle is None or backend == "onnx") and _cnn_file(name, backend) not in existing:
+            missing.append(_cnn_file(name, backend))
+        if bundle is None and native_path(model_dir, name) is None \
+                and f"xgb_{name}.pkl" not in existing:
             missing.append(f"xgb_{name}.pkl")
     if missing:
+        hint = ("Export the .onnx files with `python -m ml.export_onnx`, and "
+                "download the rest" if backend == "onnx" else "Download these")
         raise FileNotFoundError(
-            f"Missing model files in {MODEL_DIR}:\n"
+            f"Missing model files in {model_dir}:\n"
             + "\n".join(f"  - {f}" for f in missing)
-            + "\n\nDownload these from Google Drive (ML-Samples/saved_model/)"
+            + f"\n\n{hint} from Google Drive (ML-Samples/saved_model/)"
         )
 
+
+def _cnn_file(name, backend):
+    return f"cnn_{name}.onnx" if backend == "onnx" else f"cnn_{name}.pth"
+
+
+def model_set_version(model_dir=None, backend=None) -> str:
+    """
+    Identifier of the model set in `model_dir` (default MODEL_DIR).
+
+    MAD_MODEL_VERSION wins if set; otherwise a short fingerprint of the
+    six model files' (.onnx instead of .pth for ONNX) names, sizes and modification times
+    — or, with a model bundle, of its manifest checksums — plus the
+    settings that change scores (draft decode, non-eager `backend`,
+    cascade margin).  Used to key cached results so they are never
+    served across a model or configuration update.
+    """
+    override = os.environ.get("MAD_MODEL_VERSION")
+    if override:
+        return override
+
+    model_dir = model_dir or MODEL_DIR
+    backend   = resolve_backend(backend)
+    bundle    = find_bundle(model_dir, env_path=model_dir == MODEL_DIR)
+    digest    = hashlib.sha256()
+    if bundle is not None:
+        digest.update(f"bundle={ModelBundle(bundle, verify=False).version};".encode())
+    for name in CNN_MODEL_NAMES:
+        paths = (os.path.join(model_dir, _cnn_file(name, backend)),
+                 native_path(model_dir, name) or os.path.join(model_dir, f"xgb_{name}.pkl"))
+        if bundle is not None:
+            paths = paths[:1] if backend == "onnx" else ()
+        for path in paths:
+            fname = os.path.basename(path)
+            st    = os.stat(path)
+            digest.update(f"{fname}:{st.st_size}:{st.st_mtime_ns};".encode())
+    digest.update(f"draft={int(DRAFT_DECODE)}".encode())
+    if backend != "eager":
+        digest.update(f"backend={backend}".encode())
+    if CASCADE_MARGIN is not None:
+        digest.update(f"cascade={CASCADE_MARGIN}".encode())
+    return digest.hexdigest()[:12]
+
+# ─────────────────────────────────────────────────────────────────────
+# PREPROCESSING — image → normalised (3, 224, 224) tensor
+# ─────────────────────────────────────────────────────────────────────
+
+def resize_for_cnn(image_input, draft=None):
+    """
+    Decode + resize one image to the 224×224 RGB PIL image the CNNs see.
+
+    This is the expensive, torch-free half of preprocess(): it can run in
+    another process and ship a small uint8 image back.  INFER_TRANSFORM's
+    Resize leaves an image that is already 224×224 untouched, so
+    preprocess(resize_for_cnn(x)) == preprocess(x).  The resize is PIL
+    bilinear — exactly what transforms.Resize does for PIL images — so
+    it needs no torch import.
+
+    With `draft` (default: DRAFT_DECODE) JPEGs are decoded through
+    libjpeg's DCT scaling straight to the smallest 1/2, 1/4 or 1/8 scale
+    that still covers 224×224, instead of decoding every pixel only to
+    throw ~99% of them away.  An ImageContext takes that path even when
+    forensics has already decoded the full image, so the CNN input (and
+    the score) never depends on which stage ran first.
+    """
+    if draft is None:
+        draft = DRAFT_DECODE
+
+    if isinstance(image_input, str):
+        if not os.path.exists(image_input):
+            raise FileNotFoundError(f"Image not found: {image_input}")
+        img = Image.open(image_input)
+        if draft:
+            img.draft("RGB", CNN_INPUT_SIZE)
+        img = img.convert("RGB")
+    elif ImageContext is not None and isinstance(image_input, ImageContext):
+        img = image_input.draft_rgb(CNN_INPUT_SIZE) if draft else image_input.rgb
+    else:
+        img = image_input.convert("RGB")
+
+    if img.size == CNN_INPUT_SIZE:
+        return img
+    return img.resize(CNN_INPUT_SIZE, Image.BILINEAR)   # = transforms.Resize((224, 224))
+
+
+def preprocess(image_input, draft=None):
+    """
+    Turn one image into the CNN input tensor.
+
+    Accepts the same inputs as predict(); an already-preprocessed
+    (3, 224, 224) tensor is passed through unchanged so callers can
+    decode on other threads/processes and batch later.
+    """
+    _import_torch()
+    if isinstance(image_input, torch.Tensor):
+        return image_input
+    return INFER_TRANSFORM(resize_for_cnn(image_input, draft))   # (3, 224, 224)
+
+
+def preprocess_array(image_input, draft=None):
+    """
+    preprocess() without torch: float32 (3, 224, 224) NumPy array.
+
+    Used by the ONNX Runtime backend.  An ndarray input is passed
+    through unchanged.
+    """
+    if isinstance(image_input, np.ndarray):
+        return image_input
+    arr = np.asarray(resize_for_cnn(image_input, draft), dtype=np.float32) / 255.0
+    arr = (arr - _NP_MEAN) / _NP_STD
+    return np.ascontiguousarray(arr.transpose(2, 0, 1))
+
+
+def preprocess_for(cnn_models):
+    """preprocess or preprocess_array, whichever matches the loaded backbones."""
+    return preprocess_array if _uses_onnx(cnn_models) else preprocess
+
+
+def preprocess_batch(images, cnn_models):
+    """
+    One (N, 3, 224, 224) batch for `cnn_models`: a tensor on DEVICE for
+    the torch backends, a float32 array for ONNX Runtime.
+    """
+    return _stack([preprocess_for(cnn_models)(img) for img in images])
+
+
+def _uses_onnx(cnn_models):
+    return getattr(next(iter(cnn_models.values())), "runtime", "torch") == "onnx"
+
 # ─────────────────────────────────────────────────────────────────────
 # PREDICTION — the main function called per request
 # ─────────────────────────────────────────────────────────────────────
@@ -149,8 +520,9 @@ def predict(image_input, cnn_models, xgb_models):
 
     Parameters
     ----------
-    image_input : str | PIL.Image.Image
-        Absolute file path OR an already-opened PIL image.
+    image_input : str | PIL.Image.Image | df.image_context.ImageContext
+        Absolute file path, an already-opened PIL image, or the
+        per-request decoded context shared with the forensics stage.
     cnn_models  : dict — from load_models()
     xgb_models  : dict — from load_models()
 
@@ -162,40 +534,188 @@ def predict(image_input, cnn_models, xgb_models):
         real_prob   float  0.0–1.0
         fake_prob   float  0.0–1.0
         flag_review bool   True if confidence < 0.75
-        model_votes dict   per-CNN prediction (for debugging)
+        model_votes dict   per-CNN prediction (for debugging) — only the
+                           CNNs that actually ran, in cascade mode
     """
-    # ── Load and preprocess image ────────────────────────────────────
-    if isinstance(image_input, str):
-        if not os.path.exists(image_input):
-            raise FileNotFoundError(f"Image not found: {image_input}")
-        img = Image.open(image_input).convert("RGB")
-    else:
-        img = image_input.convert("RGB")
+    return predict_batch([image_input], cnn_models, xgb_models)[0]
+
 
-    tensor = INFER_TRANSFORM(img).unsqueeze(0).to(DEVICE)  # (1, 3, 224, 224)
+def predict_batch(images, cnn_models, xgb_models, cascade_margin=None,
+                  features_out=None):
+    """
+    Run the ensemble on several images at once.
+
+    Each backbone and each XGBoost head is called once for the whole
+    batch instead of once per image.  BatchNorm layers are in eval mode,
+    so every image gets the same result it would get from predict().
+
+    Parameters
+    ----------
+    images         : list — any inputs accepted by preprocess()
+    cnn_models     : dict — from load_models()
+    xgb_models     : dict — from load_models()
+    cascade_margin : float | None — run CASCADE_ORDER with early exit
+                     (see predict_cascade); default CASCADE_MARGIN
+    features_out   : list | None — if given, receives one dict per image
+                     of {model name: 1-D feature vector} for every CNN
+                     that ran on it (see ml.embeddings)
+
+    Returns
+    -------
+    list[dict] — one predict()-style result per image, in input order.
+    """
+    if not images:
+        return []
+
+    batch = preprocess_batch(images, cnn_models)                         # (N, 3, 224, 224)
+    n     = batch.shape[0]
+
+    if cascade_margin is None:
+        cascade_margin = CASCADE_MARGIN
+    if cascade_margin is not None:
+        return predict_cascade(batch, cnn_models, xgb_models, cascade_margin,
+                               features_out)
+
+    if features_out is not None:
+        features_out[:] = [{} for _ in range(n)]
 
     # ── Extract features + XGBoost predict per CNN ───────────────────
-    all_probs  = []
-    model_votes = {}
+    model_probs = {}
+
+    for name in CNN_MODEL_NAMES:
+        feats = extract_features(cnn_models[name], batch)          # (N, D)
+        model_probs[name] = xgb_models[name].predict_proba(feats)   # (N, 2)
+        if features_out is not None:
+            for i in range(n):
+                features_out[i][name] = feats[i]
+
+    return _soft_vote(model_probs)
+
 
+def predict_from_features(inputs, cnn_models, xgb_models, features):
+    """
+    Full-ensemble predict_batch() that reuses features already computed.
+
+    Models in `cnn_models` run their backbone on `inputs`; the others
+    take their features from `features` (one {name: vector} per input,
+    as predict_batch's `features_out` fills it), so only their XGBoost
+    head runs.  `xgb_models` needs every model.  Used by ml.shadow to
+    score a candidate set against production batches.
+    """
+    if not inputs:
+        return []
+    batch       = None
+    model_probs = {}
+    for name in CNN_MODEL_NAMES:
+        if name in cnn_models:
+            if batch is None:
+                batch = preprocess_batch(inputs, cnn_models)
+            feats = extract_features(cnn_models[name], batch)
+        else:
+            feats = np.stack([f[name] for f in features])
+        model_probs[name] = xgb_models[name].predict_proba(feats)
+    return _soft_vote(model_probs)
+
+
+def _soft_vote(model_probs):
+    """predict()-style results from {name: (N, 2) probabilities} of every model."""
+    stacked   = np.stack([model_probs[name] for name in CNN_MODEL_NAMES])  # (M, N, 2)
+    avg_probs = stacked.mean(axis=0)                                       # (N, 2)
+    vote_idx  = stacked.argmax(axis=2).T.tolist()                          # (N, M)
+
+    model_votes = [
+        {name: LABEL_MAP[v] for name, v in zip(CNN_MODEL_NAMES, row)}
+        for row in vote_idx
+    ]
+    return _format_results(avg_probs, model_votes)
+
+
+def predict_cascade(batch, cnn_models, xgb_models, margin, features_out=None):
+    """
+    Early-exit ensemble over a preprocessed (N, 3, 224, 224) batch.
+
+    Backbones run in CASCADE_ORDER.  After each stage the soft vote of
+    the models run so far is checked per image; images whose winning
+    probability reaches `margin` are finished, and only the rest are
+    passed to the next (more expensive) backbone.  With margin > 1 this
+    is the full ensemble.  `features_out` as for predict_batch().
+    """
+    n         = batch.shape[0]
+    prob_sum  = np.zeros((n, 2))
+    ran       = np.zeros(n, dtype=np.int64)
+    votes     = [{} for _ in range(n)]
+    active    = np.arange(n)
+    if features_out is not None:
+        features_out[:] = [{} for _ in range(n)]
+
+    for stage, name in enumerate(CASCADE_ORDER):
+        feats = extract_features(cnn_models[name], _take(batch, active))
+        probs = xgb_models[name].predict_proba(feats)                   # (A, 2)
+
+        prob_sum[active] += probs
+        ran[active]      += 1
+        for row, (i, v) in enumerate(zip(active.tolist(), probs.argmax(axis=1).tolist())):
+            votes[i][name] = LABEL_MAP[v]
+            if features_out is not None:
+                features_out[i][name] = feats[row]
+
+        if stage == len(CASCADE_ORDER) - 1:
+            break
+        avg    = prob_sum[active] / ran[active, None]
+        active = active[~cascade_exit(avg, margin)]
+        if len(active) == 0:
+            break
+
+    return _format_results(prob_sum / ran[:, None], votes)
+
+
+def cascade_exit(avg_probs, margin):
+    """Boolean mask of rows of (N, 2) soft-vote probabilities confident enough to stop."""
+    return np.max(avg_probs, axis=1) >= margin
+
+
+# ── Batch helpers: NumPy batches for ONNX Runtime, tensors for torch ──
+
+def _stack(inputs):
+    if isinstance(inputs[0], np.ndarray):
+        return np.stack(inputs)
+    return torch.stack(inputs).to(DEVICE)
+
+
+def _take(batch, rows):
+    if isinstance(batch, np.ndarray):
+        return batch[rows]
+    return batch[torch.from_numpy(rows)]
+
+
+def extract_features(cnn, batch):
+    """
+    Run one backbone on a preprocess_batch() batch and flatten its
+    output to an (N, D) NumPy array, whichever the backend.
+    """
+    n = batch.shape[0]
+    if isinstance(batch, np.ndarray):
+        return cnn(batch).reshape(n, -1)
     with torch.no_grad():
-        for name in CNN_MODEL_NAMES:
-            cnn   = cnn_models[name]
-            feat  = cnn(tensor).view(1, -1).cpu().numpy()          # flatten
-            probs = xgb_models[name].predict_proba(feat)[0]        # [p_real, p_fake]
-            all_probs.append(probs)
-            model_votes[name] = LABEL_MAP[int(np.argmax(probs))]
-
-    # ── Soft-vote ensemble ───────────────────────────────────────────
-    avg_probs  = np.mean(all_probs, axis=0)          # shape (2,)
-    pred_class = int(np.argmax(avg_probs))
-    confidence = float(avg_probs[pred_class])
-
-    return {
-        "prediction" : LABEL_MAP[pred_class],
-        "confidence" : round(confidence, 4),
-        "real_prob"  : round(float(avg_probs[0]), 4),
-        "fake_prob"  : round(float(avg_probs[1]), 4),
-        "flag_review": confidence < 0.75,
-        "model_votes": model_votes,
-    }
+        return cnn(batch).view(n, -1).cpu().numpy()
+
+
+def _format_results(avg_probs, model_votes):
+    """predict()-style dicts from (N, 2) soft-vote probabilities + per-image votes."""
+    pred_class = avg_probs.argmax(axis=1).tolist()
+    confidence = avg_probs.max(axis=1).tolist()
+    real_prob  = avg_probs[:, 0].tolist()
+    fake_prob  = avg_probs[:, 1].tolist()
+
+    return [
+        {
+            "prediction" : LABEL_MAP[cls],
+            "confidence" : round(conf, 4),
+            "real_prob"  : round(real, 4),
+            "fake_prob"  : round(fake, 4),
+            "flag_review": conf < 0.75,
+            "model_votes": votes,
+        }
+        for cls, conf, real, fake, votes
+        in zip(pred_class, confidence, real_prob, fake_prob, model_votes)
+    ]
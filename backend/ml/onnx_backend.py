@@ -0,0 +1,93 @@
+"""
+backend/ml/onnx_backend.py
+============================
+ONNX Runtime serving path for the CNN feature extractors.
+
+load_models(backend="onnx") (or MAD_INFERENCE_BACKEND=onnx) loads
+MODEL_DIR/cnn_<name>.onnx — produced by `python -m ml.export_onnx` —
+into CPU InferenceSessions instead of building the torch backbones.
+Nothing here imports torch; preprocessing goes through
+ml.inference.preprocess_array().
+
+Thread tuning:
+    MAD_ORT_INTRA_THREADS  threads inside one operator (default: cores)
+    MAD_ORT_INTER_THREADS  operators run in parallel   (default: 1)
+The batcher runs one backbone at a time, and these graphs are a plain
+chain of convolutions, so parallelism belongs inside the operators.
+"""
+
+import os
+import time
+
+import numpy as np
+
+
+def _env_threads(name, default):
+    try:
+        return max(0, int(os.environ.get(name, default)))
+    except ValueError:
+        return default
+
+
+class OrtBackbone:
+    """
+    One backbone as an ONNX Runtime session.
+
+    Called like the torch module it replaces: (N, 3, 224, 224) float32
+    in, feature array out.
+    """
+
+    runtime = "onnx"
+
+    def __init__(self, path: str, intra_threads: int | None = None,
+                 inter_threads: int | None = None):
+        import onnxruntime as ort
+
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        opts.execution_mode           = ort.ExecutionMode.ORT_SEQUENTIAL
+        opts.intra_op_num_threads     = (
+            intra_threads if intra_threads is not None
+            else _env_threads("MAD_ORT_INTRA_THREADS", os.cpu_count() or 1)
+        )
+        opts.inter_op_num_threads     = (
+            inter_threads if inter_threads is not None
+            else _env_threads("MAD_ORT_INTER_THREADS", 1)
+        )
+
+        self.path       = path
+        self.session    = ort.InferenceSession(
+            path, sess_options=opts, providers=["CPUExecutionProvider"]
+        )
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, batch: np.ndarray) -> np.ndarray:
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        return self.session.run(None, {self.input_name: batch})[0]
+
+
+def load_onnx_backbones(model_dir: str, names, timings=None) -> dict:
+    """
+    {name: OrtBackbone} for MODEL_DIR/cnn_<name>.onnx.  With `timings`,
+    records "import_ms" (onnxruntime) and per-model "load_ms" as
+    load_models() does.
+    """
+    started = time.perf_counter()
+    import onnxruntime  # noqa: F401 — timed here, used by OrtBackbone
+    if timings is not None:
+        timings["import_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+    backbones = {}
+    for name in names:
+        started = time.perf_counter()
+        path = os.path.join(model_dir, f"cnn_{name}.onnx")
+        if not os.path.exists(path):
+            raise FileNotFoundError(
+                f"Missing ONNX model: {path}\n"
+                f"  → Run `python -m ml.export_onnx` from backend/ first."
+            )
+        backbones[name] = OrtBackbone(path)
+        if timings is not None:
+            timings.setdefault("models", {}).setdefault(name, {})["load_ms"] = \
+                round((time.perf_counter() - started) * 1000, 2)
+    return backbones
@@ -0,0 +1,209 @@
+"""
+backend/ml/registry.py
+========================
+Hot-swappable model sets.
+
+Replacing the files in ml/models/ used to mean restarting the worker
+and dropping everything in flight.  The registry holds the model set
+new requests use and can load another one — the same directory after
+its files were replaced, or a versioned directory next to it — while
+the current set keeps serving:
+
+    registry.reload("/srv/models/2024-06")   # blocks until swapped
+
+Each ModelSet owns its models, its MicroBatcher (so a CNN batch never
+mixes two sets) and anything else built for it, and is identified by
+its model_set_version.  Requests lease the current set for their whole
+run; a swap only changes what the *next* lease gets.  The replaced
+set is closed, and its models freed, once its last lease is returned.
+
+Until the swap completes both sets are in memory.  Bundled weights
+(ml/bundle.py) are file-backed and cost page cache rather than
+private memory; a bundle rewritten by `python -m ml.bundle` replaces
+its files, so a set still mapping the old ones is unaffected.
+"""
+
+import sys
+import time
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+
+class ModelSet:
+    """One loaded model set and the batcher serving it."""
+
+    def __init__(self, version, cnn_models, xgb_models, batcher, resources=(),
+                 model_dir=None):
+        self.version    = version
+        self.model_dir  = model_dir
+        self.cnn_models = cnn_models
+        self.xgb_models = xgb_models
+        self.batcher    = batcher
+        self.resources  = list(resources)   # closed along with the set
+        self.loaded_at  = time.time()
+        self.leases     = 0
+        self.retired    = False
+
+    def submit(self, image, key=None):
+        """MicroBatcher.submit on this set's batcher."""
+        return self.batcher.submit(image, key)
+
+    def close(self):
+        self.batcher.close()
+        for resource in self.resources:
+            try:
+                resource.close()
+            except Exception as exc:
+                sys.stderr.write(f"[ml-registry] closing {self.version}: {exc}\n")
+        self.cnn_models = self.xgb_models = self.batcher = None
+        self.resources  = []
+
+
+class ModelRegistry:
+    """
+    The current ModelSet, swappable at runtime.
+
+    Parameters
+    ----------
+    build_set : callable(model_dir | None) → ModelSet
+        loads, warms up and wraps one model set (default directory for
+        None); called on the reloading thread
+    """
+
+    def __init__(self, build_set):
+        self._build_set = build_set
+        self._current   = None
+        self._first     = Future()     # resolves once a set is installed
+        self._lock      = threading.Lock()
+        self._reloading = threading.Lock()
+        self._retiring  = []
+        self.swaps      = 0
+
+    # ── Installing / swapping ────────────────────────────────────────
+
+    def install(self, model_set):
+        """
+        Make `model_set` current.  A Future of one (a background load) is
+        installed when it resolves; leases wait for it until then.
+        """
+        if isinstance(model_set, Future):
+            model_set.add_done_callback(self._install_future)
+            return
+        with self._lock:
+            old, self._current = self._current, model_set
+            if old is not None:
+                old.retired = True
+                self.swaps += 1
+                if old.leases:
+                    self._retiring.append(old)
+                    old = None
+        if not self._first.done():
+            self._first.set_result(None)
+        if old is not None:
+            old.close()
+
+    def reload(self, model_dir=None) -> dict:
+        """
+        Build a set from `model_dir` and swap it in.  Blocks until done;
+        raises RuntimeError while another reload is running, or whatever
+        loading raised (the current set then stays in place).
+        """
+        if not self._reloading.acquire(blocking=False):
+            raise RuntimeError("A model reload is already in progress")
+        try:
+            started  = time.perf_counter()
+            previous = self.version
+            new_set  = self._build_set(model_dir)
+            self.install(new_set)
+            return {
+                "model_version": new_set.version,
+                "previous"     : previous,
+                "model_dir"    : new_set.model_dir,
+                "reload_ms"    : round((time.perf_counter() - started) * 1000, 2),
+            }
+        finally:
+            self._reloading.release()
+
+    # ── Leasing ──────────────────────────────────────────────────────
+
+    def acquire(self) -> ModelSet:
+        """
+        The current set, held until release().  Waits for the first set
+        while it is still loading; raises if that load failed.
+        """
+        self._first.result()
+        with self._lock:
+            current = self._current
+            current.leases += 1
+            return current
+
+    def release(self, model_set: ModelSet):
+        with self._lock:
+            model_set.leases -= 1
+            free = model_set.retired and model_set.leases == 0
+            if free:
+                self._retiring.remove(model_set)
+        if free:
+            model_set.close()
+
+    @contextmanager
+    def lease(self):
+        model_set = self.acquire()
+        try:
+            yield model_set
+        finally:
+            self.release(model_set)
+
+    # ── Introspection ────────────────────────────────────────────────
+
+    @property
+    def version(self):
+        """Version of the current set (None while the first one loads)."""
+        current = self._current
+        return current.version if current is not None else None
+
+    def backlog(self) -> int:
+        """Images waiting for the current set's next batch."""
+        current = self._current
+        return current.batcher.backlog() if current is not None and current.batcher else 0
+
+    def in_flight(self) -> int:
+        """Requests holding a lease, on any set."""
+        with self._lock:
+            sets = self._retiring + [self._current]
+            return sum(s.leases for s in sets if s is not None)
+
+    @property
+    def ready(self) -> bool:
+        return self._first.done() and self._first.exception() is None
+
+    def stats(self) -> dict:
+        with self._lock:
+            current = self._current
+            return {
+                "model_version": current.version if current is not None else None,
+                "model_dir"    : current.model_dir if current is not None else None,
+                "leases"       : current.leases if current is not None else 0,
+                "swaps"        : self.swaps,
+                "retiring"     : [{"model_version": s.version, "leases": s.leases}
+                                  for s in self._retiring],
+                "reloading"    : self._reloading.locked(),
+            }
+
+    def close(self):
+        """Close the current set (and any still draining)."""
+        with self._lock:
+            sets, self._current = self._retiring + [self._current], None
+            self._retiring = []
+        for model_set in sets:
+            if model_set is not None:
+                model_set.close()
+
+    def _install_future(self, future):
+        exc = future.exception()
+        if exc is not None:
+            if not self._first.done():
+                self._first.set_exception(exc)
+            return
+        self.install(future.result())
@@ -0,0 +1,367 @@
+"""
+backend/ml/shadow.py
+======================
+Shadow evaluation of a candidate model set on live traffic.
+
+A candidate (a retrained XGBoost head, a new backbone) is scored on
+the same images as production, but never on the request path: the
+MicroBatcher hands each finished batch to ShadowEvaluator.offer()
+after its Futures are resolved, which only queues it.  A single
+background thread at lowered OS priority (MAD_SHADOW_NICE) scores the
+queued batches and logs where the candidate disagrees.
+
+Shadow work waits for idle time and is shed before production waits:
+    - a queued batch is only scored while `busy()` is False; the worker
+      passes "no images waiting for a batch and fewer than
+      MAD_SHADOW_MAX_INFLIGHT requests in flight"
+    - the queue holds MAD_SHADOW_QUEUE batches; offers beyond that are
+      dropped, not queued, so under sustained load nearly all shadow
+      work is shed
+    - MAD_SHADOW_SAMPLE < 1 scores only that fraction of batches
+Dropped images are counted ("shed") in stats().
+
+The candidate lives in MAD_SHADOW_MODEL_DIR: XGBoost heads for every
+model (xgb_<name>.ubj/.json/.pkl, or a bundle) and CNN weights only for
+the backbones it changes.  Models without their own backbone reuse the
+features production already computed for the batch, so trialling a
+new head costs one predict_proba per batch.  With MAD_CASCADE_MARGIN
+set, production may not have run every backbone; images missing a
+feature the candidate needs are skipped.
+
+Disagreements — a different label, or a fake probability at least
+MAD_SHADOW_DELTA (default 0.1) apart — are appended to MAD_SHADOW_LOG
+(default <shadow dir>/shadow_disagreements.bin), 48-byte rows:
+
+    uint32  unix time
+    32 B    image SHA-256
+    float32 production fake_prob
+    float32 shadow fake_prob
+    uint8   production label (0 real, 1 fake)
+    uint8   shadow label
+    2 B     padding
+
+    python -m ml.shadow summary <log>
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import random
+import struct
+import argparse
+import threading
+
+import numpy as np
+
+try:
+    from ml.inference import (
+        CNN_MODEL_NAMES, LABEL_MAP, load_backbones, load_heads, predict_from_features,
+        resolve_backend,
+    )
+    from ml.bundle import ModelBundle, find_bundle
+except ImportError:
+    from inference import (
+        CNN_MODEL_NAMES, LABEL_MAP, load_backbones, load_heads, predict_from_features,
+        resolve_backend,
+    )
+    from bundle import ModelBundle, find_bundle
+
+
+DEFAULT_QUEUE = 8
+DEFAULT_DELTA = 0.1
+DEFAULT_NICE  = 10
+LOG_NAME      = "shadow_disagreements.bin"
+
+_ROW   = struct.Struct("<I32sffBB2x")
+_DTYPE = np.dtype([
+    ("time",         "<u4"),
+    ("sha256",       "u1", (32,)),
+    ("prod_fake",    "<f4"),
+    ("shadow_fake",  "<f4"),
+    ("prod_label",   "u1"),
+    ("shadow_label", "u1"),
+    ("pad",          "V2"),
+])
+_FAKE  = {label: cls for cls, label in LABEL_MAP.items()}
+_STOP  = object()
+
+_IDLE_POLL_S = 0.005
+
+
+class ShadowEvaluator:
+    """
+    Scores a candidate model set on production batches, off the request path.
+
+    Parameters
+    ----------
+    model_dir : str        — candidate set (see module doc)
+    log_path  : str|None   — disagreement log (default <model_dir>/shadow_disagreements.bin)
+    max_queue : int        — batches waiting to be scored before offers are shed
+    sample    : float      — fraction of batches to score (0–1)
+    delta     : float      — fake_prob difference that counts as a disagreement
+    busy      : callable() → bool, optional — True while production needs
+                             the CPU; queued batches wait until it is False
+    nice      : int        — niceness added to the shadow thread (Linux)
+    """
+
+    def __init__(self, model_dir: str, log_path: str | None = None,
+                 max_queue: int = DEFAULT_QUEUE, sample: float = 1.0,
+                 delta: float = DEFAULT_DELTA, busy=None, nice: int = DEFAULT_NICE):
+        self.model_dir = model_dir
+        self.log_path  = log_path or os.path.join(model_dir, LOG_NAME)
+        self.sample    = min(1.0, max(0.0, float(sample)))
+        self.delta     = float(delta)
+        self.nice      = int(nice)
+        self._busy     = busy or (lambda: False)
+        self._queue    = queue.Queue(maxsize=max(1, int(max_queue)))
+        self._thread   = None
+        self._closing  = False
+        self._loaded   = threading.Event()
+        self.error     = None
+
+        self.cnn_models = {}
+        self.xgb_models = {}
+        self.counters   = {"offered": 0, "shed": 0, "skipped": 0,
+                           "evaluated": 0, "disagreements": 0, "label_flips": 0}
+        self._lock      = threading.Lock()
+
+    @classmethod
+    def from_env(cls, busy=None):
+        """Evaluator for MAD_SHADOW_MODEL_DIR and MAD_SHADOW_*, or None when unset."""
+        model_dir = os.environ.get("MAD_SHADOW_MODEL_DIR", "").strip()
+        if not model_dir:
+            return None
+
+        def number(name, default, cast):
+            try:
+                return cast(os.environ.get(name, default))
+            except ValueError:
+                return default
+
+        return cls(
+            model_dir,
+            log_path =os.environ.get("MAD_SHADOW_LOG") or None,
+            max_queue=number("MAD_SHADOW_QUEUE",  DEFAULT_QUEUE, int),
+            sample   =number("MAD_SHADOW_SAMPLE", 1.0,           float),
+            delta    =number("MAD_SHADOW_DELTA",  DEFAULT_DELTA, float),
+            busy     =busy,
+            nice     =number("MAD_SHADOW_NICE",   DEFAULT_NICE,  int),
+        )
+
+    # ── Lifecycle ────────────────────────────────────────────────────
+
+    def start(self):
+        """Load the candidate and start scoring, both on the shadow thread."""
+        self._thread = threading.Thread(target=self._run, name="ml-shadow", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        if self._thread is None:
+            return
+        self._closing = True
+        while True:
+            try:
+                self._queue.put_nowait(_STOP)
+                break
+            except queue.Full:
+                self._drain()
+        self._thread.join()
+        self._thread = None
+
+    # ── Producer side (batcher thread) ───────────────────────────────
+
+    def offer(self, inputs, results, features, keys):
+        """
+        Queue one finished production batch; never blocks.  The batch is
+        shed when the candidate is not loaded yet, is sampled out, or the
+        queue is full.
+        """
+        n = len(results)
+        with self._lock:
+            self.counters["offered"] += n
+        if not self._loaded.is_set() or self.error is not None \
+                or (self.sample < 1.0 and random.random() >= self.sample):
+            self._count("shed", n)
+            return
+        try:
+            self._queue.put_nowait((inputs, results, features, keys))
+        except queue.Full:
+            self._count("shed", n)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self.counters,
+                "model_dir": self.model_dir,
+                "loaded"   : self._loaded.is_set() and self.error is None,
+                "error"    : self.error,
+                "backbones": sorted(self.cnn_models),
+                "queued"   : self._queue.qsize(),
+                "log"      : self.log_path,
+            }
+
+    # ── Shadow thread ────────────────────────────────────────────────
+
+    def _run(self):
+        _lower_priority(self.nice)
+        try:
+            self._load()
+        except Exception as exc:
+            self.error = f"{type(exc).__name__}: {exc}"
+            sys.stderr.write(f"[ml-shadow] cannot load {self.model_dir}: {self.error}\n")
+            self._loaded.set()
+            return
+        self._loaded.set()
+
+        with open(self.log_path, "ab") as log:
+            while True:
+                item = self._queue.get()
+                if item is _STOP:
+                    return
+                while self._busy() and not self._closing:
+                    time.sleep(_IDLE_POLL_S)
+                if self._closing:
+                    self._count("shed", len(item[1]))
+                    continue
+                try:
+                    rows = self._evaluate(*item)
+                except Exception as exc:
+                    sys.stderr.write(f"[ml-shadow] batch failed: {exc}\n")
+                    self._count("skipped", len(item[1]))
+                    continue
+                if rows:
+                    log.write(b"".join(rows))
+                    log.flush()
+
+    def _load(self):
+        backend    = resolve_backend()
+        bundle_dir = find_bundle(self.model_dir, env_path=False)
+        bundle     = ModelBundle(bundle_dir) if bundle_dir else None
+        own        = [
+            name for name in CNN_MODEL_NAMES
+            if (bundle is not None and name in bundle.manifest["models"])
+            or os.path.exists(os.path.join(
+                self.model_dir, f"cnn_{name}.{'onnx' if backend == 'onnx' else 'pth'}"))
+        ]
+        self.xgb_models = load_heads(self.model_dir, bundle)
+        self.cnn_models = load_backbones(own, self.model_dir, backend, bundle) if own else {}
+
+    def _evaluate(self, inputs, results, features, keys):
+        """Score one batch; returns the log rows of its disagreements."""
+        reused = [name for name in CNN_MODEL_NAMES if name not in self.cnn_models]
+        rows   = [
+            i for i in range(len(results))
+            if not reused or (features is not None and all(name in features[i] for name in reused))
+        ]
+        self._count("skipped", len(results) - len(rows))
+        if not rows:
+            return []
+
+        shadow = predict_from_features(
+            [inputs[i] for i in rows], self.cnn_models, self.xgb_models,
+            [features[i] for i in rows] if features is not None else None,
+        )
+
+        out, now, flips = [], int(time.time()), 0
+        for i, candidate in zip(rows, shadow):
+            prod         = results[i]
+            prod_label   = _FAKE[prod["prediction"]]
+            shadow_label = _FAKE[candidate["prediction"]]
+            flips       += prod_label != shadow_label
+            if prod_label == shadow_label and \
+                    abs(candidate["fake_prob"] - prod["fake_prob"]) < self.delta:
+                continue
+            sha = bytes.fromhex(keys[i]) if keys[i] else bytes(32)
+            out.append(_ROW.pack(now, sha, prod["fake_prob"], candidate["fake_prob"],
+                                 prod_label, shadow_label))
+
+        with self._lock:
+            self.counters["evaluated"]     += len(rows)
+            self.counters["disagreements"] += len(out)
+            self.counters["label_flips"]   += flips
+        return out
+
+    # ── Helpers ──────────────────────────────────────────────────────
+
+    def _count(self, key, n):
+        with self._lock:
+            self.counters[key] += n
+
+    def _drain(self):
+        try:
+            while True:
+                item = self._queue.get_nowait()
+                if item is not _STOP:
+                    self._count("shed", len(item[1]))
+        except queue.Empty:
+            pass
+
+
+def _lower_priority(nice):
+    # On Linux a thread id is a valid PRIO_PROCESS target and only that
+    # thread (and the threads it starts, e.g. its OpenMP team) is reniced
+    if nice <= 0 or not hasattr(os, "setpriority") or not hasattr(threading, "get_native_id"):
+        return
+    try:
+        tid = threading.get_native_id()
+        os.setpriority(os.PRIO_PROCESS, tid, os.getpriority(os.PRIO_PROCESS, tid) + nice)
+    except OSError as exc:
+        sys.stderr.write(f"[ml-shadow] could not lower thread priority: {exc}\n")
+
+
+# ─────────────────────────────────────────────────────────────────────
+# LOG READER
+# ─────────────────────────────────────────────────────────────────────
+
+def read_log(path: str) -> np.ndarray:
+    """Disagreement rows as a structured array (a torn last row is ignored)."""
+    size = os.path.getsize(path) // _ROW.size * _ROW.size
+    if size == 0:
+        return np.zeros(0, dtype=_DTYPE)
+    return np.fromfile(path, dtype=_DTYPE, count=size // _ROW.size)
+
+
+def summarize(path: str) -> dict:
+    rows = read_log(path)
+    if len(rows) == 0:
+        return {"rows": 0}
+    flips = rows["prod_label"] != rows["shadow_label"]
+    return {
+        "rows"           : int(len(rows)),
+        "first"          : int(rows["time"].min()),
+        "last"           : int(rows["time"].max()),
+        "label_flips"    : int(flips.sum()),
+        "real_to_fake"   : int((flips & (rows["shadow_label"] == 1)).sum()),
+        "fake_to_real"   : int((flips & (rows["shadow_label"] == 0)).sum()),
+        "mean_abs_delta" : round(float(np.abs(rows["shadow_fake"] - rows["prod_fake"]).mean()), 4),
+        "distinct_images": int(len(np.unique(rows["sha256"], axis=0))),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect a shadow disagreement log.")
+    sub    = parser.add_subparsers(dest="command", required=True)
+    for name, help_text in (("summary", "counts and label flips"),
+                            ("dump",    "one JSON line per disagreement")):
+        sub.add_parser(name, help=help_text).add_argument("log")
+    args = parser.parse_args(argv)
+
+    if args.command == "summary":
+        sys.stdout.write(json.dumps(summarize(args.log), indent=2) + "\n")
+        return
+    for row in read_log(args.log):
+        sys.stdout.write(json.dumps({
+            "time"        : int(row["time"]),
+            "sha256"      : row["sha256"].tobytes().hex(),
+            "prod_fake"   : round(float(row["prod_fake"]), 4),
+            "shadow_fake" : round(float(row["shadow_fake"]), 4),
+            "prod"        : LABEL_MAP[int(row["prod_label"])],
+            "shadow"      : LABEL_MAP[int(row["shadow_label"])],
+        }) + "\n")
+
+
+if __name__ == "__main__":
+    main()
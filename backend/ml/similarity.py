@@ -0,0 +1,439 @@
+"""
+backend/ml/similarity.py
+==========================
+Nearest-neighbour search over CNN embeddings of labelled receipts.
+
+Fraudsters reuse templates with small edits; such near-copies land
+close together in the backbones' feature space even when the pixels
+differ.  A FraudIndex holds L2-normalised embeddings of receipts with
+a known label and returns the top-k most similar ones (cosine
+distance) for a new upload.
+
+Embedding: one backbone's features, mobilenet_v2 by default because it
+runs for every image, including those the early-exit cascade stops
+early.  Its 1280×7×7 map is average-pooled to 1280 values
+(MAD_SIMILARITY_MODEL picks another backbone).
+
+Search:
+    brute force   a float32 product over all vectors, converted from
+                  float16 a block of rows at a time; used until the
+                  index is trained
+    IVF           spherical k-means centroids; a query only scans the
+                  `nprobe` nearest lists.  At ~1M vectors use
+                  nlist ≈ 1000–4000, nprobe ≈ 8–16.
+Inserts append to the vectors and to their IVF list — nothing is
+rebuilt.  Vectors are stored as float16 (ranking is unaffected at the
+~1e-3 level) to halve memory.
+
+On disk (append-only except meta/centroids):
+    <dir>/meta.json        {"dim", "model", "nlist"}
+    <dir>/vectors.f16      normalised rows
+    <dir>/items.jsonl      {"sha256", "label", "note"} per row
+    <dir>/centroids.npy    IVF centroids (after train())
+    <dir>/lists.i32        IVF list of every row (after train())
+
+Build from the embedding store:
+    python -m ml.similarity build --embeddings /data/emb \\
+        --labels labels.csv --out /data/fraud-index --nlist 1024
+where labels.csv has `sha256,label[,note]` lines.  The worker loads
+MAD_FRAUD_INDEX and answers {"cmd": "index_add", ...} to add
+confirmed cases while running.
+"""
+
+import os
+import sys
+import csv
+import json
+import argparse
+import threading
+
+import numpy as np
+
+
+DEFAULT_MODEL  = "mobilenet_v2"
+DEFAULT_K      = 5
+DEFAULT_NPROBE = 8
+
+# Backbones whose flattened output is a (channels, H, W) map; pooled
+# to `channels` values for similarity search.
+_POOL_CHANNELS = {"mobilenet_v2": 1280}
+
+_KMEANS_ITERS  = 10
+
+# Rows converted to float32 per step of a search (~20 MB at dim 1280),
+# so a query never materialises a float32 copy of the whole index.
+_SEARCH_CHUNK  = 4096
+_KMEANS_SAMPLE = 65_536
+
+
+def embedding_vector(features: dict, model: str = DEFAULT_MODEL) -> np.ndarray:
+    """The normalised search vector for one image's {name: features}."""
+    vec = np.asarray(features[model], dtype=np.float32).ravel()
+    channels = _POOL_CHANNELS.get(model)
+    if channels and vec.size > channels and vec.size % channels == 0:
+        vec = vec.reshape(channels, -1).mean(axis=1)
+    return _normalise(vec[None, :])[0]
+
+
+def _normalise(mat):
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    return mat / np.maximum(norms, 1e-12)
+
+
+def _similarities(vectors, query, rows=None):
+    """
+    float32 `vectors[rows] @ query` (all rows when None), converting
+    _SEARCH_CHUNK float16 rows at a time.
+    """
+    total = len(vectors) if rows is None else len(rows)
+    out   = np.empty(total, dtype=np.float32)
+    query = np.asarray(query, dtype=np.float32)
+    for start in range(0, total, _SEARCH_CHUNK):
+        stop  = min(start + _SEARCH_CHUNK, total)
+        block = vectors[start:stop] if rows is None else vectors[rows[start:stop]]
+        np.matmul(block.astype(np.float32), query, out=out[start:stop])
+    return out
+
+
+class FraudIndex:
+    """
+    Growable cosine-similarity index with optional IVF partitioning.
+
+    Thread-safe: searches run concurrently with inserts and only see
+    rows that were completely added before they started.
+    """
+
+    def __init__(self, dim: int | None = None, model: str = DEFAULT_MODEL,
+                 path: str | None = None, nprobe: int = DEFAULT_NPROBE):
+        """`dim` may be None until the first add() fixes it."""
+        self.dim    = int(dim) if dim else None
+        self.model  = model
+        self.path   = path
+        self.nprobe = nprobe
+
+        self._vectors   = np.zeros((1024, self.dim or 0), dtype=np.float16)
+        self._size      = 0
+        self._items     = []
+        self._centroids = None
+        self._lists     = None           # list of growable int32 arrays
+        self._list_len  = None
+        self._lock      = threading.Lock()
+        self._files     = None
+
+    # ── Persistence ──────────────────────────────────────────────────
+
+    @classmethod
+    def open(cls, path: str, nprobe: int = DEFAULT_NPROBE) -> "FraudIndex":
+        """Load an index directory written by save() / inserts."""
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        index = cls(meta["dim"], meta.get("model", DEFAULT_MODEL), path, nprobe)
+
+        items   = _read_items(os.path.join(path, "items.jsonl"))
+        vectors = np.fromfile(os.path.join(path, "vectors.f16"), dtype=np.float16)
+        rows    = min(len(items), vectors.size // index.dim)
+        index._append_rows(vectors[:rows * index.dim].reshape(rows, index.dim), items[:rows])
+        # Drop anything a crash left past the last complete row
+        _truncate(os.path.join(path, "vectors.f16"), rows * index.dim * 2)
+        _truncate(os.path.join(path, "lists.i32"),   rows * 4)
+
+        centroids_path = os.path.join(path, "centroids.npy")
+        if os.path.exists(centroids_path):
+            centroids = np.load(centroids_path)
+            assign    = np.fromfile(os.path.join(path, "lists.i32"), dtype=np.int32)
+            if len(assign) < rows:                      # rows added after a crash
+                extra  = index._nearest_centroids(index._vectors[len(assign):rows], centroids)
+                assign = np.concatenate([assign, extra])
+                with open(os.path.join(path, "lists.i32"), "ab") as f:
+                    f.write(extra.tobytes())
+            index._set_ivf(centroids, assign[:rows])
+        return index
+
+    def save(self, path: str):
+        """Write the whole index to `path`; later inserts append there."""
+        os.makedirs(path, exist_ok=True)
+        with self._lock:
+            self._close_files()
+            self.path = path
+            self._write_meta(path)
+            self._vectors[:self._size].tofile(os.path.join(path, "vectors.f16"))
+            with open(os.path.join(path, "items.jsonl"), "w", encoding="utf-8") as f:
+                for item in self._items:
+                    f.write(json.dumps(item) + "\n")
+            if self._centroids is not None:
+                np.save(os.path.join(path, "centroids.npy"), self._centroids)
+                self._assignments().tofile(os.path.join(path, "lists.i32"))
+
+    def close(self):
+        with self._lock:
+            self._close_files()
+
+    # ── Building ─────────────────────────────────────────────────────
+
+    def add(self, vectors: np.ndarray, items: list):
+        """
+        Insert (N, dim) embeddings with their {"sha256", "label", ...}
+        records.  Vectors are normalised here; with an IVF each row
+        joins its nearest list.  Persisted immediately when the index
+        has a path.
+        """
+        vectors = _normalise(np.atleast_2d(np.asarray(vectors, dtype=np.float32)))
+        with self._lock:
+            if self.dim is None:
+                self.dim      = vectors.shape[1]
+                self._vectors = np.zeros((1024, self.dim), dtype=np.float16)
+                if self.path:
+                    self._write_meta(self.path)
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f"expected {self.dim}-dim vectors, got {vectors.shape[1]}")
+            start = self._size
+            self._append_rows(vectors.astype(np.float16), items)
+            assign = None
+            if self._centroids is not None:
+                assign = self._nearest_centroids(vectors, self._centroids)
+                self._add_to_lists(np.arange(start, self._size), assign)
+            if self.path:
+                self._persist(vectors.astype(np.float16), items, assign)
+
+    def train(self, nlist: int, seed: int = 0):
+        """(Re)build IVF centroids with spherical k-means over the stored vectors."""
+        with self._lock:
+            data = self._vectors[:self._size].astype(np.float32)
+            if len(data) < nlist:
+                raise ValueError(f"need at least nlist={nlist} vectors, have {len(data)}")
+            rng    = np.random.default_rng(seed)
+            sample = data[rng.choice(len(data), min(len(data), _KMEANS_SAMPLE), replace=False)]
+
+            centroids = sample[rng.choice(len(sample), nlist, replace=False)]
+            for _ in range(_KMEANS_ITERS):
+                assign = np.argmax(sample @ centroids.T, axis=1)
+                sums   = np.zeros_like(centroids)
+                np.add.at(sums, assign, sample)
+                empty  = ~sums.any(axis=1)
+                sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+                centroids = _normalise(sums)
+
+            self._set_ivf(centroids, self._nearest_centroids(data, centroids))
+
+    # ── Search ───────────────────────────────────────────────────────
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def search(self, query: np.ndarray, k: int = DEFAULT_K) -> list:
+        """
+        Top-k neighbours of one normalised query vector.
+
+        Returns [{"sha256", "label", ..., "distance"}] — cosine distance
+        (0 = identical direction), nearest first.
+        """
+        with self._lock:
+            n, vectors, items = self._size, self._vectors, self._items
+            candidates = None
+            if self._centroids is not None and n:
+                scores = self._centroids @ query
+                probe  = np.argpartition(-scores, min(self.nprobe, len(scores)) - 1)[:self.nprobe]
+                candidates = np.concatenate(
+                    [self._lists[c][:self._list_len[c]].copy() for c in probe]
+                )
+        if n == 0:
+            return []
+
+        if candidates is None:
+            rows = np.arange(n)
+            sims = _similarities(vectors[:n], query)
+        else:
+            rows = candidates
+            sims = _similarities(vectors, query, rows)
+
+        k   = min(k, len(rows))
+        if k == 0:
+            return []
+        top = np.argpartition(-sims, k - 1)[:k]
+        top = top[np.argsort(-sims[top])]
+        return [
+            {**items[rows[i]], "distance": round(max(0.0, float(1.0 - sims[i])), 5)}
+            for i in top
+        ]
+
+    # ── Internals (caller holds self._lock unless noted) ─────────────
+
+    def _append_rows(self, vectors, items):
+        need = self._size + len(vectors)
+        if need > len(self._vectors):
+            grown = np.zeros((max(need, 2 * len(self._vectors)), self.dim), dtype=np.float16)
+            grown[:self._size] = self._vectors[:self._size]
+            # Searches holding the old array keep a consistent snapshot
+            self._vectors = grown
+        self._vectors[self._size:need] = vectors
+        self._items.extend(items)          # searches only read rows < their own _size
+        self._size  = need
+
+    @staticmethod
+    def _nearest_centroids(vectors, centroids):
+        return np.argmax(np.asarray(vectors, dtype=np.float32) @ centroids.T, axis=1).astype(np.int32)
+
+    def _set_ivf(self, centroids, assign):
+        self._centroids = centroids.astype(np.float32)
+        self._lists     = [np.zeros(16, dtype=np.int32) for _ in range(len(centroids))]
+        self._list_len  = np.zeros(len(centroids), dtype=np.int64)
+        self._add_to_lists(np.arange(len(assign)), assign)
+
+    def _add_to_lists(self, rows, assign):
+        for c in np.unique(assign):
+            new = rows[assign == c].astype(np.int32)
+            cur = self._list_len[c]
+            if cur + len(new) > len(self._lists[c]):
+                grown = np.zeros(max(cur + len(new), 2 * len(self._lists[c])), dtype=np.int32)
+                grown[:cur] = self._lists[c][:cur]
+                self._lists[c] = grown
+            self._lists[c][cur:cur + len(new)] = new
+            self._list_len[c] = cur + len(new)
+
+    def _assignments(self):
+        assign = np.zeros(self._size, dtype=np.int32)
+        for c, lst in enumerate(self._lists):
+            assign[lst[:self._list_len[c]]] = c
+        return assign
+
+    def _write_meta(self, path):
+        with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"dim": self.dim, "model": self.model,
+                       "nlist": 0 if self._centroids is None else len(self._centroids)}, f)
+
+    def _persist(self, vectors, items, assign):
+        if self._files is None:
+            self._files = {
+                name: open(os.path.join(self.path, name), mode)
+                for name, mode in (("vectors.f16", "ab"), ("items.jsonl", "a"), ("lists.i32", "ab"))
+            }
+        # items.jsonl last: a row only counts once its record exists
+        self._files["vectors.f16"].write(vectors.tobytes())
+        if assign is not None:
+            self._files["lists.i32"].write(assign.astype(np.int32).tobytes())
+        for item in items:
+            self._files["items.jsonl"].write(json.dumps(item) + "\n")
+        for f in self._files.values():
+            f.flush()
+
+    def _close_files(self):
+        if self._files is not None:
+            for f in self._files.values():
+                f.close()
+            self._files = None
+
+
+def index_from_env():
+    """FraudIndex at MAD_FRAUD_INDEX (+ MAD_SIMILARITY_NPROBE), or None."""
+    path = os.environ.get("MAD_FRAUD_INDEX")
+    if not path:
+        return None
+    nprobe = int(os.environ.get("MAD_SIMILARITY_NPROBE", DEFAULT_NPROBE))
+    if os.path.exists(os.path.join(path, "meta.json")):
+        return _check_cascade(FraudIndex.open(path, nprobe=nprobe))
+    # New, empty index: created on disk by the first insert
+    os.makedirs(path, exist_ok=True)
+    model = os.environ.get("MAD_SIMILARITY_MODEL", DEFAULT_MODEL)
+    return _check_cascade(FraudIndex(model=model, path=path, nprobe=nprobe))
+
+
+def _check_cascade(index):
+    """Warn when the early-exit cascade can stop before index.model runs."""
+    if os.environ.get("MAD_CASCADE_MARGIN") and index.model != DEFAULT_MODEL:
+        sys.stderr.write(
+            f"[similarity] MAD_CASCADE_MARGIN is set and the index uses {index.model}, "
+            f"which the cascade may skip: such images get no \"similar\" and cannot "
+            f"be indexed — use {DEFAULT_MODEL}\n"
+        )
+    return index
+
+
+def _read_items(path):
+    """Records of items.jsonl, cutting the file back to its last complete line."""
+    items, good = [], 0
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                break
+            good += len(line)
+    _truncate(path, good)
+    return items
+
+
+def _truncate(path, size):
+    if os.path.exists(path) and os.path.getsize(path) > size:
+        os.truncate(path, size)
+
+
+# ─────────────────────────────────────────────────────────────────────
+# CLI — build an index from the embedding store
+# ─────────────────────────────────────────────────────────────────────
+
+def build(embeddings_dir, model_version, labels_csv, out_dir, model=DEFAULT_MODEL,
+          nlist=0):
+    try:
+        from ml.embeddings import EmbeddingReader
+    except ImportError:
+        from embeddings import EmbeddingReader
+
+    labels = {}
+    with open(labels_csv, "r", encoding="utf-8", newline="") as f:
+        for row in csv.reader(f):
+            if row and len(row[0]) == 64:
+                labels[row[0]] = (row[1] if len(row) > 1 else "fake",
+                                  row[2] if len(row) > 2 else None)
+
+    hashes, feats = EmbeddingReader(embeddings_dir, model_version).matrix(model)
+    keep = [i for i, h in enumerate(hashes) if h in labels]
+    if not keep:
+        raise ValueError("none of the labelled hashes are in the embedding store")
+
+    vectors = np.stack([embedding_vector({model: feats[i]}, model) for i in keep])
+    items   = [
+        {"sha256": hashes[i], "label": labels[hashes[i]][0], "note": labels[hashes[i]][1]}
+        for i in keep
+    ]
+    index = FraudIndex(vectors.shape[1], model)
+    index.add(vectors, items)
+    if nlist:
+        index.train(nlist)
+    index.save(out_dir)
+    index.close()
+    return index.size
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build a fraud similarity index.")
+    sub    = parser.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="index labelled images from the embedding store")
+    b.add_argument("--embeddings", required=True, help="embedding store root (MAD_EMBED_DIR)")
+    b.add_argument("--model-version", help="default: current model_set_version()")
+    b.add_argument("--labels", required=True, help="CSV of sha256,label[,note]")
+    b.add_argument("--out", required=True, help="index directory to write")
+    b.add_argument("--model", default=DEFAULT_MODEL)
+    b.add_argument("--nlist", type=int, default=0, help="IVF lists (0 = brute force)")
+    args = parser.parse_args(argv)
+
+    version = args.model_version
+    if version is None:
+        try:
+            from ml.inference import model_set_version
+        except ImportError:
+            from inference import model_set_version
+        version = model_set_version()
+
+    try:
+        size = build(args.embeddings, version, args.labels, args.out, args.model, args.nlist)
+    except (OSError, ValueError) as exc:
+        sys.stderr.write(f"{exc}\n")
+        sys.exit(1)
+    print(json.dumps({"indexed": size, "path": args.out, "nlist": args.nlist}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+backend/ml/xgb_native.py
+==========================
+XGBoost heads loaded from the native model format.
+
+The shipped heads are pickled sklearn XGBClassifier objects: unpickling
+them drags in scikit-learn and ties the model files to the library
+versions that wrote them, and every predict_proba() call goes through
+the wrapper's validation layer.  A NativeHead holds just the Booster,
+loaded from xgb_<name>.ubj (or .json), and scores a whole (N, D)
+feature batch with one Booster.inplace_predict() call.
+
+    MAD_XGB_THREADS   threads per predict call (default: cores)
+
+`python -m ml.export_xgb` writes the .ubj files next to the pickles;
+load_models() prefers them when present.
+"""
+
+import os
+
+import numpy as np
+
+
+NATIVE_EXTENSIONS = (".ubj", ".json")
+
+
+def xgb_threads_from_env() -> int:
+    try:
+        return max(1, int(os.environ.get("MAD_XGB_THREADS", os.cpu_count() or 1)))
+    except ValueError:
+        return os.cpu_count() or 1
+
+
+class NativeHead:
+    """
+    Booster with the XGBClassifier.predict_proba() contract.
+
+    Parameters
+    ----------
+    path    : str       — .ubj / .json model written by Booster.save_model
+    nthread : int|None  — threads per call (default MAD_XGB_THREADS)
+    """
+
+    def __init__(self, path: str, nthread: int | None = None):
+        import xgboost as xgb
+
+        self.path    = path
+        self.booster = xgb.Booster()
+        self.booster.load_model(path)
+        self.booster.set_param({"nthread": nthread or xgb_threads_from_env()})
+
+        # The sklearn wrapper predicts with the early-stopping best
+        # iteration when there is one; do the same.
+        best = self.booster.attr("best_iteration")
+        self.iteration_range = (0, int(best) + 1) if best is not None else (0, 0)
+
+    @property
+    def n_features_in_(self) -> int:
+        return self.booster.num_features()
+
+    def predict_proba(self, features: np.ndarray) -> np.ndarray:
+        """(N, D) features → (N, 2) [P(real), P(fake)]."""
+        out = self.booster.inplace_predict(
+            np.ascontiguousarray(features, dtype=np.float32),
+            iteration_range=self.iteration_range,
+        )
+        if out.ndim == 1:                      # binary:logistic → P(class 1)
+            return np.column_stack((1.0 - out, out))
+        return out
+
+
+def native_path(model_dir: str, name: str):
+    """Path of xgb_<name>.ubj/.json in `model_dir`, or None."""
+    for ext in NATIVE_EXTENSIONS:
+        path = os.path.join(model_dir, f"xgb_{name}{ext}")
+        if os.path.exists(path):
+            return path
+    return None
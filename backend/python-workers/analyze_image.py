@@ -8,10 +8,85 @@ It delegates ML to ml_worker/inference.py
 and forensics to df/analyzer.py.
 
 Accepts newline-delimited JSON on stdin, writes results to stdout.
-Each request/response is a single JSON line.
+Each request/response is a single JSON line.  Requests are processed
+concurrently (MAD_WORKER_CONCURRENCY, default min(4, cores)) and
+answered as soon as they finish, so responses may come back out of
+order — match them by "id".  CNN inference from concurrent requests
+is micro-batched (MAD_BATCH_SIZE, MAD_BATCH_WAIT_MS).  With
+MAD_CASCADE_MARGIN set, confident images stop after the cheaper
+backbones and "model_votes" lists only the models that ran.
+MAD_INFERENCE_BACKEND picks the CNN backend (see ml/backends.py);
+"onnx" serves exported graphs through ONNX Runtime without importing
+torch at all.
+
+MAD_STARTUP picks how the worker starts:
+    full        load and warm up every model, then report ready (default)
+    background  report ready as soon as the forensics stack is
+                imported and load the models on a thread; requests
+                that need ML wait for it, and {"status": "ml_ready"}
+                (or "ml_error") is written once it is done
+    forensics   never import or load the ML stack; every request is
+                answered with forensics only
+Before the models count as loaded, a synthetic receipt is pushed
+through every backbone and head at a spread of batch sizes up to
+MAD_BATCH_SIZE, and through every forensic check, so the first uploads do
+not pay one-off initialisation costs (MAD_WARMUP,
+MAD_WARMUP_BATCH_SIZES, MAD_WARMUP_ROUNDS; see worker/warmup.py).
+The ready line carries a "startup" breakdown in ms: module imports
+("import_ms"), torch / onnxruntime import ("ml_import_ms"), per model
+weight loading ("load_ms", "xgb_load_ms") and warm-up ("warmup_ms"),
+and under "warmup" the latency of every warm-up round per batch size
+("ml") and of the forensic checks ("forensics").
 
 Request:
     {"id": "uuid", "image_path": "/absolute/path/to/upload.jpg"}
+    {"id": "uuid", "image_bytes": 52341}\n<52341 raw bytes>  // in-band frame
+    {"id": "uuid", "shm": "mad-<uuid>", "size": 52341}    // /dev/shm segment
+    {"id": "uuid", "image_path": "...", "forensics_only": true}  // skip ML
+    {"id": "uuid", "cmd": "stats"}          // cache / coalescing counters
+    {"id": "uuid", "cmd": "reload"}         // hot-swap the model set
+    {"id": "uuid", "cmd": "reload", "model_dir": "/srv/models/v7"}
+    {"id": "uuid", "cmd": "index_add", "image_path": "...",
+     "label": "fake", "note": "case 1234"}  // add to MAD_FRAUD_INDEX
+
+{"cmd": "reload"} loads the model set again — from MODEL_DIR after its
+files were replaced, or from "model_dir" — and warms it up, while
+requests keep being served by the current set (ml/registry.py).  New
+requests then use the new set; those already running finish on the
+old one, which is freed afterwards.  The answer, once swapped, carries
+"model_version" and "previous" (leave MAD_MODEL_VERSION unset, or every
+set gets the same version and cached results outlive a swap).  Every
+analysis response reports the "model_version" it was scored with
+(null for forensics only).
+
+Results are cached by SHA-256 of the file bytes + model-set version
+(MAD_CACHE_SIZE in-memory LRU entries, optional MAD_CACHE_DB SQLite
+file that survives restarts); results in which a forensic check
+failed are not cached.  An upload that arrives while an
+identical one is still running waits for that run instead of starting
+its own.  With MAD_EMBED_DIR set, the CNN features of every analysed
+image are kept there for retraining (ml/embeddings.py).
+
+With MAD_FRAUD_INDEX set, every response also lists the most similar
+known receipts from that index under "similar" (MAD_SIMILARITY_K,
+default 5; see ml/similarity.py).  It is null when the early-exit
+cascade stopped before the index's backbone ran.  Cached and coalesced
+responses carry the neighbours found when the upload was first analysed.
+
+With MAD_NEARDUP=report|shortcircuit, a perceptual hash of each upload
+is looked up among earlier ones (worker/near_dup.py).  A close match is
+reported under "near_duplicate" with its stored verdict, or — in
+shortcircuit mode, when its result is still cached — answered with
+that result straight away ("cache": "near_duplicate").
+
+With MAD_SHADOW_MODEL_DIR set, a candidate model set is scored on the
+same batches as production, on a low-priority thread after the
+responses are written, and its disagreements are logged
+(ml/shadow.py).  A shadow batch only runs while no images wait for a
+batch and fewer than MAD_SHADOW_MAX_INFLIGHT requests (default half of
+MAD_WORKER_CONCURRENCY or of the CPU count, whichever is smaller, at
+least 1) are in flight; under sustained
+load it is shed.  {"cmd": "stats"} reports how much ran.
 
 Response:
     {
@@ -31,14 +106,45 @@ Response:
       "metadata"        : {"has_exif": true, "software": null, "suspicious": false, ...},
       "noise"           : {"variance": 120.4, "mean_abs": 8.3, "suspicious": false},
       "forensic_flags"  : 0,
-      "forensic_verdict": "Clean"
+      "forensic_verdict": "Clean",
+
+      // Nearest labelled receipts (only with MAD_FRAUD_INDEX)
+      "similar": [{"sha256": "...", "label": "fake", "note": "...",
+                   "distance": 0.012}, ...],
+
+      // Close perceptual-hash match (only with MAD_NEARDUP)
+      "near_duplicate": {"sha256": "...", "distance": 2,
+                         "prediction": "Real", "fake_prob": 0.03},
+
+      // "memory" / "disk" when served from the result cache,
+      // "coalesced" when it shared a concurrent identical request's run,
+      // "near_duplicate" when short-circuited to a near-duplicate's
+      // cached result, else "miss"
+      "cache": "miss",
+
+      // Per-stage wall times (ms); ML and forensic checks overlap
+      "timings": {"read_ms": 1.2, "ela_ms": 210.0, "metadata_ms": 0.4,
+                  "noise_ms": 95.3, "forensics_ms": 212.1,
+                  "ml_ms": 180.5, "ml_batch_size": 2, "total_ms": 214.0}
     }
 """
 
 import sys
 import os
 import json
+import hashlib
+import threading
+import time
 import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+
+_IMPORT_STARTED = time.perf_counter()
+
+STARTUP_MODES = ("full", "background", "forensics")
+STARTUP_MODE  = os.environ.get("MAD_STARTUP", "full").strip().lower()
+if STARTUP_MODE not in STARTUP_MODES:
+    sys.stderr.write(f"[worker] unknown MAD_STARTUP={STARTUP_MODE!r} — using full\n")
+    STARTUP_MODE = "full"
 
 # ── Fix sys.path so imports work from any working directory ──────────
 _THIS_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -49,18 +155,35 @@ for _p in [_BACKEND, _PROJECT]:
     if _p not in sys.path:
         sys.path.insert(0, _p)
 
-# ── ML inference ─────────────────────────────────────────────────────
-try:
-    from ml.inference import load_models, predict as ml_predict
-    _ML_AVAILABLE = True
-    _ML_ERROR     = None
-except Exception as e:
-    _ML_AVAILABLE = False
-    _ML_ERROR     = traceback.format_exc()
+from worker.dispatcher import RequestDispatcher, concurrency_from_env
+from worker.cache      import ResultCache, cache_key
+from worker.coalesce   import InFlightTable
+from worker.near_dup   import NearDuplicateIndex, dhash
+from worker.transport  import open_shm
+from worker.warmup     import synthetic_receipt, warmup_from_env
+
+# ── ML inference (torch itself is only imported by load_models) ─────
+_ML_AVAILABLE = False
+_ML_ERROR     = "disabled (MAD_STARTUP=forensics)"
+if STARTUP_MODE != "forensics":
+    try:
+        from ml.inference import load_models, model_set_version, resolve_backend, warm_up
+        from ml.inference import MODEL_DIR, CNN_INPUT_SIZE, DRAFT_DECODE
+        from ml.batching  import MicroBatcher, DEFAULT_MAX_BATCH_SIZE, DEFAULT_MAX_WAIT_MS
+        from ml.registry  import ModelRegistry, ModelSet
+        from ml.shadow    import ShadowEvaluator
+        from ml.embeddings import EmbeddingStore
+        from ml.similarity import index_from_env, embedding_vector, DEFAULT_K
+        _ML_AVAILABLE = True
+        _ML_ERROR     = None
+    except Exception as e:
+        _ML_AVAILABLE = False
+        _ML_ERROR     = traceback.format_exc()
 
 # ── Digital forensics ────────────────────────────────────────────────
 try:
     from df.analyzer import run_forensics
+    from df.image_context import ImageContext
     _FORENSICS_AVAILABLE = True
     _FORENSICS_ERROR     = None
 except Exception as e:
@@ -70,7 +193,26 @@ except Exception as e:
 
 # STARTUP
 
-def startup():
+# Startup breakdown (ms) reported in the ready line
+STARTUP = {"mode": STARTUP_MODE, "import_ms": round((time.perf_counter() - _IMPORT_STARTED) * 1000, 2)}
+
+
+def startup(announce=True, mode=None):
+    """
+    Start the ML side according to `mode` (default MAD_STARTUP) and
+    write the ready line unless `announce` is False.
+
+    Returns the loaded (cnn_models, xgb_models) for "full", a Future of
+    them for "background" and None for "forensics"; serve() takes any
+    of the three.
+    """
+    mode = mode or STARTUP_MODE
+    if mode == "forensics":
+        _warm_forensics()
+        if announce:
+            _write(ready_message(ml=False))
+        return None
+
     if not _ML_AVAILABLE:
         _write({
             "status" : "error",
@@ -78,15 +220,21 @@ def startup():
         })
         sys.exit(1)
 
+    if mode == "background":
+        models = Future()
+        threading.Thread(
+            target=_load_in_background, args=(models,), name="ml-loader", daemon=True
+        ).start()
+        if announce:
+            _write(ready_message(ml="loading"))
+        return models
+
     try:
-        cnn_models, xgb_models = load_models()
-        _write({
-            "status"             : "ready",
-            "ml"                 : True,
-            "forensics"          : _FORENSICS_AVAILABLE,
-            "forensics_note"     : _FORENSICS_ERROR if not _FORENSICS_AVAILABLE else None,
-        })
-        return cnn_models, xgb_models
+        models = _load_and_warm()
+        _warm_forensics()
+        if announce:
+            _write(ready_message())
+        return models
     except Exception as exc:
         _write({
             "status" : "error",
@@ -96,41 +244,235 @@ def startup():
         sys.exit(1)
 
 
+def _load_and_warm(model_dir=None, report=None):
+    """Load and warm up a model set; timings go to `report` (default STARTUP)."""
+    report    = STARTUP if report is None else report
+    started   = time.perf_counter()
+    ml_timing = {}
+    warmup    = warmup_from_env(_env_number("MAD_BATCH_SIZE", DEFAULT_MAX_BATCH_SIZE))
+    cnn_models, xgb_models = load_models(timings=ml_timing, model_dir=model_dir)
+    if warmup is not None:
+        warm_up(cnn_models, xgb_models, timings=ml_timing, image=synthetic_receipt(),
+                batch_sizes=warmup["batch_sizes"], rounds=warmup["rounds"])
+        report.setdefault("warmup", {})["ml"] = ml_timing["warmup"]
+    report["ml_import_ms"] = ml_timing.get("import_ms")      # torch / onnxruntime
+    report["models"]       = ml_timing.get("models", {})
+    report["ml_total_ms"]  = _ms_since(started)
+    return cnn_models, xgb_models
+
+
+def _warm_forensics():
+    """Run every forensic check on synthetic receipts (MAD_WARMUP_ROUNDS times)."""
+    warmup = warmup_from_env(1)
+    if warmup is None or not _FORENSICS_AVAILABLE:
+        return
+    rounds_ms = []
+    for seed in range(warmup["rounds"]):
+        started = time.perf_counter()
+        try:
+            run_forensics(ImageContext(synthetic_receipt(seed)))
+        except Exception as exc:
+            sys.stderr.write(f"[worker] forensics warm-up failed: {exc}\n")
+            return
+        rounds_ms.append(_ms_since(started))
+    STARTUP.setdefault("warmup", {})["forensics"] = rounds_ms
+
+
+def _load_in_background(models):
+    try:
+        loaded = _load_and_warm()
+        _warm_forensics()
+        models.set_result(loaded)
+    except Exception as exc:
+        models.set_exception(exc)
+        _write({
+            "status" : "ml_error",
+            "message": str(exc),
+            "trace"  : traceback.format_exc(),
+        })
+        return
+    _write({"status": "ml_ready", "startup": STARTUP})
+
+
+def ready_message(ml=True) -> dict:
+    return {
+        "status"             : "ready",
+        "ml"                 : ml,
+        "backend"            : resolve_backend() if _ML_AVAILABLE else None,
+        "forensics"          : _FORENSICS_AVAILABLE,
+        "forensics_note"     : _FORENSICS_ERROR if not _FORENSICS_AVAILABLE else None,
+        "startup"            : STARTUP,
+    }
+
+
 # ─────────────────────────────────────────────────────────────────────
 # REQUEST HANDLER
 # ─────────────────────────────────────────────────────────────────────
 
-def handle(line, cnn_models, xgb_models):
-    req_id = None
+def handle(line, registry, stage_pool=None, cache=None, inflight=None,
+           index=None, near_dup=None, payload=None, shadow=None):
+    """
+    Handle one request line and write its response.
+
+    `registry` (an ml.registry.ModelRegistry) supplies the model set: a
+    request leases the current one for its whole run, so a concurrent
+    {"cmd": "reload"} never changes the models under it.  The set's
+    MicroBatcher scores the image — concurrent requests share CNN
+    batches — and its version keys the cache and is reported as
+    "model_version".
+
+    With a ResultCache, an upload whose bytes + model-set version were
+    analysed before is answered from the cache ("cache": "memory" or
+    "disk") without running ML or forensics.  With an InFlightTable, a
+    duplicate of an upload that is still being analysed waits for that
+    run and shares its result ("cache": "coalesced").  {"cmd": "stats"}
+    returns the cache and coalescing counters instead.
+
+    With a FraudIndex, the nearest labelled receipts are added under
+    "similar" (the set's batcher must then keep features), and
+    {"cmd": "index_add"} inserts an image into the index.  The index is
+    not rebuilt on reload: vectors added before a swap come from the
+    previous set's backbones.
+
+    With a NearDuplicateIndex, uploads whose perceptual hash is close to
+    an analysed image's get "near_duplicate", or in "shortcircuit" mode
+    that image's cached result ("cache": "near_duplicate").
+
+    While the ML ensemble runs, the forensic checks are scheduled as
+    separate tasks on `stage_pool` (or run inline if None), so request
+    latency is the slowest stage instead of the sum of all of them.
+    Per-stage wall times are returned under "timings".
+
+    The image comes from `payload` (the bytes of an in-band frame), a
+    shared-memory segment ("shm" + "size") or "image_path", in that
+    order; see worker/transport.py.
+
+    `registry` may be None (MAD_STARTUP=forensics); requests are then
+    answered as if they asked for "forensics_only".
+    """
+    req_id    = None
+    model_set = None
     try:
+        started  = time.perf_counter()
+        timings  = {}
         req      = json.loads(line)
         req_id   = req.get("id", "no-id")
-        img_path = req.get("image_path", "")
 
-        if not img_path:
-            raise ValueError("Missing field: image_path")
-        if not os.path.isfile(img_path):
-            raise FileNotFoundError(f"Image not found: {img_path}")
+        if req.get("cmd") == "stats":
+            _write({
+                "id"      : req_id,
+                "error"   : None,
+                "cache"   : cache.stats() if cache is not None else None,
+                "inflight": inflight.stats() if inflight is not None else None,
+                "index"   : {"size": index.size} if index is not None else None,
+                "near_dup": near_dup.stats() if near_dup is not None else None,
+                "models"  : registry.stats() if registry is not None else None,
+                "shadow"  : shadow.stats() if shadow is not None else None,
+            })
+            return
+
+        if req.get("cmd") == "reload":
+            _start_reload(req_id, registry, req.get("model_dir"))
+            return
 
-        # ── ML prediction ────────────────────────────────────────────
-        ml_result = ml_predict(img_path, cnn_models, xgb_models)
+        if req.get("cmd") == "index_add":
+            if registry is None:
+                raise ValueError("No models loaded (MAD_STARTUP=forensics)")
+            with registry.lease() as leased:
+                _write({"id": req_id, **_index_add(req, leased.submit, index, payload)})
+            return
 
-        # ── Forensics ────────────────────────────────────────────────
-        if _FORENSICS_AVAILABLE:
+        # ── Read once, share across ML + forensics ───────────────────
+        image = _request_image(req, payload)
+        timings["read_ms"] = _ms_since(started)
+
+        forensics_only = bool(req.get("forensics_only")) or registry is None
+        ml_submit, model_version = None, None
+        if not forensics_only:
+            # Waits only while a background load is still running
+            model_set = registry.acquire()
+            ml_submit, model_version = model_set.submit, model_set.version
+
+        # Forensics-only results do not depend on the models
+        key = cache_key(image.sha256, "forensics" if forensics_only else model_version)
+
+        # ── Cached result for identical bytes + models? ──────────────
+        if cache is not None:
+            cached, tier = cache.get(key)
+            if cached is not None:
+                timings["total_ms"] = _ms_since(started)
+                _write({
+                    "id"           : req_id,
+                    **cached,
+                    "model_version": model_version,
+                    "cache"        : tier,
+                    "timings"      : timings,
+                })
+                return
+
+        # ── Near-duplicate of an image judged before? ────────────────
+        phash, near = None, None
+        if near_dup is not None and not forensics_only:
+            hash_started = time.perf_counter()
+            phash = dhash(image)
+            match = near_dup.lookup(phash, exclude=image.sha256)
+            timings["near_dup_ms"] = _ms_since(hash_started)
+            if match is not None:
+                near   = {"sha256": match[0], "distance": match[1]}
+                stored = None
+                if cache is not None:
+                    stored, _ = cache.get(cache_key(match[0], model_version), record=False)
+                if stored is not None and near_dup.mode == "shortcircuit":
+                    timings["total_ms"] = _ms_since(started)
+                    _write({
+                        "id"            : req_id,
+                        **stored,
+                        "model_version" : model_version,
+                        "near_duplicate": near,
+                        "cache"         : "near_duplicate",
+                        "timings"       : timings,
+                    })
+                    return
+                if stored is not None:
+                    near["prediction"] = stored.get("prediction")
+                    near["fake_prob"]  = stored.get("fake_prob")
+
+        # ── Same upload already being analysed? ──────────────────────
+        if inflight is not None:
+            future, leader = inflight.claim(key)
+            if not leader:
+                result = future.result()
+                timings["total_ms"] = _ms_since(started)
+                _write({
+                    "id"           : req_id,
+                    **result,
+                    "model_version": model_version,
+                    "cache"        : "coalesced",
+                    "timings"      : timings,
+                })
+                return
             try:
-                forensics = run_forensics(img_path)
-            except Exception as fe:
-                forensics = _empty_forensics(str(fe))
+                result = _analyze(image, ml_submit, stage_pool, timings, index)
+                _note_near_duplicate(result, near_dup, phash, near, image)
+            except Exception as exc:
+                inflight.fail(key, exc)
+                raise
+            if cache is not None and _cacheable(result):
+                cache.put(key, result)
+            inflight.resolve(key, result)
         else:
-            forensics = _empty_forensics(
-                f"Forensics module unavailable — {_FORENSICS_ERROR}"
-            )
+            result = _analyze(image, ml_submit, stage_pool, timings, index)
+            _note_near_duplicate(result, near_dup, phash, near, image)
+            if cache is not None and _cacheable(result):
+                cache.put(key, result)
 
+        timings["total_ms"] = _ms_since(started)
         _write({
-            "id"   : req_id,
-            "error": None,
-            **ml_result,
-            **forensics,
+            "id"           : req_id,
+            **result,
+            "model_version": model_version,
+            "cache"        : "miss" if cache is not None else None,
+            "timings"      : timings,
         })
 
     except json.JSONDecodeError as je:
@@ -144,6 +486,161 @@ def handle(line, cnn_models, xgb_models):
             "error": f"{type(exc).__name__}: {exc}",
             "trace": traceback.format_exc(),
         })
+    finally:
+        if model_set is not None:
+            registry.release(model_set)
+
+
+def _start_reload(req_id, registry, model_dir=None):
+    """
+    Reload on a thread of its own: loading takes seconds, and must not
+    hold one of the dispatcher's request slots meanwhile.  The answer is
+    written once the new set is in place (or failed to load).
+    """
+    if registry is None:
+        raise ValueError("No models loaded (MAD_STARTUP=forensics)")
+
+    def run():
+        try:
+            _write({"id": req_id, "error": None, **registry.reload(model_dir)})
+        except Exception as exc:
+            _write({
+                "id"           : req_id,
+                "error"        : f"Reload failed — {type(exc).__name__}: {exc}",
+                "model_version": registry.version,
+            })
+
+    threading.Thread(target=run, name="ml-reload", daemon=True).start()
+
+
+def _request_image(req, payload=None):
+    """ImageContext (a _FileImage without df) for a request's image."""
+    if payload is not None or req.get("shm"):
+        if not _FORENSICS_AVAILABLE:
+            raise RuntimeError(f"In-memory images need df.image_context — {_FORENSICS_ERROR}")
+        data = payload if payload is not None else open_shm(req["shm"], req.get("size", 0))
+        return ImageContext(data)
+
+    img_path = req.get("image_path", "")
+    if not img_path:
+        raise ValueError("Missing field: image_path")
+    if not os.path.isfile(img_path):
+        raise FileNotFoundError(f"Image not found: {img_path}")
+    return ImageContext.from_path(img_path) if _FORENSICS_AVAILABLE else _FileImage(img_path)
+
+
+class _FileImage:
+    """
+    Stand-in for ImageContext when df is unavailable: the path and the
+    SHA-256 of its bytes (for cache, coalescing and embedding keys).
+    The CNN preprocessing decodes it through convert(), like a PIL
+    image; JPEGs take the same reduced-resolution draft decode as
+    ImageContext.draft_rgb, so scores (and cache keys) match a worker
+    with df.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.sha256 = hashlib.sha256(f.read()).hexdigest()
+
+    def convert(self, mode):
+        from PIL import Image
+        with Image.open(self.path) as img:
+            if _ML_AVAILABLE and DRAFT_DECODE:
+                img.draft("RGB", CNN_INPUT_SIZE)
+            return img.convert(mode)
+
+
+def _analyze(image, ml_submit, stage_pool, timings, index=None):
+    """
+    Run ML and forensics side by side; returns the combined result.
+    Without `ml_submit` only the forensic checks run.
+    """
+    # ── ML prediction (runs on the batcher thread) ───────────────────
+    ml_future = ml_submit(image, image.sha256) if ml_submit is not None else None
+
+    # ── Forensics (runs alongside ML) ────────────────────────────────
+    if _FORENSICS_AVAILABLE:
+        forensics_started = time.perf_counter()
+        try:
+            forensics = run_forensics(image, executor=stage_pool, timings=timings)
+        except Exception as fe:
+            forensics = _empty_forensics(str(fe))
+        timings["forensics_ms"] = _ms_since(forensics_started)
+    else:
+        forensics = _empty_forensics(
+            f"Forensics module unavailable — {_FORENSICS_ERROR}"
+        )
+
+    if ml_future is None:
+        return {"error": None, **forensics}
+
+    ml_result = ml_future.result()
+    if hasattr(ml_future, "completed_at"):
+        timings["ml_ms"]         = round((ml_future.completed_at - ml_future.submitted_at) * 1000, 2)
+        timings["ml_batch_size"] = ml_future.batch_size
+
+    result = {
+        "error": None,
+        **ml_result,
+        **forensics,
+    }
+    if index is not None:
+        # The cascade may have finished before the index's backbone ran
+        if index.model not in ml_future.features:
+            result["similar"] = None
+            return result
+        search_started    = time.perf_counter()
+        result["similar"] = index.search(
+            embedding_vector(ml_future.features, index.model), SIMILARITY_K
+        )
+        timings["similarity_ms"] = _ms_since(search_started)
+    return result
+
+
+def _index_add(req, ml_submit, index, payload=None):
+    """Embed one image and insert it into the fraud index."""
+    if index is None or ml_submit is None:
+        raise ValueError("No fraud index configured (MAD_FRAUD_INDEX)")
+    label = req.get("label")
+    if not label:
+        raise ValueError("index_add needs a label")
+
+    image  = _request_image(req, payload)
+    future = ml_submit(image, image.sha256)
+    future.result()
+    if index.model not in future.features:
+        raise ValueError(
+            f"index_add: the early-exit cascade stopped before {index.model} ran "
+            f"(MAD_CASCADE_MARGIN); index a backbone every image runs, e.g. mobilenet_v2"
+        )
+    index.add(
+        embedding_vector(future.features, index.model)[None, :],
+        [{"sha256": image.sha256, "label": label, "note": req.get("note")}],
+    )
+    return {"error": None, "indexed": True, "sha256": image.sha256, "size": index.size}
+
+
+def _note_near_duplicate(result, near_dup, phash, near, image):
+    """Attach the near-duplicate match and record this image's hash."""
+    if phash is None:
+        return
+    if near is not None:
+        result["near_duplicate"] = near
+    near_dup.add(phash, image.sha256)
+
+
+def _cacheable(result):
+    """
+    False when a forensic stage failed: the error may be transient, and
+    a cached copy would be served (across restarts, from SQLite) as if
+    the checks had run.
+    """
+    return not any(
+        isinstance(result.get(stage), dict) and result[stage].get("error") is not None
+        for stage in ("ela", "metadata", "noise")
+    )
 
 
 def _empty_forensics(reason="unavailable"):
@@ -157,14 +654,114 @@ def _empty_forensics(reason="unavailable"):
         "forensic_verdict": "Unavailable",
     }
 
+_WRITE_LOCK = threading.Lock()
+
+def _ms_since(start):
+    return round((time.perf_counter() - start) * 1000, 2)
+
 def _write(obj):
-    sys.stdout.write(json.dumps(obj) + "\n")
-    sys.stdout.flush()
+    # One lock for every writer thread — a JSON line must never be
+    # split by another response.
+    line = json.dumps(obj) + "\n"
+    with _WRITE_LOCK:
+        sys.stdout.write(line)
+        sys.stdout.flush()
 
-if __name__ == "__main__":
-    cnn_models, xgb_models = startup()
+def _env_number(name, default, cast=int):
+    try:
+        return cast(os.environ.get(name, default))
+    except ValueError:
+        return default
 
-    for line in sys.stdin:
-        line = line.strip()
-        if line:
-            handle(line, cnn_models, xgb_models)
+SIMILARITY_K = _env_number("MAD_SIMILARITY_K", DEFAULT_K) if _ML_AVAILABLE else 0
+
+def serve(models, stream=None, model_version=None, shared=False):
+    """
+    Answer requests from `stream` (default stdin) until EOF.
+
+    `models` is what startup() returned: (cnn_models, xgb_models), a
+    Future of them still loading (ML requests wait for it), or None to
+    serve forensics only.  Sets up the model registry, caches and
+    indexes around them; python-workers/supervisor.py calls this in
+    each forked worker process, with the `model_version` it computed
+    and `shared=True` so the embedding store is safe to append to from
+    all of them.
+    """
+    concurrency = concurrency_from_env()
+    # Per in-flight request: CNN preprocessing + one slot per forensic
+    # check (ELA, metadata, noise), all running alongside each other
+    stage_pool  = ThreadPoolExecutor(
+        max_workers=concurrency * 4,
+        thread_name_prefix="stage",
+    )
+    with_ml  = models is not None
+    # Need ImageContext: both are keyed by content SHA-256
+    index    = index_from_env() if with_ml and _FORENSICS_AVAILABLE else None
+    near_dup = NearDuplicateIndex.from_env() if with_ml and _FORENSICS_AVAILABLE else None
+    registry = None
+    # Shadow batches wait for (nearly) idle production, else are shed
+    shadow_limit = _env_number("MAD_SHADOW_MAX_INFLIGHT",
+                               max(1, min(concurrency, os.cpu_count() or 1) // 2))
+    shadow   = ShadowEvaluator.from_env(
+        busy=lambda: registry.backlog() > 0 or registry.in_flight() >= shadow_limit
+    ) if with_ml else None
+
+    def build_set(model_dir=None, loaded=None, version=None):
+        # One batcher (and embedding store) per model set: CNN batches
+        # and stored features never mix two sets
+        cnn_models, xgb_models = loaded if loaded is not None else _load_and_warm(model_dir, {})
+        version    = version or model_set_version(model_dir)
+        embeddings = EmbeddingStore.from_env(version, shared)
+        batcher    = MicroBatcher(
+            cnn_models, xgb_models,
+            max_batch_size=_env_number("MAD_BATCH_SIZE",    DEFAULT_MAX_BATCH_SIZE),
+            max_wait_ms   =_env_number("MAD_BATCH_WAIT_MS", DEFAULT_MAX_WAIT_MS, float),
+            preprocess_executor=stage_pool,
+            feature_sink=embeddings.append if embeddings is not None else None,
+            keep_features=index is not None,
+            shadow_sink=shadow.offer if shadow is not None else None,
+        )
+        return ModelSet(version, cnn_models, xgb_models, batcher,
+                        [embeddings] if embeddings is not None else [],
+                        model_dir or MODEL_DIR)
+
+    if with_ml:
+        registry = ModelRegistry(build_set)
+        if isinstance(models, Future):
+            first = Future()
+
+            def install_first(loaded):
+                try:
+                    first.set_result(build_set(loaded=loaded.result(), version=model_version))
+                except Exception as exc:
+                    first.set_exception(exc)
+
+            models.add_done_callback(install_first)
+            registry.install(first)
+        else:
+            registry.install(build_set(loaded=models, version=model_version))
+    if shadow is not None:
+        shadow.start()
+
+    cache      = ResultCache.from_env()
+    inflight   = InFlightTable()
+    dispatcher = RequestDispatcher(
+        lambda line, payload=None: handle(line, registry, stage_pool, cache, inflight,
+                                          index, near_dup, payload, shadow),
+        max_concurrency=concurrency,
+    )
+    dispatcher.serve(stream if stream is not None else sys.stdin)
+    stage_pool.shutdown()
+    if registry is not None:
+        registry.close()
+    if shadow is not None:
+        shadow.close()
+    cache.close()
+    if index is not None:
+        index.close()
+    if near_dup is not None:
+        near_dup.close()
+
+
+if __name__ == "__main__":
+    serve(startup())
@@ -0,0 +1,308 @@
+"""
+backend/python-workers/bulk_scan.py
+=====================================
+Offline bulk re-scoring of archived receipts.
+
+Walks a directory, a .tar/.tar.gz/.tgz archive or a .zip archive,
+decodes images and runs forensics in a process pool, feeds the decoded
+224×224 CNN inputs to ml.inference.predict_batch() in batches, and
+streams one JSON line per image to the output file.
+
+Every image scored without error is also appended to a checkpoint
+file, so an interrupted run started again with the same arguments
+skips what it already did and retries what failed (the output then
+holds the failed line and, later, the retry's).  Progress (images/s)
+is printed to stderr as it goes.  With --embeddings DIR the CNN
+features are stored as well (see ml/embeddings.py), so the archive
+never needs the backbones again to refit or re-score the XGBoost heads.
+
+Usage:
+    python python-workers/bulk_scan.py /data/receipts      -o scores.jsonl
+    python python-workers/bulk_scan.py receipts-2024.tar.gz -o scores.jsonl \\
+        --workers 16 --batch-size 32 --no-forensics --embeddings /data/emb
+
+Output line:
+    {"source": "2024/03/r-0001.jpg", "sha256": "...", "model_version": "...",
+     "error": null, "prediction": "Real", ..., "ela": {...}, ...}
+"""
+
+import sys
+import os
+import json
+import time
+import tarfile
+import zipfile
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+# ── Fix sys.path so imports work from any working directory ──────────
+_THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+_BACKEND  = os.path.dirname(_THIS_DIR)          # backend/
+_PROJECT  = os.path.dirname(_BACKEND)           # project root
+
+for _p in [_BACKEND, _PROJECT]:
+    if _p not in sys.path:
+        sys.path.insert(0, _p)
+
+import numpy as np
+from PIL import Image
+
+from df.analyzer      import run_forensics
+from df.image_context import ImageContext
+
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff"}
+
+
+# ─────────────────────────────────────────────────────────────────────
+# SOURCES — yield (entry_id, path_or_bytes) for every image
+# ─────────────────────────────────────────────────────────────────────
+
+def iter_source(source: str):
+    """
+    Yield (entry_id, payload) pairs for every image in `source`.
+
+    Directories yield file paths (read by the pool workers); archives
+    are read sequentially here and yield the member bytes.
+    """
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for fname in sorted(files):
+                if _is_image(fname):
+                    path = os.path.join(root, fname)
+                    yield os.path.relpath(path, source), path
+
+    elif zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as zf:
+            for info in zf.infolist():
+                if not info.is_dir() and _is_image(info.filename):
+                    yield info.filename, zf.read(info)
+
+    elif tarfile.is_tarfile(source):
+        # Streaming mode: works for compressed tars without seeking
+        with tarfile.open(source, mode="r|*") as tf:
+            for member in tf:
+                if member.isfile() and _is_image(member.name):
+                    yield member.name, tf.extractfile(member).read()
+
+    else:
+        raise ValueError(f"Not a directory, .tar or .zip archive: {source}")
+
+
+def _is_image(name):
+    return os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+
+
+# ─────────────────────────────────────────────────────────────────────
+# POOL WORKER — decode + forensics + CNN resize, no torch work
+# ─────────────────────────────────────────────────────────────────────
+
+def decode_job(entry_id, payload, with_forensics=True):
+    """
+    Runs in a pool process.
+
+    Returns a dict with the entry id, content hash, forensics result and
+    the uint8 (224, 224, 3) CNN input, or an "error" entry.
+    """
+    from ml.inference import resize_for_cnn
+
+    try:
+        if isinstance(payload, str):
+            ctx = ImageContext.from_path(payload)
+        else:
+            ctx = ImageContext(payload)
+
+        out = {
+            "source"   : entry_id,
+            "sha256"   : ctx.sha256,
+            "cnn_input": np.asarray(resize_for_cnn(ctx)),
+            "error"    : None,
+        }
+        if with_forensics:
+            out["forensics"] = run_forensics(ctx)
+        return out
+
+    except Exception as exc:
+        return {
+            "source": entry_id,
+            "error" : f"{type(exc).__name__}: {exc}",
+        }
+
+
+# ─────────────────────────────────────────────────────────────────────
+# CHECKPOINT
+# ─────────────────────────────────────────────────────────────────────
+
+def load_checkpoint(path):
+    """Set of entry ids a previous run scored without error."""
+    if not os.path.exists(path):
+        return set()
+    with open(path, "r", encoding="utf-8") as f:
+        return {line.rstrip("\n") for line in f if line.strip()}
+
+
+# ─────────────────────────────────────────────────────────────────────
+# MAIN LOOP
+# ─────────────────────────────────────────────────────────────────────
+
+def scan(source, out_path, checkpoint_path=None, workers=None, batch_size=16,
+         with_forensics=True, report_every=5.0, embeddings_dir=None):
+    from ml.inference  import load_models, model_set_version, predict_batch
+    from ml.embeddings import EmbeddingStore
+
+    checkpoint_path = checkpoint_path or out_path + ".ckpt"
+    done            = load_checkpoint(checkpoint_path)
+    workers         = workers or os.cpu_count() or 1
+
+    cnn_models, xgb_models = load_models()
+    model_version          = model_set_version()
+    store = EmbeddingStore(embeddings_dir, model_version) if embeddings_dir else None
+
+    out_f  = open(out_path,        "a", encoding="utf-8")
+    ckpt_f = open(checkpoint_path, "a", encoding="utf-8")
+
+    stats   = {"scanned": 0, "skipped": 0, "errors": 0}
+    started = time.perf_counter()
+    last_report = started
+    pending_batch = []
+
+    def flush_batch():
+        if not pending_batch:
+            return
+        images   = [Image.fromarray(item["cnn_input"]) for item in pending_batch]
+        features = [] if store is not None else None
+        try:
+            results = predict_batch(images, cnn_models, xgb_models, features_out=features)
+            errors  = [None] * len(results)
+            if store is not None:
+                for item, feats in zip(pending_batch, features):
+                    store.append(item["sha256"], feats)
+        except Exception as exc:
+            results = [{}] * len(pending_batch)
+            errors  = [f"{type(exc).__name__}: {exc}"] * len(pending_batch)
+
+        for item, ml_result, err in zip(pending_batch, results, errors):
+            emit({
+                "source"       : item["source"],
+                "sha256"       : item["sha256"],
+                "model_version": model_version,
+                "error"        : err,
+                **ml_result,
+                **item.get("forensics", {}),
+            })
+        pending_batch.clear()
+        out_f.flush()
+        ckpt_f.flush()
+
+    def emit(record):
+        out_f.write(json.dumps(record) + "\n")
+        stats["scanned"] += 1
+        if record.get("error"):
+            stats["errors"] += 1        # not checkpointed: retried on resume
+        else:
+            ckpt_f.write(record["source"] + "\n")
+
+    # Keep a bounded number of decode jobs in flight so archives are
+    # not read into memory faster than the CNNs can consume them.
+    max_in_flight = workers * max(2, batch_size)
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            in_flight = set()
+
+            def drain(block):
+                nonlocal in_flight
+                if not in_flight:
+                    return
+                finished, in_flight = wait(
+                    in_flight,
+                    timeout=None if block else 0,
+                    return_when=FIRST_COMPLETED,
+                )
+                for fut in finished:
+                    item = fut.result()
+                    if item["error"]:
+                        emit({"model_version": model_version, **item})
+                        continue
+                    pending_batch.append(item)
+                    if len(pending_batch) >= batch_size:
+                        flush_batch()
+
+            for entry_id, payload in iter_source(source):
+                if entry_id in done:
+                    stats["skipped"] += 1
+                    continue
+                in_flight.add(pool.submit(decode_job, entry_id, payload, with_forensics))
+                while len(in_flight) >= max_in_flight:
+                    drain(block=True)
+                drain(block=False)
+
+                now = time.perf_counter()
+                if now - last_report >= report_every:
+                    _report(stats, started, now)
+                    last_report = now
+
+            while in_flight:
+                drain(block=True)
+            flush_batch()
+
+    finally:
+        flush_batch()
+        if store is not None:
+            store.close()
+        out_f.close()
+        ckpt_f.close()
+
+    _report(stats, started, time.perf_counter())
+    return stats
+
+
+def _report(stats, started, now):
+    elapsed = max(now - started, 1e-9)
+    sys.stderr.write(
+        f"[bulk_scan] {stats['scanned']} scanned "
+        f"({stats['scanned'] / elapsed:.1f} img/s), "
+        f"{stats['skipped']} skipped from checkpoint, "
+        f"{stats['errors']} errors, {elapsed:.0f}s elapsed\n"
+    )
+    sys.stderr.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Re-score a directory or tar/zip archive of receipts to JSONL."
+    )
+    parser.add_argument("source", help="directory, .tar[.gz] or .zip archive")
+    parser.add_argument("-o", "--output", required=True, help="JSONL output file (appended)")
+    parser.add_argument("--checkpoint", help="checkpoint file (default: <output>.ckpt)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="decode processes (default: all cores)")
+    parser.add_argument("--batch-size", type=int, default=16,
+                        help="images per CNN batch (default: 16)")
+    parser.add_argument("--no-forensics", action="store_true",
+                        help="only run the ML ensemble")
+    parser.add_argument("--embeddings", metavar="DIR",
+                        help="also store the CNN features under DIR")
+    args = parser.parse_args(argv)
+
+    try:
+        scan(
+            args.source, args.output,
+            checkpoint_path=args.checkpoint,
+            workers=args.workers,
+            batch_size=args.batch_size,
+            with_forensics=not args.no_forensics,
+            embeddings_dir=args.embeddings,
+        )
+    except KeyboardInterrupt:
+        sys.stderr.write("[bulk_scan] interrupted — rerun the same command to resume\n")
+        sys.exit(130)
+    except Exception:
+        traceback.print_exc()
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
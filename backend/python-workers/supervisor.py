@@ -0,0 +1,343 @@
+"""
+backend/python-workers/supervisor.py
+======================================
+Pre-forking supervisor for analyze_image.py.
+
+One worker process leaves most cores of a large box idle: the
+micro-batcher runs every forward pass on a single thread, and the
+forensic checks share one GIL.  The supervisor loads the models once,
+then forks MAD_WORKERS copies of the worker.  The weights are shared
+copy-on-write with the parent (nothing writes to them after loading),
+so memory does not grow with the worker count.  Weights loaded from a
+model bundle (ml/bundle.py) are file-backed pages of the page cache,
+shared even with other supervisors on the host.
+
+It speaks the same newline-JSON protocol on its own stdin/stdout as
+analyze_image.py, so server.js can spawn either one.  Each request
+goes to the worker with the fewest outstanding requests; responses are
+relayed as they arrive (out of order, matched by "id").  Binary frame
+requests are passed on with their payload; shared-memory requests
+only by name (worker/transport.py).
+
+    MAD_WORKERS          worker processes (default cores // 4, at least 1)
+    MAD_WORKER_THREADS   torch / XGBoost / ONNX Runtime threads per
+                         worker (default cores // MAD_WORKERS), so the
+                         workers together do not oversubscribe the CPU
+
+Per-process state stays per process: the in-memory result cache,
+coalescing and the near-duplicate table only see the requests routed
+to their worker (set MAD_CACHE_DB to share cached results).
+{"cmd": "index_add"} always goes to the first worker, and its
+additions reach the other workers on their next start.
+{"cmd": "reload"} goes to every worker; each loads the new model set
+itself (bundled weights, ml/bundle.py, are still shared through the
+page cache), and a single answer is written once all of them are
+done, with each worker's answer under "workers".  The ONNX
+Runtime backend is loaded in each worker instead, since its sessions
+do not survive a fork, and MAD_STARTUP=background loads in full
+before forking for the same reason.  Without os.fork (Windows) this
+runs a single in-process worker.
+
+Usage:
+    python python-workers/supervisor.py
+"""
+
+import gc
+import os
+import sys
+import json
+import itertools
+import threading
+from collections import Counter
+
+import analyze_image as worker
+from worker.transport import iter_requests
+
+
+_WRITE_LOCK = threading.Lock()
+
+
+def workers_from_env() -> int:
+    cores = os.cpu_count() or 1
+    try:
+        return max(1, int(os.environ.get("MAD_WORKERS", max(1, cores // 4))))
+    except ValueError:
+        return max(1, cores // 4)
+
+
+def threads_from_env(n_workers: int) -> int:
+    default = max(1, (os.cpu_count() or 1) // n_workers)
+    try:
+        return max(1, int(os.environ.get("MAD_WORKER_THREADS", default)))
+    except ValueError:
+        return default
+
+
+def set_threads(threads: int, xgb_models=None):
+    """Cap the intra-op threads of this process's CNN and XGBoost runs."""
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        torch.set_num_threads(threads)
+    for head in (xgb_models or {}).values():
+        # XGBClassifier has a `booster` attribute too: its (None) param
+        if getattr(head, "booster", None) is not None:   # NativeHead
+            head.booster.set_param({"nthread": threads})
+        elif hasattr(head, "set_params"):                # pickled XGBClassifier
+            head.set_params(n_jobs=threads)
+
+
+def _write_line(line: str):
+    with _WRITE_LOCK:
+        sys.stdout.write(line if line.endswith("\n") else line + "\n")
+        sys.stdout.flush()
+
+
+# ─────────────────────────────────────────────────────────────────────
+# WORKER PROCESSES
+# ─────────────────────────────────────────────────────────────────────
+
+class WorkerProcess:
+    """Parent-side handle on one forked worker."""
+
+    def __init__(self, index, pid, request_fd, response_fd):
+        self.index     = index
+        self.pid       = pid
+        self.requests  = os.fdopen(request_fd, "wb")
+        self.responses = os.fdopen(response_fd, "r", encoding="utf-8")
+        self.pending   = Counter()      # request id → requests outstanding
+        self.load      = 0
+        self.alive     = True
+
+    def send(self, line: str, payload: bytes | None = None):
+        self.requests.write(line.encode("utf-8") + b"\n")
+        if payload is not None:
+            self.requests.write(payload)
+        self.requests.flush()
+
+
+def _fork_worker(index, models, model_version, threads, inherited_fds):
+    request_r,  request_w  = os.pipe()
+    response_r, response_w = os.pipe()
+    pid = os.fork()
+    if pid:
+        os.close(request_r)
+        os.close(response_w)
+        return WorkerProcess(index, pid, request_w, response_r)
+
+    # ── Child ────────────────────────────────────────────────────────
+    status = 1
+    try:
+        for fd in inherited_fds + [request_w, response_r]:
+            os.close(fd)
+        os.dup2(request_r, 0)
+        os.dup2(response_w, 1)
+        os.close(request_r)
+        os.close(response_w)
+        sys.stdin  = os.fdopen(0, "rb")
+        sys.stdout = os.fdopen(1, "w", encoding="utf-8")
+
+        if models is None and worker.STARTUP_MODE != "forensics":   # backend not fork-safe
+            models = worker.startup(announce=False, mode="full")
+        if models is not None:
+            set_threads(threads, models[1])
+        worker._write({**worker.ready_message(ml=models is not None), "pid": os.getpid()})
+
+        worker.serve(models, model_version=model_version, shared=True)
+        status = 0
+    except SystemExit as exc:
+        status = exc.code if isinstance(exc.code, int) else 1
+    except BaseException as exc:
+        sys.stderr.write(f"[supervisor] worker {index} failed: {exc}\n")
+    finally:
+        try:
+            sys.stdout.flush()
+        finally:
+            os._exit(status)
+
+
+# ─────────────────────────────────────────────────────────────────────
+# SUPERVISOR
+# ─────────────────────────────────────────────────────────────────────
+
+class Supervisor:
+    """Routes request lines to the least-loaded worker and relays answers."""
+
+    def __init__(self, workers):
+        self.workers  = workers
+        self._lock    = threading.Lock()
+        self._turn    = itertools.count()
+        self._closing = False
+        self._gather  = {}              # broadcast request id → answers so far
+        self._readers = [
+            threading.Thread(target=self._relay, args=(w,), name=f"relay-{w.index}", daemon=True)
+            for w in workers
+        ]
+
+    def serve(self, stream):
+        for reader in self._readers:
+            reader.start()
+        for line, payload in iter_requests(getattr(stream, "buffer", stream)):
+            self.route(line, payload)
+
+        self._closing = True
+        for w in self.workers:
+            if w.alive:
+                w.requests.close()
+        for reader in self._readers:
+            reader.join()
+        for w in self.workers:
+            os.waitpid(w.pid, 0)
+
+    def route(self, line: str, payload: bytes | None = None):
+        try:
+            req = json.loads(line)
+            req_id, cmd = req.get("id", "no-id"), req.get("cmd")
+        except (ValueError, AttributeError):
+            req_id, cmd = None, None      # the worker answers with the parse error
+
+        with self._lock:
+            if cmd == "reload":
+                targets = [w for w in self.workers if w.alive]
+                if targets:
+                    self._gather[req_id] = {"waiting": len(targets), "answers": []}
+            else:
+                target  = self._pick(cmd)
+                targets = [target] if target is not None else []
+            for target in targets:
+                target.pending[req_id] += 1
+                target.load += 1
+        if not targets:
+            _write_line(json.dumps({"id": req_id, "error": "No live worker process"}))
+            return
+        for target in targets:
+            try:
+                target.send(line, payload)
+            except OSError:
+                pass                       # its relay thread reports the exit
+
+    def _pick(self, cmd):
+        # Caller holds self._lock
+        if cmd == "index_add":
+            first = self.workers[0]
+            return first if first.alive else None
+        alive = [w for w in self.workers if w.alive]
+        if not alive:
+            return None
+        start = next(self._turn) % len(alive)        # rotate among equally idle workers
+        order = alive[start:] + alive[:start]
+        return min(order, key=lambda w: w.load)
+
+    def _relay(self, w: WorkerProcess):
+        for line in w.responses:
+            try:
+                req_id = json.loads(line).get("id")
+            except ValueError:
+                req_id = None
+            with self._lock:
+                if w.pending[req_id] > 0:
+                    w.pending[req_id] -= 1
+                    w.load -= 1
+            self._deliver(req_id, line)
+
+        # EOF: the worker exited — fail whatever it still owed
+        with self._lock:
+            w.alive = False
+            lost, w.pending = w.pending, Counter()
+            w.load = 0
+            all_gone = not any(other.alive for other in self.workers)
+        for req_id, count in lost.items():
+            for _ in range(count):
+                self._deliver(req_id, json.dumps({
+                    "id"   : req_id,
+                    "error": f"Worker process {w.pid} exited unexpectedly",
+                }))
+        if all_gone and not self._closing:
+            # Nothing left to serve: exit so server.js restarts the pool
+            sys.stderr.write("[supervisor] all worker processes exited\n")
+            os._exit(1)
+
+
+    def _deliver(self, req_id, line: str):
+        """Write a worker's answer, or hold it until a broadcast is complete."""
+        with self._lock:
+            gather = self._gather.get(req_id)
+            if gather is not None:
+                gather["answers"].append(line)
+                gather["waiting"] -= 1
+                if gather["waiting"]:
+                    return
+                del self._gather[req_id]
+        if gather is None:
+            _write_line(line)
+            return
+
+        answers = []
+        for answer in gather["answers"]:
+            msg = json.loads(answer)
+            msg.pop("id", None)
+            answers.append(msg)
+        errors = [a["error"] for a in answers if a.get("error")]
+        _write_line(json.dumps({
+            "id"           : req_id,
+            "error"        : errors[0] if errors else None,
+            "model_version": answers[0].get("model_version"),
+            "previous"     : answers[0].get("previous"),
+            "workers"      : answers,
+        }))
+
+
+def main():
+    n_workers = workers_from_env()
+    threads   = threads_from_env(n_workers)
+    os.environ.setdefault("MAD_XGB_THREADS",       str(threads))
+    os.environ.setdefault("MAD_ORT_INTRA_THREADS", str(threads))
+
+    if n_workers == 1 or not hasattr(os, "fork"):
+        if n_workers > 1:
+            sys.stderr.write("[supervisor] os.fork unavailable — running a single worker\n")
+        models = worker.startup()
+        if models is not None and not hasattr(models, "result"):
+            set_threads(threads, models[1])
+        worker.serve(models)
+        return
+
+    # ── Load once in the parent (except ONNX Runtime, see docstring) ──
+    # Always fully, before forking: a background loader thread would
+    # not survive the fork.
+    models, model_version = None, None
+    if worker.STARTUP_MODE != "forensics":
+        if not worker._ML_AVAILABLE:
+            worker.startup()                             # reports the error and exits
+        if worker.resolve_backend() != "onnx":
+            models = worker.startup(announce=False, mode="full")
+        model_version = worker.model_set_version()
+
+    # Keep the garbage collector from touching (and so copying) every
+    # object page the workers inherit.
+    gc.collect()
+    gc.freeze()
+
+    workers, inherited = [], []
+    for index in range(n_workers):
+        w = _fork_worker(index, models, model_version, threads, inherited)
+        workers.append(w)
+        inherited += [w.requests.fileno(), w.responses.fileno()]
+
+    # ── Wait for every worker's ready line ───────────────────────────
+    ready = None
+    for w in workers:
+        msg = json.loads(w.responses.readline() or '{"status": "error", "message": "worker exited"}')
+        if msg.get("status") != "ready":
+            _write_line(json.dumps(msg))
+            for other in workers:
+                other.requests.close()
+            sys.exit(1)
+        ready = ready or msg
+    ready.pop("pid", None)
+    _write_line(json.dumps({**ready, "workers": n_workers, "threads_per_worker": threads}))
+
+    Supervisor(workers).serve(sys.stdin)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,10 @@
  * Express server — port 8000 (matching your existing setup).
  * Spawns ONE Python worker process at startup and routes all
  * image-analysis requests through it via stdin/stdout JSON.
+ * MAD_TRANSPORT=frame|shm hands the worker the upload bytes directly
+ * instead of a file in uploads/.  SIGHUP makes the worker reload its
+ * model set (MAD_RELOAD_DIR, default its model directory) without
+ * dropping requests in flight.
  *
  * Endpoints:
  *   GET  /api/health         → { status, mlReady, forensicsAvailable }
@@ -22,18 +26,25 @@ const { spawn }    = require("child_process");
 const app  = express();
 const PORT = process.env.PORT || 8000;
 
+// ── How uploads reach the worker (MAD_TRANSPORT) ─────────────────────
+//   path  — written to UPLOAD_DIR, worker reads the file (default)
+//   frame — kept in memory, sent as raw bytes after the JSON line
+//   shm   — kept in memory, copied to a MAD_SHM_DIR (/dev/shm) segment
+const TRANSPORT = (process.env.MAD_TRANSPORT || "path").toLowerCase();
+const SHM_DIR   = process.env.MAD_SHM_DIR || "/dev/shm";
+
 // ── Upload temp directory ────────────────────────────────────────────
 const UPLOAD_DIR = path.join(__dirname, "uploads");
 fs.mkdirSync(UPLOAD_DIR, { recursive: true });
 
 // ── Multer — preserve file extension so PIL can identify it ─────────
-const storage = multer.diskStorage({
+const storage = TRANSPORT === "path" ? multer.diskStorage({
   destination: UPLOAD_DIR,
   filename: (_, file, cb) => {
     const ext = path.extname(file.originalname).toLowerCase() || ".jpg";
     cb(null, `upload-${Date.now()}-${Math.random().toString(36).slice(2)}${ext}`);
   },
-});
+}) : multer.memoryStorage();
 const upload = multer({
   storage,
   limits: { fileSize: 10 * 1024 * 1024 },   // 10 MB
@@ -66,7 +77,7 @@ class PythonWorker {
     this.forensicsReady   = false;
     this.pending          = new Map();   // id → { resolve, reject, timer }
     this.buffer           = "";
-    this.TIMEOUT_MS       = 90_000;     // 90 s — first request is slow (model load)
+    this.TIMEOUT_MS       = 90_000;     // 90 s — covers waiting on a MAD_STARTUP=background model load
   }
 
   /**
@@ -79,8 +90,10 @@ class PythonWorker {
       const pythonBin = this._findPython();
 
       // ── Worker script path ──────────────────────────────────────
+      // MAD_WORKERS set → pre-forking supervisor (same protocol)
       const workerScript = path.join(
-        __dirname, "python-workers", "analyze_image.py"
+        __dirname, "python-workers",
+        process.env.MAD_WORKERS ? "supervisor.py" : "analyze_image.py"
       );
 
       if (!fs.existsSync(workerScript)) {
@@ -138,7 +151,8 @@ class PythonWorker {
               this.forensicsReady = msg.forensics === true;
               this.proc.stdout.removeListener("data", readyHandler);
               console.log(
-                `[ML] Worker ready — forensics: ${this.forensicsReady}`
+                `[ML] Worker ready — ml: ${msg.ml}  forensics: ${this.forensicsReady}` +
+                `  startup: ${JSON.stringify(msg.startup || {})}`
               );
               resolve();
               return;
@@ -156,8 +170,8 @@ class PythonWorker {
     });
   }
 
-  /** Send one image path to the worker; returns a Promise of the result. */
-  analyze(imagePath) {
+  /** Send one uploaded file to the worker; returns a Promise of the result. */
+  analyze(file) {
     if (!this.ready) {
       return Promise.reject(new Error("ML worker is not ready"));
     }
@@ -170,10 +184,49 @@ class PythonWorker {
       }, this.TIMEOUT_MS);
 
       this.pending.set(id, { resolve, reject, timer });
-      this.proc.stdin.write(JSON.stringify({ id, image_path: imagePath }) + "\n");
+      this._send(id, file);
+    });
+  }
+
+  /**
+   * Hot-swap the worker's model set; resolves with the worker's answer
+   * ({ model_version, previous, ... }) once new requests use it.
+   */
+  reload(modelDir) {
+    if (!this.ready) {
+      return Promise.reject(new Error("ML worker is not ready"));
+    }
+
+    return new Promise((resolve, reject) => {
+      const id    = uuid();
+      const timer = setTimeout(() => {
+        this.pending.delete(id);
+        reject(new Error("ML worker reload timed out"));
+      }, this.TIMEOUT_MS);
+
+      this.pending.set(id, { resolve, reject, timer });
+      const req = { id, cmd: "reload" };
+      if (modelDir) req.model_dir = modelDir;
+      this.proc.stdin.write(JSON.stringify(req) + "\n");
     });
   }
 
+  /** Write one request in the configured transport. */
+  _send(id, file) {
+    if (TRANSPORT === "frame") {
+      // Header line + raw bytes; both writes queue in order
+      this.proc.stdin.write(JSON.stringify({ id, image_bytes: file.buffer.length }) + "\n");
+      this.proc.stdin.write(file.buffer);
+    } else if (TRANSPORT === "shm") {
+      const shm = `mad-${id}`;
+      fs.writeFileSync(path.join(SHM_DIR, shm), file.buffer);
+      file.shmPath = path.join(SHM_DIR, shm);
+      this.proc.stdin.write(JSON.stringify({ id, shm, size: file.buffer.length }) + "\n");
+    } else {
+      this.proc.stdin.write(JSON.stringify({ id, image_path: file.path }) + "\n");
+    }
+  }
+
   /** Parse stdout lines and resolve/reject matching pending requests. */
   _onData(chunk) {
     this.buffer += chunk;
@@ -190,6 +243,12 @@ class PythonWorker {
         continue;
       }
 
+      // MAD_STARTUP=background: models finished loading (or failed)
+      if (msg.status === "ml_ready" || msg.status === "ml_error") {
+        console.log(`[ML] ${msg.status}: ${msg.message || JSON.stringify(msg.startup)}`);
+        continue;
+      }
+
       const pending = this.pending.get(msg.id);
       if (!pending) continue;
 
@@ -249,20 +308,21 @@ async function handleAnalyze(req, res) {
     return res.status(400).json({ error: "No image file provided" });
   }
 
-  const tmpPath = req.file.path;
-
   try {
-    const mlResult = await worker.analyze(tmpPath);
+    const mlResult = await worker.analyze(req.file);
     const transformedResult = transformPythonResponse(mlResult, req.file);
     res.json(transformedResult);
   } catch (err) {
     console.error("[/api/analyze]", err.message);
     res.status(500).json({ error: err.message });
   } finally {
-    // Always delete the temp upload file
-    fs.unlink(tmpPath, (unlinkErr) => {
-      if (unlinkErr) console.warn("[cleanup]", unlinkErr.message);
-    });
+    // Always delete the temp upload file / shared-memory segment
+    const tmpPath = req.file.path || req.file.shmPath;
+    if (tmpPath) {
+      fs.unlink(tmpPath, (unlinkErr) => {
+        if (unlinkErr) console.warn("[cleanup]", unlinkErr.message);
+      });
+    }
   }
 }
 
@@ -338,6 +398,7 @@ function transformPythonResponse(pythonResult, file) {
       prediction: pythonResult.prediction,
       confidence: pythonResult.confidence,
       models_used: Object.keys(pythonResult.model_votes || {}),
+      model_version: pythonResult.model_version || null,
       features_extracted: 0,
     },
     timestamp: new Date().toISOString(),
@@ -348,6 +409,14 @@ function transformPythonResponse(pythonResult, file) {
 app.post("/api/analyze", upload.single("image"), handleAnalyze);
 app.post("/api/predict", upload.single("image"), handleAnalyze);   // alias
 
+// Reload the model set: kill -HUP <pid>
+process.on("SIGHUP", () => {
+  worker
+    .reload(process.env.MAD_RELOAD_DIR)
+    .then((msg) => console.log(`[ML] Model set ${msg.previous || "?"} → ${msg.model_version}`))
+    .catch((err) => console.error("[ML] Reload failed:", err.message));
+});
+
 // 404 fallback
 app.use((_, res) => res.status(404).json({ error: "Route not found" }));
 
@@ -0,0 +1,34 @@
+"""
+Worker Runtime Module
+
+Plumbing for the long-running Python analysis worker
+(python-workers/analyze_image.py):
+- Concurrent request dispatch over the stdin/stdout JSON protocol
+- Content-addressed result cache (memory LRU + optional SQLite)
+- In-flight coalescing of identical concurrent uploads
+- Perceptual-hash lookup of near-duplicate uploads
+- In-band binary frames and shared-memory image transfer
+- Start-up warm-up settings and synthetic input
+"""
+
+from .dispatcher import RequestDispatcher
+from .cache import ResultCache, cache_key
+from .coalesce import InFlightTable
+from .near_dup import NearDuplicateIndex, dhash
+from .transport import iter_requests, open_shm
+from .warmup import synthetic_receipt, warmup_from_env
+
+__all__ = [
+    'RequestDispatcher',
+    'ResultCache',
+    'cache_key',
+    'InFlightTable',
+    'NearDuplicateIndex',
+    'dhash',
+    'iter_requests',
+    'open_shm',
+    'synthetic_receipt',
+    'warmup_from_env',
+]
+
+__version__ = '1.0.0'
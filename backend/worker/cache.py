@@ -0,0 +1,146 @@
+"""
+backend/worker/cache.py
+=========================
+Content-addressed cache of finished analysis results.
+
+Reviewers and retrying clients resubmit the same receipt many times.
+Results are keyed by SHA-256 of the uploaded bytes plus the model-set
+version, so an identical file analysed by the same models is answered
+from the cache instead of running the CNNs and forensics again.
+
+Two tiers:
+    memory  bounded LRU (MAD_CACHE_SIZE entries, 0 disables)
+    disk    optional SQLite file (MAD_CACHE_DB) that survives restarts
+
+Only successful results are cached; request ids and timings are not
+part of the stored value.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+DEFAULT_MAX_ENTRIES = 1024
+
+
+def cache_key(content_sha256: str, model_version: str) -> str:
+    return f"{model_version}:{content_sha256}"
+
+
+class ResultCache:
+    """
+    Bounded in-memory LRU with an optional SQLite tier behind it.
+
+    Parameters
+    ----------
+    max_entries : int       — LRU capacity (0 turns the memory tier off)
+    db_path     : str|None  — SQLite file for the disk tier, or None
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, db_path: str | None = None):
+        self.max_entries = max(0, int(max_entries))
+        self.db_path     = db_path
+
+        self._lru  = OrderedDict()
+        self._lock = threading.Lock()
+        self._db   = None
+        if db_path:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " key TEXT PRIMARY KEY, body TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            self._db.commit()
+
+        self.counters = {
+            "memory_hits": 0,
+            "disk_hits"  : 0,
+            "misses"     : 0,
+            "stores"     : 0,
+        }
+
+    @classmethod
+    def from_env(cls) -> "ResultCache":
+        """Build a cache from MAD_CACHE_SIZE / MAD_CACHE_DB."""
+        try:
+            size = int(os.environ.get("MAD_CACHE_SIZE", DEFAULT_MAX_ENTRIES))
+        except ValueError:
+            size = DEFAULT_MAX_ENTRIES
+        return cls(max_entries=size, db_path=os.environ.get("MAD_CACHE_DB") or None)
+
+    # ── Lookup / store ───────────────────────────────────────────────
+
+    def get(self, key: str, record: bool = True):
+        """
+        Return (result, tier) for a cached key, or (None, None).
+
+        `tier` is "memory" or "disk".  The result is a fresh dict each
+        time, so callers may add request-specific fields to it.
+        `record=False` leaves the hit/miss counters alone (lookups on
+        behalf of another request, e.g. a near-duplicate's result).
+        """
+        with self._lock:
+            body = self._lru.get(key)
+            if body is not None:
+                self._lru.move_to_end(key)
+                self.counters["memory_hits"] += record
+                return json.loads(body), "memory"
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT body FROM results WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    self._remember(key, row[0])
+                    self.counters["disk_hits"] += record
+                    return json.loads(row[0]), "disk"
+
+            self.counters["misses"] += record
+            return None, None
+
+    def put(self, key: str, result: dict):
+        body = json.dumps(result)
+        with self._lock:
+            self._remember(key, body)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO results (key, body, created) VALUES (?, ?, ?)",
+                    (key, body, time.time()),
+                )
+                self._db.commit()
+            self.counters["stores"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = sum(self.counters[k] for k in ("memory_hits", "disk_hits", "misses"))
+            hits    = self.counters["memory_hits"] + self.counters["disk_hits"]
+            return {
+                **self.counters,
+                "entries"    : len(self._lru),
+                "max_entries": self.max_entries,
+                "disk"       : self.db_path,
+                "hit_rate"   : round(hits / lookups, 4) if lookups else None,
+            }
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    # ── Helpers ──────────────────────────────────────────────────────
+
+    def _remember(self, key, body):
+        # Caller holds self._lock
+        if self.max_entries == 0:
+            return
+        self._lru[key] = body
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
@@ -0,0 +1,69 @@
+"""
+backend/worker/coalesce.py
+============================
+In-flight request coalescing for identical uploads.
+
+Double-clicks and client retries (server.js gives up after 90 s and the
+user tries again) send the same image while the first analysis is
+still running.  The first request for a key becomes the leader and does
+the work; duplicates that arrive before it finishes attach to the
+leader's Future and receive the same result instead of starting a
+second ensemble run.
+
+    future, leader = inflight.claim(key)
+    if leader:
+        try:
+            result = compute()
+            inflight.resolve(key, result)
+        except Exception as exc:
+            inflight.fail(key, exc)
+            raise
+    else:
+        result = future.result()
+"""
+
+import threading
+from concurrent.futures import Future
+
+
+class InFlightTable:
+    """Maps content keys to the Future of the computation running for them."""
+
+    def __init__(self):
+        self._running = {}
+        self._lock    = threading.Lock()
+        self.coalesced = 0
+
+    def claim(self, key: str):
+        """
+        Return (future, is_leader).
+
+        The leader must call resolve() or fail() exactly once; everyone
+        else just waits on the returned future.
+        """
+        with self._lock:
+            future = self._running.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = Future()
+            self._running[key] = future
+            return future, True
+
+    def resolve(self, key: str, result):
+        future = self._pop(key)
+        if future is not None:
+            future.set_result(result)
+
+    def fail(self, key: str, exc: BaseException):
+        future = self._pop(key)
+        if future is not None:
+            future.set_exception(exc)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"in_flight": len(self._running), "coalesced": self.coalesced}
+
+    def _pop(self, key):
+        with self._lock:
+            return self._running.pop(key, None)
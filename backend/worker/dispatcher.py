@@ -0,0 +1,71 @@
+"""
+backend/worker/dispatcher.py
+==============================
+Concurrent request dispatcher for the stdin/stdout JSON worker.
+
+The worker used to read one line, handle it completely, write the
+answer and only then read the next line, so a single slow image held
+up everything queued behind it.  RequestDispatcher keeps reading stdin
+and hands each line to a thread pool; responses are written as soon as
+they are ready (out of order, matched by their "id" in server.js).
+
+Stdout writes must go through one lock so JSON lines never interleave —
+see analyze_image._write().  Requests may carry their image as a binary
+frame after the JSON line (worker/transport.py); the frame is read here
+and handed to the handler with its line.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from .transport import iter_requests
+
+
+DEFAULT_CONCURRENCY = min(4, os.cpu_count() or 1)
+
+
+def concurrency_from_env() -> int:
+    """Read MAD_WORKER_CONCURRENCY, falling back to DEFAULT_CONCURRENCY."""
+    try:
+        return max(1, int(os.environ.get("MAD_WORKER_CONCURRENCY", DEFAULT_CONCURRENCY)))
+    except ValueError:
+        return DEFAULT_CONCURRENCY
+
+
+class RequestDispatcher:
+    """
+    Runs `handler(line)` for each input line on a bounded thread pool.
+
+    Parameters
+    ----------
+    handler         : callable(str[, bytes]) — handles one request line
+                                       (plus its frame payload, if any)
+                                       and writes its own response
+    max_concurrency : int           — requests processed at the same time
+    """
+
+    def __init__(self, handler, max_concurrency: int = DEFAULT_CONCURRENCY):
+        self.handler         = handler
+        self.max_concurrency = max(1, int(max_concurrency))
+        self._pool = ThreadPoolExecutor(
+            max_workers=self.max_concurrency,
+            thread_name_prefix="request",
+        )
+
+    def dispatch(self, line: str, payload: bytes | None = None):
+        """Queue one request line; returns immediately."""
+        if payload is None:
+            return self._pool.submit(self.handler, line)
+        return self._pool.submit(self.handler, line, payload)
+
+    def serve(self, stream):
+        """
+        Read requests from `stream` (binary, or a text stream's buffer)
+        until EOF, then wait for every queued request to finish before
+        returning.
+        """
+        try:
+            for line, payload in iter_requests(getattr(stream, "buffer", stream)):
+                self.dispatch(line, payload)
+        finally:
+            self._pool.shutdown(wait=True)
@@ -0,0 +1,176 @@
+"""
+backend/worker/near_dup.py
+============================
+Perceptual-hash lookup of near-duplicate uploads.
+
+The result cache only catches byte-identical files.  Receipts also come
+back as re-screenshots, re-compressions and resized copies of an image
+that was already judged; their bytes differ but a 64-bit difference
+hash (dHash) of a tiny grayscale thumbnail barely changes.  Each
+analysed image's hash is recorded with its SHA-256, and a new upload
+whose hash is within `max_distance` bits of a recorded one is reported
+as a near-duplicate of it.
+
+Modes (MAD_NEARDUP):
+    off           no hashing (default)
+    report        analyse as usual, add "near_duplicate" with the
+                  stored verdict of the closest match
+    shortcircuit  answer with the match's cached result (ML *and*
+                  forensics of the earlier file) without running
+                  anything; needs the match to still be in the
+                  ResultCache, otherwise falls back to report
+
+Receipts printed from the same template can hash close together, so
+keep MAD_NEARDUP_DISTANCE small (default 4 of 64 bits) and check the
+matches "report" produces before turning on "shortcircuit".
+
+Lookup is a multi-index hash table: the hash is cut into
+max_distance + 1 bands, and any hash within max_distance bits must
+agree exactly on at least one band (pigeonhole), so a query only
+compares against the entries sharing a band value (about 0.1 ms per
+lookup at a million entries).  Hashes survive restarts in an append-only file
+(MAD_NEARDUP_FILE, 40-byte rows: hash + SHA-256).
+"""
+
+import os
+import threading
+
+import numpy as np
+from PIL import Image
+
+
+MODES                = ("off", "report", "shortcircuit")
+HASH_BITS            = 64
+DEFAULT_MAX_DISTANCE = 4
+
+# The thumbnail comes from the same reduced-resolution decode the CNN
+# preprocessing uses (ImageContext.draft_rgb), so hashing adds no decode
+# of its own on the normal path.
+DECODE_SIZE = (224, 224)
+
+_ROW_BYTES = 8 + 32
+
+
+def dhash(image) -> int:
+    """64-bit difference hash of an ImageContext or PIL image."""
+    img = image.draft_rgb(DECODE_SIZE) if hasattr(image, "draft_rgb") else image
+    small = np.asarray(img.convert("L").resize((9, 8), Image.BOX), dtype=np.int16)
+    bits  = (small[:, 1:] > small[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+class NearDuplicateIndex:
+    """
+    Multi-index hash table of {dHash: SHA-256}.
+
+    Parameters
+    ----------
+    mode         : str       — "report" or "shortcircuit" (see module doc)
+    max_distance : int       — largest Hamming distance that still matches
+    path         : str|None  — append-only file for persistence
+    """
+
+    def __init__(self, mode: str = "report", max_distance: int = DEFAULT_MAX_DISTANCE,
+                 path: str | None = None):
+        if mode not in MODES or mode == "off":
+            raise ValueError(f"mode must be 'report' or 'shortcircuit', got {mode!r}")
+        self.mode         = mode
+        self.max_distance = max(0, min(int(max_distance), HASH_BITS // 2))
+        self.path         = path
+
+        # (shift, mask) of each band, covering all 64 bits
+        n_bands     = self.max_distance + 1
+        edges       = [round(i * HASH_BITS / n_bands) for i in range(n_bands + 1)]
+        self._bands = [(lo, (1 << (hi - lo)) - 1) for lo, hi in zip(edges, edges[1:])]
+        self._tables = [{} for _ in self._bands]
+        self._shas   = {}
+        self._lock   = threading.Lock()
+        self._file   = None
+
+        self.counters = {"lookups": 0, "matches": 0, "added": 0}
+
+        if path and os.path.exists(path):
+            self._load(path)
+
+    @classmethod
+    def from_env(cls):
+        """Index for MAD_NEARDUP / MAD_NEARDUP_DISTANCE / MAD_NEARDUP_FILE, or None when off."""
+        mode = os.environ.get("MAD_NEARDUP", "off").strip().lower()
+        if mode in ("", "off", "0"):
+            return None
+        try:
+            distance = int(os.environ.get("MAD_NEARDUP_DISTANCE", DEFAULT_MAX_DISTANCE))
+        except ValueError:
+            distance = DEFAULT_MAX_DISTANCE
+        return cls(mode, distance, os.environ.get("MAD_NEARDUP_FILE") or None)
+
+    # ── Lookup / insert ──────────────────────────────────────────────
+
+    def lookup(self, h: int, exclude: str | None = None):
+        """
+        (sha256, distance) of the closest recorded hash within range, or
+        None.  Entries recorded for `exclude` (the upload's own SHA-256)
+        are skipped.
+        """
+        with self._lock:
+            self.counters["lookups"] += 1
+            best = None
+            for (shift, mask), table in zip(self._bands, self._tables):
+                for other in table.get((h >> shift) & mask, ()):
+                    d = (h ^ other).bit_count()
+                    if d > self.max_distance or self._shas[other] == exclude:
+                        continue
+                    if best is None or d < best[1]:
+                        best = (other, d)
+            if best is None:
+                return None
+            self.counters["matches"] += 1
+            return self._shas[best[0]], best[1]
+
+    def add(self, h: int, sha256_hex: str):
+        """Record an analysed image; the first image seen for a hash wins."""
+        with self._lock:
+            if h in self._shas:
+                return
+            self._insert(h, sha256_hex)
+            self.counters["added"] += 1
+            if self.path:
+                if self._file is None:
+                    self._file = open(self.path, "ab")
+                self._file.write(h.to_bytes(8, "big") + bytes.fromhex(sha256_hex))
+                self._file.flush()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self.counters,
+                "mode"        : self.mode,
+                "entries"     : len(self._shas),
+                "max_distance": self.max_distance,
+            }
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    # ── Helpers ──────────────────────────────────────────────────────
+
+    def _insert(self, h, sha256_hex):
+        # Caller holds self._lock (or is still in __init__)
+        self._shas[h] = sha256_hex
+        for (shift, mask), table in zip(self._bands, self._tables):
+            table.setdefault((h >> shift) & mask, []).append(h)
+
+    def _load(self, path):
+        with open(path, "rb") as f:
+            raw = f.read()
+        rows = len(raw) // _ROW_BYTES
+        for i in range(rows):
+            row = raw[i * _ROW_BYTES:(i + 1) * _ROW_BYTES]
+            h   = int.from_bytes(row[:8], "big")
+            if h not in self._shas:
+                self._insert(h, row[8:].hex())
+        if len(raw) > rows * _ROW_BYTES:                # torn last row
+            os.truncate(path, rows * _ROW_BYTES)
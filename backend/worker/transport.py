@@ -0,0 +1,93 @@
+"""
+backend/worker/transport.py
+=============================
+Ways for a request to hand the worker its image bytes.
+
+    path    {"id": ..., "image_path": "/abs/upload.jpg"}
+            the original protocol: server.js writes the upload to disk,
+            the worker reads it back
+    frame   {"id": ..., "image_bytes": N}\\n followed by exactly N raw
+            bytes on stdin, then the next request line
+    shm     {"id": ..., "shm": "mad-<uuid>", "size": N}
+            the bytes are in a shared-memory segment (a file under
+            MAD_SHM_DIR, default /dev/shm); the worker maps it
+            read-only and decodes straight from the mapping.  The
+            sender owns the segment and unlinks it once answered.
+
+Frames and shm segments skip the disk write, fsync, read and unlink
+that every path request costs.  Both end up as an ImageContext over
+the bytes without another copy (see df/image_context.py).
+"""
+
+import os
+import re
+import json
+import mmap
+
+
+DEFAULT_SHM_DIR = "/dev/shm"
+
+_SHM_NAME  = re.compile(r"^[A-Za-z0-9._-]+$")
+_FRAME_KEY = b'"image_bytes"'
+
+
+def iter_requests(stream):
+    """
+    Yield (line, payload) from a binary request stream until EOF.
+
+    `payload` is the bytes of a frame request and None otherwise.  A
+    frame cut short by EOF ends the stream.
+    """
+    while True:
+        raw = stream.readline()
+        if not raw:
+            return
+        line = raw.decode("utf-8", errors="replace").strip()
+        if not line:
+            continue
+
+        size = _frame_size(raw) if _FRAME_KEY in raw else None
+        if size is None:
+            yield line, None
+            continue
+
+        payload = _read_exactly(stream, size)
+        if payload is None:
+            return
+        yield line, payload
+
+
+def open_shm(name: str, size: int, directory: str | None = None):
+    """Read-only mmap of `size` bytes of the shared-memory segment `name`."""
+    if not isinstance(name, str) or not _SHM_NAME.match(name):
+        raise ValueError(f"Invalid shared-memory segment name: {name!r}")
+    size = int(size)
+    if size <= 0:
+        raise ValueError(f"Invalid shared-memory segment size: {size}")
+
+    directory = directory or os.environ.get("MAD_SHM_DIR", DEFAULT_SHM_DIR)
+    path = os.path.join(directory, name)
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"Shared-memory segment not found: {path}")
+    with open(path, "rb") as f:
+        # The mapping stays valid after the file is closed (and unlinked)
+        return mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+
+
+def _frame_size(raw: bytes):
+    try:
+        size = json.loads(raw).get("image_bytes")
+    except (ValueError, AttributeError):
+        return None
+    return size if isinstance(size, int) and size >= 0 else None
+
+
+def _read_exactly(stream, size: int):
+    chunks, remaining = [], size
+    while remaining:
+        chunk = stream.read(remaining)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return chunks[0] if len(chunks) == 1 else b"".join(chunks)